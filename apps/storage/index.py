@@ -1,18 +1,46 @@
 
 
 from zoom import *
+import zoom.catalog
 
 index_query = "select distinct kind from storage_entities union select distinct kind from entities"
+legacy_query = "select distinct kind from storage_entities"
+
+
+def catalogued(name):
+    """the catalog entry of an entity kind, if there is one"""
+    if zoom.catalog.entries(system.db) is None:
+        return None
+    if name in [rec.kind for rec in zoom.catalog.kinds(system.db)]:
+        return store(name).catalog
 
 
 class IndexView(View):
 
     def index(self,**k):
-        entities = '<br>'.join([link_to(rec.kind,rec.kind,'browse') for rec in db(index_query)])
+        kinds = []
+        if zoom.catalog.entries(system.db) is not None:
+            kinds = zoom.catalog.kinds(system.db)
+            if not kinds and zoom.catalog.build(system.db):
+                kinds = zoom.catalog.kinds(system.db)
+        if kinds:
+            names = set(rec.kind for rec in kinds)
+            legacy = [rec.kind for rec in db(legacy_query) if rec.kind not in names]
+            items = [(link_to(rec.kind,rec.kind,'browse'), rec.entities, rec.updated) for rec in kinds]
+            items += [(link_to(kind,kind,'browse'), '', '') for kind in legacy]
+            entities = browse(items, labels=['Kind','Entities','Updated'])
+        else:
+            entities = '<br>'.join([link_to(rec.kind,rec.kind,'browse') for rec in db(index_query)])
         return Page('<H1>Storage</H1><H3>Entities</H3><br>%s' % entities)
         
     def show(self, name):
         system.app.menu = (('index','Entities',''), ('show','Browse Data',name+'/browse'))
+        entry = catalogued(name)
+        if entry is not None and len(entry):
+            labels = ['Attribute','Datatypes','Drop']
+            datatypes = entry.datatypes()
+            items = [(attribute,', '.join(datatypes[attribute]),link_to('drop',name,'drop',item=attribute)) for attribute in sorted(datatypes)]
+            return page(browse(items,labels=labels), title=name)
         labels = ['Attribute','Frequecy','Drop']
         items = db('select distinct attribute, count(*) as count from attributes where kind=%s group by 1 order by count, attribute',name)
         if not items:
@@ -45,16 +73,22 @@ class IndexView(View):
             footer_name = 'records'
         footer = '%s %s' % (len(items), footer_name)
 
-        a = db('select distinct attribute, count(*) as count from attributes where kind=%s group by 1 order by count, attribute',name)
-        if not a:
-            a = db('select distinct attribute, count(*) as count from storage_values where kind=%s group by 1 order by count, attribute',name)
-        attributes = [i.attribute for i in a] + ['actions']
+        entry = catalogued(name)
+        if entry is not None and len(entry):
+            attributes = sorted(entry.attributes()) + ['actions']
+        else:
+            a = db('select distinct attribute, count(*) as count from attributes where kind=%s group by 1 order by count, attribute',name)
+            if not a:
+                a = db('select distinct attribute, count(*) as count from storage_values where kind=%s group by 1 order by count, attribute',name)
+            attributes = [i.attribute for i in a] + ['actions']
 
         return page(browse(items, columns=attributes, footer=footer), title='Entity: '+name)
 
     def drop(self,name,item):
         db('delete from storage_values where kind=%s and attribute=%s',name,item)
         db('delete from attributes where kind=%s and attribute=%s',name,item)
+        if catalogued(name) is not None:
+            zoom.catalog.rebuild(system.db, name)
         return redirect_to('/storage/'+name)
         
 class IndexController(Controller):
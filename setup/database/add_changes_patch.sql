@@ -0,0 +1,23 @@
+--
+-- Table structure for table `changes`
+--
+create table changes (
+    seq       int not null auto_increment,
+    kind      varchar(100),
+    row_id    int,
+    operation varchar(10),
+    attributes text,
+    changed   datetime,
+    PRIMARY KEY (seq),
+    KEY `kind_key` (`kind`, `seq`)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
+
+--
+-- Table structure for table `change_cursors`
+--
+create table change_cursors (
+    name      varchar(100) NOT NULL,
+    seq       int not null default 0,
+    updated   datetime,
+    PRIMARY KEY (name)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
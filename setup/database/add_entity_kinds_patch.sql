@@ -0,0 +1,21 @@
+--
+-- Table structure for table `entity_kinds`
+--
+create table entity_kinds (
+    kind      varchar(100) NOT NULL,
+    entities  int not null default 0,
+    updated   datetime,
+    PRIMARY KEY (kind)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
+
+--
+-- Table structure for table `entity_kind_attributes`
+--
+create table entity_kind_attributes (
+    id int not null auto_increment,
+    kind      varchar(100) NOT NULL,
+    attribute varchar(100) NOT NULL,
+    datatype  varchar(30) NOT NULL,
+    PRIMARY KEY (id),
+    UNIQUE KEY `attribute_key` (`kind`, `attribute`, `datatype`)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
@@ -0,0 +1,9 @@
+--
+-- Table structure for table `entity_partitions`
+--
+create table entity_partitions (
+    kind             varchar(100) NOT NULL,
+    entities_table   varchar(100),
+    attributes_table varchar(100),
+    PRIMARY KEY (kind)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
@@ -0,0 +1,10 @@
+--
+-- Table structure for table `materialized_kinds`
+--
+create table materialized_kinds (
+    kind       varchar(100) NOT NULL,
+    state      varchar(10),
+    table_name varchar(100),
+    columns    text,
+    PRIMARY KEY (kind)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
@@ -0,0 +1,36 @@
+--
+-- Table structure for table `messages`
+--
+create table messages (
+    id         int not null auto_increment,
+    topic      varchar(100),
+    status     varchar(10) not null default 'ready',
+    visible_at datetime,
+    attempts   int not null default 0,
+    claimant   varchar(32),
+    node       varchar(100),
+    created    datetime,
+    payload    longtext,
+    PRIMARY KEY (id),
+    KEY `topic_key` (`topic`, `status`, `id`),
+    KEY `status_key` (`status`, `id`),
+    KEY `claimant_key` (`claimant`)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
+
+--
+-- Move the messages waiting in the entity tables
+--
+insert into messages (topic, status, visible_at, attempts, node, created, payload)
+select t.value, 'ready', now(), 0, n.value, c.value, b.value
+from attributes t
+join attributes b
+    on b.kind=t.kind and b.row_id=t.row_id and b.attribute='body'
+left join attributes n
+    on n.kind=t.kind and n.row_id=t.row_id and n.attribute='node'
+left join attributes c
+    on c.kind=t.kind and c.row_id=t.row_id and c.attribute='timestamp'
+where t.kind='system_message' and t.attribute='topic'
+order by t.row_id;
+
+delete from attributes where kind='system_message';
+delete from entities where kind='system_message';
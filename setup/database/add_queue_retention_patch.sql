@@ -0,0 +1,9 @@
+--
+-- Table structure for table `queue_retention`
+--
+create table queue_retention (
+    topic     varchar(100) not null,
+    max_age   int,
+    max_count int,
+    PRIMARY KEY (topic)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
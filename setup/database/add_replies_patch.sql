@@ -0,0 +1,9 @@
+--
+-- Table structure for table `replies`
+--
+create table replies (
+    correlation_id int not null,
+    payload        longtext,
+    created        datetime,
+    PRIMARY KEY (correlation_id)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
@@ -0,0 +1,14 @@
+
+--
+-- Table structure for table `search_terms`
+--
+create table search_terms (
+    id int not null auto_increment,
+    kind      varchar(100) NOT NULL,
+    row_id    int not null,
+    term      varchar(50),
+    hits      int,
+    PRIMARY KEY (id),
+    KEY `term_key` (`kind`, `term`),
+    KEY `row_id_key` (`kind`, `row_id`)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
@@ -0,0 +1,8 @@
+--
+-- Table structure for table `store_versions`
+--
+create table store_versions (
+    name    varchar(100) NOT NULL,
+    version int NOT NULL default 0,
+    PRIMARY KEY (name)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
@@ -0,0 +1,16 @@
+
+--
+-- Table structure for table `typed_attributes`
+--
+create table typed_attributes (
+    id int not null auto_increment,
+    kind      varchar(100) NOT NULL,
+    row_id    int not null,
+    attribute varchar(100),
+    number    double,
+    moment    datetime,
+    PRIMARY KEY (id),
+    KEY `row_id_key` (`row_id`),
+    KEY `number_key` (`kind`, `attribute`, `number`),
+    KEY `moment_key` (`kind`, `attribute`, `moment`)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
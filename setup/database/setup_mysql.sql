@@ -99,6 +99,163 @@ create table if not exists attributes (
     KEY `kv` (`kind`, `attribute`, `value`(100))
     ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
 
+--
+-- Table structure for table `search_terms`
+--
+drop table if exists search_terms;
+create table if not exists search_terms (
+    id int not null auto_increment,
+    kind      varchar(100) NOT NULL,
+    row_id    int not null,
+    term      varchar(50),
+    hits      int,
+    PRIMARY KEY (id),
+    KEY `term_key` (`kind`, `term`),
+    KEY `row_id_key` (`kind`, `row_id`)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
+
+--
+-- Table structure for table `typed_attributes`
+--
+drop table if exists typed_attributes;
+create table if not exists typed_attributes (
+    id int not null auto_increment,
+    kind      varchar(100) NOT NULL,
+    row_id    int not null,
+    attribute varchar(100),
+    number    double,
+    moment    datetime,
+    PRIMARY KEY (id),
+    KEY `row_id_key` (`row_id`),
+    KEY `number_key` (`kind`, `attribute`, `number`),
+    KEY `moment_key` (`kind`, `attribute`, `moment`)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
+
+--
+-- Table structure for table `materialized_kinds`
+--
+drop table if exists materialized_kinds;
+create table if not exists materialized_kinds (
+    kind       varchar(100) NOT NULL,
+    state      varchar(10),
+    table_name varchar(100),
+    columns    text,
+    PRIMARY KEY (kind)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
+
+--
+-- Table structure for table `store_versions`
+--
+drop table if exists store_versions;
+create table if not exists store_versions (
+    name    varchar(100) NOT NULL,
+    version int NOT NULL default 0,
+    PRIMARY KEY (name)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
+
+--
+-- Table structure for table `entity_kinds`
+--
+drop table if exists entity_kinds;
+create table if not exists entity_kinds (
+    kind      varchar(100) NOT NULL,
+    entities  int not null default 0,
+    updated   datetime,
+    PRIMARY KEY (kind)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
+
+--
+-- Table structure for table `entity_kind_attributes`
+--
+drop table if exists entity_kind_attributes;
+create table if not exists entity_kind_attributes (
+    id int not null auto_increment,
+    kind      varchar(100) NOT NULL,
+    attribute varchar(100) NOT NULL,
+    datatype  varchar(30) NOT NULL,
+    PRIMARY KEY (id),
+    UNIQUE KEY `attribute_key` (`kind`, `attribute`, `datatype`)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
+
+--
+-- Table structure for table `changes`
+--
+drop table if exists changes;
+create table if not exists changes (
+    seq       int not null auto_increment,
+    kind      varchar(100),
+    row_id    int,
+    operation varchar(10),
+    attributes text,
+    changed   datetime,
+    PRIMARY KEY (seq),
+    KEY `kind_key` (`kind`, `seq`)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
+
+--
+-- Table structure for table `change_cursors`
+--
+drop table if exists change_cursors;
+create table if not exists change_cursors (
+    name      varchar(100) NOT NULL,
+    seq       int not null default 0,
+    updated   datetime,
+    PRIMARY KEY (name)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
+
+--
+-- Table structure for table `entity_partitions`
+--
+drop table if exists entity_partitions;
+create table if not exists entity_partitions (
+    kind             varchar(100) NOT NULL,
+    entities_table   varchar(100),
+    attributes_table varchar(100),
+    PRIMARY KEY (kind)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
+
+--
+-- Table structure for table `messages`
+--
+drop table if exists messages;
+create table if not exists messages (
+    id         int not null auto_increment,
+    topic      varchar(100),
+    status     varchar(10) not null default 'ready',
+    visible_at datetime,
+    attempts   int not null default 0,
+    claimant   varchar(32),
+    node       varchar(100),
+    created    datetime,
+    payload    longtext,
+    PRIMARY KEY (id),
+    KEY `topic_key` (`topic`, `status`, `id`),
+    KEY `status_key` (`status`, `id`),
+    KEY `claimant_key` (`claimant`)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
+
+--
+-- Table structure for table `replies`
+--
+drop table if exists replies;
+create table if not exists replies (
+    correlation_id int not null,
+    payload        longtext,
+    created        datetime,
+    PRIMARY KEY (correlation_id)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
+
+--
+-- Table structure for table `queue_retention`
+--
+drop table if exists queue_retention;
+create table if not exists queue_retention (
+    topic     varchar(100) not null,
+    max_age   int,
+    max_count int,
+    PRIMARY KEY (topic)
+    ) ENGINE=MyISAM DEFAULT CHARSET=utf8;
+
 --
 -- Table structure for table `dz_groups`
 --
@@ -0,0 +1,316 @@
+"""
+    test_queues.py
+
+    Test the queues module
+"""
+
+from zoom.db import Database
+from zoom.notifiers import LocalNotifier, SocketNotifier
+from zoom.queues import (
+    Queues, StopHandling, WaitException, START, gather, reply)
+
+import MySQLdb
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime
+
+
+class Handler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestQueues(unittest.TestCase):
+
+    def setUp(self):
+        self.db = self.connect()
+        self.queues = Queues(self.db)
+
+    def connect(self):
+        db = Database(
+            MySQLdb.Connect,
+            host='database',
+            user='testuser',
+            passwd='password',
+            db='test',
+        )
+        db.autocommit(1)
+        return db
+
+    def tearDown(self):
+        self.db(
+            'delete from replies where correlation_id in '
+            '(select id from messages where topic like %s)', 'test.%')
+        self.db('delete from messages where topic like %s', 'test.%')
+        self.db.close()
+
+    def test_topic_start(self):
+        self.queues.topic('test.jobs').send('one', 'two')
+        self.assertEqual(self.queues.topic('test.jobs').pop(), None)
+        jobs = self.queues.topic('test.jobs')
+        jobs.put('three')
+        self.assertEqual(jobs.pop(), 'three')
+        self.assertEqual(self.queues.topic('test.jobs', 0).pop(), None)
+        everything = self.queues.topic('test.jobs', START)
+        self.assertEqual(everything.peek_many(5), ['one', 'two'])
+        first = everything.last() - 1
+        self.assertEqual(
+            self.queues.topic('test.jobs', first).pop(), 'two')
+
+    def test_pop(self):
+        a, b = self.queues.topic('test.jobs'), self.queues.topic('test.jobs')
+        ids = a.send('one', 'two', 'three')
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(a.len(), 3)
+        self.assertEqual([b.pop(), a.pop(), b.pop()], ['one', 'two', 'three'])
+        self.assertEqual((a.pop(), a.len()), (None, 0))
+        self.assertEqual(
+            list(self.db('select count(*) from messages where topic=%s',
+                         'test.jobs'))[0][0], 0)
+
+    def test_messages_patch(self):
+        from zoom.store import EntityStore
+        old = EntityStore(self.db, 'system_message')
+        self.addCleanup(old.zap)
+        for body in ['"one"', '{"n": 2}']:
+            old.put(dict(topic='test.old', node='web', body=body,
+                         timestamp=datetime(2017, 1, 2, 3, 4, 5)))
+        path = os.path.join(
+            os.path.dirname(__file__), '..', '..',
+            'setup', 'database', 'add_messages_patch.sql')
+        for statement in open(path).read().split(';'):
+            if statement.strip() and 'create table' not in statement:
+                self.db(statement)
+        self.assertEqual(len(old), 0)
+        topic = self.queues.topic('test.old', START)
+        self.assertEqual(topic.pop_many(5), ['one', {'n': 2}])
+
+    def test_notifiers(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        for notifier in [LocalNotifier(), SocketNotifier(path)]:
+            received = []
+            ready = threading.Event()
+
+            def consume():
+                db = self.connect()
+                jobs = Queues(db, notifier).topic('test.jobs')
+                ready.set()
+
+                def stop(message):
+                    received.append(message)
+                    raise StopHandling
+
+                jobs.handle(stop, timeout=10, delay=5)
+                db.close()
+
+            consumer = threading.Thread(target=consume)
+            consumer.start()
+            ready.wait()
+            time.sleep(0.2)
+            start = time.time()
+            Queues(self.db, notifier).topic('test.jobs').put('wake')
+            consumer.join()
+            self.assertEqual(received, ['wake'])
+            self.assertTrue(time.time() - start < 2)
+            self.assertEqual(os.listdir(path), [])
+
+    def test_batches(self):
+        jobs = self.queues.topic('test.jobs')
+        ids = jobs.send(*range(5))
+        self.db.debug = True
+        self.assertEqual(jobs.peek_many(10), range(5))
+        self.assertEqual(jobs.pop_many(3), [0, 1, 2])
+        self.db.debug = False
+        self.assertEqual(len(self.db.log), 4)
+        batches = []
+
+        def double(batch):
+            batches.append(batch)
+            return [n * 2 for n in batch]
+
+        self.assertEqual(jobs.handle(double, timeout=0.1, batch_size=5), 2)
+        self.assertEqual(batches, [[3, 4]])
+        self.assertEqual(jobs.join(ids[3:]), [6, 8])
+        self.assertEqual(jobs.pop_many(3), [])
+
+    def test_claims(self):
+        jobs = self.queues.topic('test.jobs', START)
+        jobs.send('one', 'two')
+        one, = jobs.claim(timeout=0)
+        self.assertEqual((one.message, one.attempts), ('one', 1))
+        two, = jobs.claim(timeout=60)
+        self.assertEqual(jobs.claim(), [])
+        self.assertEqual(jobs.redeliver(), 1)
+        one, = jobs.claim()
+        self.assertEqual((one.message, one.attempts), ('one', 2))
+        jobs.retry(one, delay=60)
+        self.assertEqual(jobs.claim(), [])
+        jobs.retry(two)
+        two, = jobs.claim()
+        self.assertEqual((two.message, two.attempts), ('two', 2))
+        jobs.dead_letter(two)
+        self.assertEqual(jobs.acknowledge(two), 0)
+        self.assertEqual(
+            self.queues.topic('test.jobs.dead', START).pop(), 'two')
+
+    def test_pool(self):
+        from zoom.workers import Pool
+        handler = Handler()
+        logger = logging.getLogger('zoom.workers')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        jobs = self.queues.topic('test.jobs')
+        ids = jobs.send(2, 0, 5)
+        pool = Pool(self.connect, 'test.jobs', lambda n: 10 / n,
+                    max_attempts=3, retry_delay=0)
+        self.assertEqual(pool.work(self.db, timeout=0.2), 2)
+        self.assertEqual(self.queues.join([ids[0], ids[2]]), [5, 2])
+        self.assertEqual(
+            self.queues.topic('test.jobs.dead', START).pop_many(5), [0])
+        self.assertEqual(jobs.len(), 0)
+        self.assertEqual(
+            [r.levelname for r in handler.records],
+            ['ERROR', 'ERROR', 'ERROR'])
+
+    def test_replies(self):
+        jobs = self.queues.topic('test.jobs')
+        ids = jobs.send('a', 'b', 'c')
+        reply(self.db, [(ids[0], 'first'), (ids[2], None)])
+        reply(self.db, [(ids[0], 'second')])
+        self.db.debug = True
+        self.assertEqual(
+            gather(self.db, ids, timeout=0.1),
+            {ids[0]: 'first', ids[2]: None})
+        self.db.debug = False
+        self.assertEqual(
+            len([s for s in self.db.log if 'from replies' in s]),
+            len(self.db.log))
+        self.assertEqual(gather(self.db, ids, timeout=0), {})
+        self.assertRaises(WaitException, jobs.join, ids, timeout=0.1)
+
+        def answer():
+            db = self.connect()
+            Queues(db).topic('test.jobs', START).process(lambda m: m.upper())
+            db.close()
+
+        worker = threading.Thread(target=answer)
+        worker.start()
+        self.assertEqual(jobs.join(ids[1:2], timeout=5), ['B'])
+        worker.join()
+        self.assertEqual(
+            gather(self.db, ids, timeout=0), {ids[0]: 'A', ids[2]: 'C'})
+
+    def test_handle_failure_keeps_messages(self):
+        jobs = self.queues.topic('test.jobs')
+        jobs.send('one', 'two', 'three')
+
+        def fail(batch):
+            raise ValueError(batch)
+
+        self.assertRaises(ValueError, jobs.handle, fail, batch_size=2)
+        self.assertRaises(ValueError, jobs.handle, fail)
+        self.assertEqual(jobs.peek_many(5), ['one', 'two', 'three'])
+        seen = []
+        self.assertEqual(
+            jobs.handle(seen.extend, timeout=0.1, batch_size=2), 3)
+        self.assertEqual(seen, ['one', 'two', 'three'])
+        self.assertEqual(jobs.len(), 0)
+
+    def test_process_failure_keeps_messages(self):
+        jobs = self.queues.topic('test.jobs')
+        jobs.send('one', 'two')
+
+        def fail(message):
+            raise ValueError(message)
+
+        self.assertRaises(ValueError, jobs.process, fail)
+        self.assertEqual(jobs.peek_many(5), ['one', 'two'])
+        seen = []
+        self.assertEqual(jobs.process(seen.append), 2)
+        self.assertEqual(seen, ['one', 'two'])
+        self.assertEqual(jobs.len(), 0)
+
+    def test_acknowledge(self):
+        jobs = self.queues.topic('test.jobs', START)
+        jobs.send('one', 'two', 'three')
+        first = jobs.claim(2)
+        last = jobs.claim()
+        self.db.debug = True
+        self.assertEqual(jobs.acknowledge(*(first + last)), 3)
+        self.db.debug = False
+        self.assertEqual(len(self.db.log), 1)
+        self.assertEqual(jobs.acknowledge(*first), 0)
+        self.assertEqual(jobs.acknowledge(), 0)
+
+    def test_sweeper_survives_failures(self):
+        from zoom.retention import Sweeper, retain
+        retain(self.db, 'test.log', max_count=1)
+        self.addCleanup(retain, self.db, 'test.log')
+        log = self.queues.topic('test.log', START)
+        log.send('one', 'two', 'three')
+        handler = Handler()
+        logger = logging.getLogger('zoom.retention')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        attempts = []
+
+        def connect():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise MySQLdb.OperationalError(2006, 'gone away')
+            return self.connect()
+
+        sweeper = Sweeper(connect, interval=0.01)
+        sweeper.start()
+        for _ in range(200):
+            if log.len() == 1:
+                break
+            time.sleep(0.01)
+        sweeper.stop()
+        sweeper.join()
+        self.assertEqual(log.peek_many(5), ['three'])
+        self.assertEqual(len(handler.records), 1)
+        self.assertFalse(sweeper.is_alive())
+
+    def test_retention(self):
+        from zoom.retention import retain, policies, purge, sweep
+        log = self.queues.topic('test.log', START)
+        dead = self.queues.topic('test.log.dead', START)
+        log.send(*range(4))
+        dead.send('a', 'b')
+        claimed, = log.claim()
+        self.assertEqual(purge(self.db, 'test.log', keep=0), 3)
+        self.assertEqual(log.acknowledge(claimed), 1)
+
+        ids = log.send(*range(4))
+        reply(self.db, [(ids[0], 'done')])
+        self.db('update replies set created=%s where correlation_id=%s',
+                datetime(2017, 1, 1), ids[0])
+        self.db(
+            'update messages set created=%s where topic=%s and payload<%s',
+            datetime(2017, 1, 1), 'test.log', '2')
+        retain(self.db, 'test.%.dead', max_count=1)
+        self.addCleanup(retain, self.db, 'test.%.dead')
+        retain(self.db, 'test.log', max_age=60)
+        self.addCleanup(retain, self.db, 'test.log')
+        self.assertTrue(('test.log', 60, None) in policies(self.db))
+        removed, replies = sweep(self.db)
+        self.assertTrue(replies >= 1)
+        self.assertEqual(gather(self.db, ids[:1], timeout=0), {})
+        self.assertEqual(removed.get('test.log'), 2)
+        self.assertEqual(removed.get('test.log.dead'), 1)
+        self.assertEqual(log.peek_many(5), [2, 3])
+        self.assertEqual(dead.peek_many(5), ['b'])
+        self.assertEqual(sweep(self.db)[0].get('test.log'), None)
@@ -4,7 +4,7 @@
     Test the records module
 """
 
-from zoom.records import Record, RecordStore
+from zoom.records import Record, RecordStore, forget_schema
 from zoom.db import database
 
 import unittest
@@ -50,6 +50,7 @@ class TestRecordStore(unittest.TestCase):
             PRIMARY KEY ({key})
             )
         """.format(key=self.key, name=self.name))
+        forget_schema(db, self.name)
 
     def get_record_store(self):
         return RecordStore(self.db, Person)
@@ -172,6 +173,207 @@ class TestRecordStore(unittest.TestCase):
         self.people.zap()
         self.assertEqual(0, len(self.people))
 
+    def test_identity_map(self):
+        from zoom.identity import IdentityMap
+        from zoom.store import EntityStore
+        id = self.people.put(Person(name='Sam', age=25))
+        entities = EntityStore(self.db, Person)
+        self.addCleanup(entities.zap)
+        entities.put(Person(_id=id, name='Entity'))
+        self.db.identity_map = IdentityMap()
+        try:
+            sam = self.people.get(id)
+            self.assertTrue(self.people.get(id) is sam)
+            self.assertEqual(entities.get(id).name, 'Entity')
+            self.assertEqual(self.people.get(id).name, 'Sam')
+        finally:
+            self.db.identity_map = None
+
+    def test_put_statements(self):
+        self.db.debug = True
+        del self.db.log[:]
+        kim_id = self.people.put(Person(name='Kim', age=25))
+        kim = self.people.get(kim_id)
+        kim.age += 1
+        del self.db.log[:]
+        self.people.put(kim)
+        self.assertEqual(len(self.db.log), 1)
+        self.db.debug = False
+        self.db('alter table {} add column city varchar(100)'.format(self.name))
+        forget_schema(self.db, self.name)
+        kim.city = 'Paris'
+        self.people.put(kim)
+        self.assertEqual(self.people.get(kim_id).city, 'Paris')
+
+    def test_find_expressions(self):
+        from zoom.expressions import gt, lte, ne
+        self.people.put(Person(name='Kim', age=25, kids=2))
+        self.assertEqual(
+            [p.name for p in self.people.find(age=gt(25), order_by='-age')],
+            ['Joe', 'Ann'])
+        self.assertEqual(
+            [p.name for p in self.people.find(
+                age=lte(30), kids=None, order_by=['age', 'name'])],
+            ['Sam', 'Ann'])
+        self.assertEqual(
+            [p.name for p in self.people.find(kids=ne(None))], ['Kim'])
+        self.assertEqual(
+            [p.name for p in self.people.find(
+                name=['Ann', 'Sam', 'Zed'], order_by='name', limit=1)],
+            ['Ann'])
+        self.assertEqual(self.people.last(age=25).name, 'Kim')
+
+    def test_find_names(self):
+        self.assertEqual(
+            [p.name for p in self.people.find(order_by='age desc')],
+            ['Joe', 'Ann', 'Sam'])
+        with self.assertRaises(ValueError):
+            self.people.find(order_by='age, (select 1)')
+        with self.assertRaises(ValueError):
+            self.people.find(order_by='-age desc')
+        with self.assertRaises(ValueError):
+            self.people.find(**{'name=name or 1': 'x'})
+        with self.assertRaises(ValueError):
+            self.people.where(age__gt=1).order_by('size').all()
+        with self.assertRaises(ValueError):
+            self.people.aggregate(max='age) from person; --')
+
+    def test_search(self):
+        self.people.put(Person(name='100% Pat', age=41))
+        self.assertEqual(
+            [p.name for p in self.people.search('a 5')], ['Sam'])
+        self.assertEqual(
+            [p.name for p in self.people.search('A')],
+            ['Sam', 'Ann', '100% Pat'])
+        self.assertEqual(
+            [p.name for p in self.people.search('100%')], ['100% Pat'])
+        self.assertEqual(list(self.people.search('0%p')), [])
+        self.assertEqual(
+            [p.name for p in self.people.search('a', limit=1)], ['Sam'])
+
+    def test_query(self):
+        self.people.put(Person(name='Kim', age=25, kids=2))
+        query = self.people.where(age__gte=25, kids__isnull=True)
+        self.assertEqual(
+            [p.name for p in query.order_by('-age', 'name')],
+            ['Joe', 'Ann', 'Sam'])
+        self.assertEqual(query.count(), 3)
+        self.assertEqual(query.order_by('age').limit(1).offset(1).count(), 1)
+        self.assertEqual(
+            query.order_by('age').limit(1).offset(1).first().name, 'Ann')
+        self.assertTrue(self.people.where(kids__gt=1).exists())
+        self.assertFalse(self.people.where(age__in=[]).exists())
+        with self.assertRaises(ValueError):
+            self.people.where(**{'1=1 or name': 'Kim'})
+        with self.assertRaises(ValueError):
+            query.order_by('age, (select 1)')
+        names = self.people.only('name').where(name='Kim').all()
+        self.assertEqual(
+            [sorted(p.keys()) for p in names], [sorted([self.id_name, 'name'])])
+
+    def test_put_many(self):
+        sam = self.people.get(self.sam_id)
+        sam.age = 26
+        ids = self.people.put_many([
+            Person(name='Jane', age=25),
+            sam,
+            Person(name='Al', age=10),
+        ])
+        self.assertEqual(ids[1], self.sam_id)
+        self.assertEqual(
+            [p.name for p in self.people.get_many(ids)],
+            ['Jane', 'Sam', 'Al']
+        )
+        self.assertEqual(self.people.get(self.sam_id).age, 26)
+
+    def test_put_many_unordered_ids(self):
+        self.db.consecutive_ids = False
+        self.db.debug = True
+        ids = self.people.put_many(
+            [Person(name='Jane', age=25), Person(name='Al', age=10)])
+        self.db.debug = False
+        self.assertEqual(
+            [p.name for p in self.people.get_many(ids)], ['Jane', 'Al'])
+        self.assertEqual(
+            len([s for s in self.db.log if 'insert into' in s]), 2)
+
+    def test_put_many_upsert(self):
+        joe = Person(name='Joseph', age=51)
+        joe[self.id_name] = self.joe_id
+        zed = Person(name='Zed', age=1)
+        zed[self.id_name] = 100
+        ids = self.people.put_many(
+            [joe, zed, Person(name='Kim')], on_conflict='update')
+        self.assertEqual(ids[:2], [self.joe_id, 100])
+        self.assertEqual(self.people.get(self.joe_id).name, 'Joseph')
+        self.assertEqual(self.people.get(100).name, 'Zed')
+        self.assertEqual(self.people.get(ids[2]).name, 'Kim')
+        self.assertEqual(len(self.people), 5)
+        self.assertRaises(
+            ValueError, self.people.put_many, [], on_conflict='skip')
+
+    def test_get_many(self):
+        people = self.people.get_many([self.sam_id, 999, self.joe_id])
+        self.assertEqual(people[0].name, 'Sam')
+        self.assertEqual(people[1], None)
+        self.assertEqual(people[2].name, 'Joe')
+
+    def test_delete_many(self):
+        sam = self.people.get(self.sam_id)
+        self.assertEqual(
+            self.people.delete_many([sam, self.joe_id]),
+            [self.sam_id, self.joe_id]
+        )
+        self.assertEqual(1, len(self.people))
+
+    def test_only(self):
+        names = self.people.only('name')
+        self.assertEqual(
+            [dict(p) for p in names.find(age=25)],
+            [{self.id_name: self.sam_id, 'name': 'Sam'}]
+        )
+        joe = names.get(self.joe_id)
+        joe.name = 'Joseph'
+        self.people.put(joe)
+        joe = self.people.get(self.joe_id)
+        self.assertEqual((joe.name, joe.age), ('Joseph', 50))
+
+    def test_rows(self):
+        rows = self.people.rows()
+        sam = rows.first(name='Sam')
+        self.assertEqual((sam.name, sam['age'], sam.kids), ('Sam', 25, None))
+        self.assertEqual(dict(sam), dict(self.people.get(self.sam_id)))
+        self.assertEqual(
+            [p.name for p in rows.where(age__gte=30).order_by('age')],
+            ['Ann', 'Joe'])
+        self.assertRaises(AttributeError, setattr, sam, 'name', 'Samuel')
+        sam = Person(sam)
+        sam.name = 'Samuel'
+        self.people.put(sam)
+        self.assertEqual(self.people.get(self.sam_id).name, 'Samuel')
+
+    def test_aggregate(self):
+        self.people.put(Person(name='Kim', age=25, kids=2))
+        rows = self.people.aggregate('age', count=True, sum='kids')
+        self.assertEqual(
+            [(r.age, r.count, r.sum_kids) for r in rows],
+            [(25, 2, 2), (30, 1, None), (50, 1, None)])
+        row = self.people.aggregate(count=True, where=dict(age=[25, 30]))[0]
+        self.assertEqual(row.count, 3)
+
+    def test_change_log(self):
+        from zoom.changes import Consumer
+        consumer = Consumer(self.db, 'test_records', kinds=[self.name])
+        consumer.consume(lambda changes: None)
+        self.people.log_changes = True
+        joe = self.people.get(self.joe_id)
+        joe.age += 1
+        self.people.put(joe)
+        self.people.delete(self.sam_id)
+        self.assertEqual(
+            [(c.operation, c.row_id) for c in consumer.read()],
+            [('put', self.joe_id), ('delete', self.sam_id)])
+
 
 class TestKeyedRecordStore(TestRecordStore):
     """Keyed RecordStore Tests
@@ -5,7 +5,9 @@
 """
 
 from zoom.store import Entity, EntityStore
+from zoom.exceptions import PartialException
 from zoom.db import Database
+from zoom.identity import IdentityMap
 
 import MySQLdb
 
@@ -14,6 +16,8 @@ from decimal import Decimal
 
 from datetime import date, time, datetime
 
+from zoom.expressions import lt, gt, gte
+
 
 class Person(Entity):
     pass
@@ -43,6 +47,12 @@ class TestStore(unittest.TestCase):
         self.people.zap()
         self.db.close()
 
+    def materialize(self):
+        from zoom.materialize import start, complete, revert
+        start(self.db, 'person')
+        complete(self.db, 'person')
+        self.addCleanup(revert, self.db, 'person')
+
     def test_put(self):
         jane_id = self.people.put(Person(name='Jane', age=25))
         person = self.people.get(jane_id)
@@ -116,3 +126,495 @@ class TestStore(unittest.TestCase):
         self.assertEqual(3, len(self.people))
         self.people.zap()
         self.assertEqual(0, len(self.people))
+
+    def test_find_multiple_criteria(self):
+        self.people.put(Person(name='Joe', age=25))
+        people = self.people.find(name='Joe', age=50)
+        self.assertEqual([p._id for p in people], [self.joe_id])
+        people = self.people.find(name=['Joe', 'Sam'], age=25)
+        self.assertEqual(len(people), 2)
+        self.assertEqual(self.people.find(name='Joe', age=30), [])
+
+    def test_first_last(self):
+        jim_id = self.people.put(Person(name='Jim', age=25))
+        self.assertEqual(self.people.first(age=25)._id, self.sam_id)
+        self.assertEqual(self.people.last(age=25)._id, jim_id)
+        self.assertEqual(self.people.first(age=99), None)
+        self.assertEqual(self.people.last(age=99), None)
+
+    def test_delete_by_criteria(self):
+        self.people.put(Person(name='Sam', age=26))
+        self.assertEqual(self.people.delete(name='Sam', age=25), [self.sam_id])
+        self.assertEqual(len(self.people.find(name='Sam')), 1)
+
+    def test_page(self):
+        page, token = self.people.page(size=2)
+        self.assertEqual([p.name for p in page], ['Joe', 'Sam'])
+        page, token = self.people.page(token, size=2)
+        self.assertEqual([p.name for p in page], ['Ann'])
+        self.assertEqual(token, None)
+
+    def test_page_order_by(self):
+        page, token = self.people.page(size=2, order_by='name')
+        self.assertEqual([p.name for p in page], ['Ann', 'Joe'])
+        page, token = self.people.page(token, size=2, order_by='name')
+        self.assertEqual([p.name for p in page], ['Sam'])
+
+    def test_page_order_by_number(self):
+        self.people.put(Person(name='Tim', age=9))
+        self.people.put(Person(name='Zoe', age=100))
+        page, token = self.people.page(size=3, order_by='age')
+        self.assertEqual([p.age for p in page], [9, 25, 30])
+        page, token = self.people.page(token, size=3, order_by='age')
+        self.assertEqual([p.age for p in page], [50, 100])
+        page, token = self.people.page(size=3, order_by='-age')
+        self.assertEqual([p.age for p in page], [100, 50, 30])
+        page, token = self.people.page(token, size=3, order_by='-age')
+        self.assertEqual([p.age for p in page], [25, 9])
+
+    def test_slice(self):
+        self.assertEqual([p.name for p in self.people[1:3]], ['Sam', 'Ann'])
+        self.assertEqual(self.people[-1].name, 'Ann')
+        self.assertEqual([p.name for p in self.people], ['Joe', 'Sam', 'Ann'])
+        self.db.debug = True
+        self.assertEqual([p.name for p in self.people[1:]], ['Sam', 'Ann'])
+        self.db.debug = False
+        self.assertIn('offset 1', '\n'.join(self.db.log))
+
+    def test_put_changed_only(self):
+        joe = self.people.get(self.joe_id)
+        joe.age = 51
+        joe.email = 'joe@example.com'
+        del joe['name']
+        self.db.debug = True
+        self.people.put(joe)
+        self.db.debug = False
+        log = '\n'.join(self.db.log)
+        self.assertNotIn("where row_id=%s'", log)
+        self.assertIn('attribute in', log)
+        joe = self.people.get(self.joe_id)
+        self.assertEqual(
+            dict(joe),
+            dict(_id=self.joe_id, age=51, email='joe@example.com')
+        )
+
+    def test_put_unchanged(self):
+        joe = self.people.get(self.joe_id)
+        joe.age = 50
+        self.people.put(joe)
+        self.assertEqual(
+            dict(self.people.get(self.joe_id)),
+            dict(_id=self.joe_id, name='Joe', age=50)
+        )
+
+    def test_put_unchanged_values(self):
+        from zoom.changes import Consumer
+        consumer = Consumer(self.db, 'test_store', kinds=['person'])
+        consumer.consume(lambda changes: None)
+        self.people.log_changes = True
+        kim = Person(name='Kim', age=0, member=False, rating=0.0, nick='',
+                     born=date(2000, 1, 1), seen=datetime(2017, 1, 2, 3, 4))
+        kim_id = self.people.put(kim)
+        self.people.put(kim)
+        self.people.put_many([kim])
+        kim = self.people.get(kim_id)
+        self.people.put(kim)
+        self.people.put_many([kim])
+        kim.age = 1
+        self.people.put_many([kim])
+        self.assertEqual(
+            [(c.row_id, sorted(c.names)) for c in consumer.read()],
+            [(kim_id, sorted(kim.keys())[1:]), (kim_id, ['age'])])
+        self.assertEqual(dict(self.people.get(kim_id)), dict(kim))
+
+    def test_change_log_waits_on_gaps(self):
+        from zoom.changes import Consumer
+        consumer = Consumer(self.db, 'test_store', kinds=['person'])
+        consumer.consume(lambda changes: None)
+        self.people.log_changes = True
+        first = self.people.put(Person(name='Kim'))
+        second = self.people.put(Person(name='Pat'))
+        third = self.people.put(Person(name='Sam'))
+        self.db('delete from changes where row_id=%s', second)
+        self.assertEqual([c.row_id for c in consumer], [first])
+        self.db('update changes set changed=%s', datetime(2017, 1, 1))
+        self.assertEqual([c.row_id for c in consumer], [third])
+
+    def test_put_many_changed_only(self):
+        self.people.typed_index = True
+        self.people.reindex()
+        joe, sam = self.people.get_many([self.joe_id, self.sam_id])
+        joe.age = 51
+        del sam['name']
+        sam.city = 'Paris'
+        self.db.debug = True
+        self.people.put_many([joe, sam])
+        self.db.debug = False
+        log = '\n'.join(self.db.log)
+        self.assertNotIn('row_id in', log)
+        self.assertEqual(
+            [dict(p) for p in self.people.get_many([self.joe_id, self.sam_id])],
+            [dict(_id=self.joe_id, name='Joe', age=51),
+             dict(_id=self.sam_id, age=25, city='Paris')])
+        self.assertEqual(
+            [p.name for p in self.people.find(age=gt(40))], ['Joe'])
+
+    def test_put_deleted_entity(self):
+        joe = self.people.get(self.joe_id)
+        self.people.delete(joe)
+        self.people.put(joe)
+        self.assertEqual(self.people.get(self.joe_id).name, 'Joe')
+
+    def test_put_many(self):
+        sam = self.people.get(self.sam_id)
+        sam.age = 26
+        ids = self.people.put_many([
+            Person(name='Jane', age=25),
+            sam,
+            Person(name='Al', age=10),
+        ])
+        self.assertEqual(ids[1], self.sam_id)
+        self.assertEqual(
+            [p.name for p in self.people.get_many(ids)],
+            ['Jane', 'Sam', 'Al']
+        )
+        self.assertEqual(self.people.get(self.sam_id).age, 26)
+        self.assertEqual(len(self.people), 5)
+
+    def test_get_many(self):
+        people = self.people.get_many([self.sam_id, 999, self.joe_id])
+        self.assertEqual(people[0].name, 'Sam')
+        self.assertEqual(people[1], None)
+        self.assertEqual(people[2].name, 'Joe')
+
+    def test_delete_many(self):
+        sam = self.people.get(self.sam_id)
+        self.assertEqual(
+            self.people.delete_many([sam, self.joe_id]),
+            [self.sam_id, self.joe_id]
+        )
+        self.assertEqual(len(self.people), 1)
+
+    def test_search_index(self):
+        self.people.searchable = True
+        self.assertEqual(self.people.reindex(), 3)
+        self.people.put(Person(name='Joanne', age=25))
+        self.assertEqual(
+            [p.name for p in self.people.search('jo')], ['Joe', 'Joanne'])
+        self.assertEqual([p.name for p in self.people.search('jo 25')],
+                         ['Joanne'])
+        self.people.delete(name='Joe')
+        self.assertEqual([p.name for p in self.people.search('jo')],
+                         ['Joanne'])
+        self.people.zap()
+        self.assertEqual(list(self.people.search('jo')), [])
+
+    def test_find_ranges(self):
+        for typed in [False, True]:
+            self.people.typed_index = typed
+            self.people.reindex()
+            self.assertEqual(
+                [p.name for p in self.people.find(age=gt(25), order_by='age')],
+                ['Ann', 'Joe'])
+            self.assertEqual(
+                [p.name for p in self.people.find(age=lt(50), name=gte('B'))],
+                ['Sam'])
+
+    def test_find_date_ranges(self):
+        self.people.typed_index = True
+        self.people.put(Person(name='Kim', born=date(1990, 1, 1)))
+        self.people.put(Person(name='Lee', born=datetime(2001, 5, 5, 10, 0)))
+        found = self.people.find(born=gte(date(1995, 1, 1)))
+        self.assertEqual([p.name for p in found], ['Lee'])
+        self.assertEqual(
+            [p.name for p in self.people.find(born=lt(date(2010, 1, 1)),
+                                              order_by='-born')],
+            ['Lee', 'Kim'])
+
+    def test_identity_map(self):
+        self.db.identity_map = IdentityMap()
+        try:
+            joe = self.people.get(self.joe_id)
+            self.assertTrue(self.people.get(self.joe_id) is joe)
+            self.assertTrue(self.people.first(name='Joe') is joe)
+
+            joe.age = 51
+            self.people.put(joe)
+            self.assertEqual(self.people.get(self.joe_id).age, 51)
+
+            self.people.put(dict(_id=self.joe_id, name='Joe', age=52))
+            self.assertEqual(self.people.get(self.joe_id).age, 52)
+
+            self.people.delete(self.joe_id)
+            self.assertEqual(self.people.get(self.joe_id), None)
+        finally:
+            self.db.identity_map = None
+
+    def test_identity_map_classes(self):
+        self.db.identity_map = IdentityMap()
+        try:
+            OtherPerson = type('Person', (Entity,), {})
+            others = EntityStore(self.db, OtherPerson)
+            plain = EntityStore(self.db, 'person')
+            joe = self.people.get(self.joe_id)
+            other = others.get(self.joe_id)
+            self.assertFalse(other is joe)
+            self.assertTrue(isinstance(other, OtherPerson))
+            self.assertTrue(others.first(name='Joe') is other)
+            self.assertTrue(type(plain.get(self.joe_id)) is dict)
+            self.assertTrue(type(plain.find(name='Joe')[0]) is dict)
+            self.assertTrue(self.people.get(self.joe_id) is joe)
+            self.people.delete(self.joe_id)
+            self.assertEqual(others.get(self.joe_id), None)
+        finally:
+            self.db.identity_map = None
+
+    def test_materialize(self):
+        from zoom.materialize import start, verify, complete, revert, state
+        self.people.typed_index = True
+        self.assertEqual(start(self.db, 'person'), 3)
+        try:
+            self.people.put(Person(name='Kim', age=41, born=date(1980, 1, 2)))
+            self.assertEqual(verify(self.db, 'person'), [])
+            self.assertEqual(complete(self.db, 'person'), 4)
+            self.assertEqual(state(self.db, 'person'), 'wide')
+
+            people = EntityStore(self.db, Person)
+            self.assertEqual(len(people), 4)
+            self.assertEqual(people.get(self.joe_id).name, 'Joe')
+            self.assertEqual(
+                [p.name for p in people.find(age=gt(25), order_by='-age')],
+                ['Joe', 'Kim', 'Ann'])
+            self.assertEqual(people.first(born=date(1980, 1, 2)).name, 'Kim')
+            page, token = people.page(size=2, order_by='name')
+            self.assertEqual([p.name for p in page], ['Ann', 'Joe'])
+            page, token = people.page(token, size=2, order_by='name')
+            self.assertEqual([p.name for p in page], ['Kim', 'Sam'])
+            self.assertEqual([p.name for p in people[1:3]], ['Sam', 'Ann'])
+
+            sam = people.get(self.sam_id)
+            sam.age = 26
+            sam.city = 'Vancouver'
+            people.put(sam)
+            self.assertEqual(people.first(city='Vancouver').age, 26)
+            people.delete(self.joe_id)
+            self.assertEqual(people.exists([self.joe_id, self.sam_id]),
+                             [False, True])
+        finally:
+            revert(self.db, 'person')
+        self.assertEqual(state(self.db, 'person'), None)
+        self.people.reindex()
+        self.assertEqual(
+            sorted(p.name for p in self.people.find(age=gt(25))),
+            ['Ann', 'Kim', 'Sam'])
+
+    def test_materialize_elsewhere(self):
+        from zoom.materialize import start, verify, revert
+        from zoom.layouts import check
+        other = Database(
+            MySQLdb.Connect,
+            host='database',
+            user='testuser',
+            passwd='password',
+            db='test',
+        )
+        other.autocommit(1)
+        self.addCleanup(other.close)
+        people = EntityStore(other, Person)
+        joe = people.get(self.joe_id)
+        start(self.db, 'person')
+        self.addCleanup(revert, self.db, 'person')
+        check(other)
+        other.debug = True
+        people.put(Person(name='Kim', age=41))
+        joe.age = None
+        people.put(joe)
+        people.delete(self.sam_id)
+        other.debug = False
+        self.assertEqual(
+            len([cmd for cmd in other.log if 'materialized_kinds' in cmd]), 1)
+        self.assertEqual(verify(self.db, 'person'), [])
+        self.assertEqual(
+            sorted(p.name for p in EntityStore(self.db, Person)),
+            ['Ann', 'Joe', 'Kim'])
+
+    def test_names_are_parameters(self):
+        hostile = "name' or 1=1 or attribute='"
+        order = 'name; drop table entities'
+        for materialized in [False, True]:
+            if materialized:
+                self.materialize()
+            self.assertEqual(self.people.find(**{hostile: 'x'}), [])
+            self.assertEqual(
+                sorted(p.name for p in self.people.find(
+                    age=gt(1), order_by=order)),
+                ['Ann', 'Joe', 'Sam'])
+            self.assertEqual(
+                self.people.page(order_by=order), ([], None))
+            self.assertEqual(
+                len(self.people.aggregate(hostile, count=True, max=order)), 1)
+        self.assertEqual(len(self.people), 3)
+
+    def test_partition_elsewhere(self):
+        from zoom.partitions import move, merge
+        from zoom.layouts import check
+        other = Database(
+            MySQLdb.Connect,
+            host='database',
+            user='testuser',
+            passwd='password',
+            db='test',
+        )
+        other.autocommit(1)
+        self.addCleanup(other.close)
+        people = EntityStore(other, Person)
+        joe = people.get(self.joe_id)
+        move(self.db, 'person')
+        check(other)
+        people.put(Person(name='Kim', age=41))
+        joe.age = 51
+        people.put(joe)
+        people.delete(self.sam_id)
+        self.assertEqual(
+            list(self.db('select count(*) from entities where kind=%s',
+                         'person'))[0][0], 0)
+        self.assertEqual(merge(self.db, 'person'), 3)
+        self.assertEqual(
+            sorted((p.name, p.age) for p in self.people),
+            [('Ann', 30), ('Joe', 51), ('Kim', 41)])
+
+    def test_catalog(self):
+        from zoom.catalog import enable, entries
+        self.db.debug = True
+        self.people.put(Person(name='Al'))
+        self.db.debug = False
+        self.assertNotIn('entity_kinds', '\n'.join(self.db.log))
+        self.assertEqual(entries(self.db), None)
+        self.people.delete(name='Al')
+
+        self.assertTrue(enable(self.db))
+        self.assertEqual(len(self.people), 3)
+        self.people.db.debug = True
+        del self.db.log[:]
+        self.assertEqual(len(self.people), 3)
+        self.assertNotIn('distinct row_id', '\n'.join(self.db.log))
+        self.people.db.debug = False
+
+        joe = self.people.get(self.joe_id)
+        self.people.delete(joe)
+        self.assertEqual(len(self.people), 2)
+        self.people.put(joe)
+        self.people.put(dict(_id=self.sam_id, name='Sam', city='Paris'))
+        self.assertEqual(len(self.people), 3)
+        self.people.put_many([Person(name='Al'), joe])
+        self.assertEqual(len(self.people), 4)
+        self.people.delete_many([self.joe_id, 999])
+        self.assertEqual(len(self.people), 3)
+        self.assertEqual(
+            sorted(self.people.get_attributes()), ['age', 'city', 'name'])
+        self.db('delete from entity_kinds where kind=%s', 'person')
+        self.assertEqual(len(self.people), 3)
+        self.people.zap()
+        self.assertEqual(len(self.people), 0)
+        self.assertEqual(self.people.get_attributes(), [])
+
+    def test_catalog_legacy_database(self):
+        from zoom.catalog import enable, rebuild
+        from zoom.database import Database as LegacyDatabase
+        legacy = LegacyDatabase(
+            MySQLdb.Connect,
+            host='database',
+            user='testuser',
+            passwd='password',
+            db='test',
+        )
+        legacy.autocommit(1)
+        self.addCleanup(legacy.close)
+        self.assertTrue(enable(legacy))
+        self.assertEqual(rebuild(legacy, 'person'), 3)
+        people = EntityStore(legacy, Person)
+        people.put(dict(_id=self.sam_id, name='Sam', city='Paris'))
+        self.assertEqual(len(people), 3)
+        self.assertEqual(people.get(self.sam_id).city, 'Paris')
+
+    def test_only(self):
+        self.people.put(Person(name='Kim', photo='x' * 10000))
+        for materialized in [False, True]:
+            if materialized:
+                self.materialize()
+            names = self.people.only('name', 'photo')
+            found = names.find(age=gt(25), order_by='age')
+            self.assertEqual([p.name for p in found], ['Ann', 'Joe'])
+            self.assertEqual([sorted(p) for p in found], [['_id', 'name']] * 2)
+            self.assertEqual(
+                sorted(self.people.find(fields=['age'], name='Joe')[0].keys()),
+                ['_id', 'age'])
+            joe = names.get(self.joe_id)
+            self.assertRaises(PartialException, self.people.put, joe)
+            self.assertRaises(PartialException, self.people.put_many, [joe])
+            self.assertEqual(self.people.get(self.joe_id).age, 50)
+
+    def test_aggregate(self):
+        self.people.put(Person(name='Kim', age=25, pay=Decimal('1.25')))
+        for materialized in [False, True]:
+            if materialized:
+                self.materialize()
+            rows = self.people.aggregate('age', count=True, sum='pay')
+            self.assertEqual(
+                [(r.age, r.count, r.sum_pay) for r in rows],
+                [(25, 2, Decimal('1.25')), (30, 1, None), (50, 1, None)])
+            row = self.people.aggregate(
+                count=True, max='age', min='name', where=dict(age=gt(25)))[0]
+            self.assertEqual((row.count, row.max_age, row.min_name),
+                             (2, 50, 'Ann'))
+
+    def test_change_log(self):
+        from zoom.changes import Consumer
+        consumer = Consumer(self.db, 'test_store', kinds=['person'])
+        consumer.consume(lambda changes: None)
+        self.people.log_changes = True
+        joe = self.people.get(self.joe_id)
+        joe.city = 'Paris'
+        self.people.put(joe)
+        self.people.put(joe)
+        self.people.put_many([joe, Person(name='Al')])
+        self.people.delete(self.sam_id)
+        self.people.zap()
+        self.assertEqual(
+            [(c.operation, c.row_id, c.names) for c in consumer.read()],
+            [('put', self.joe_id, ['city']),
+             ('put', self.joe_id + 3, ['name']),
+             ('delete', self.sam_id, None),
+             ('zap', None, None)])
+        self.assertEqual(consumer.consume(lambda changes: None), 4)
+        self.assertEqual(consumer.read(), [])
+
+    def test_partition(self):
+        from zoom.partitions import move, merge, lookup
+        self.assertEqual(move(self.db, 'person'), 3)
+        self.addCleanup(merge, self.db, 'person')
+        self.assertEqual(
+            lookup(self.db, 'person').attributes, 'attributes_person')
+        self.assertEqual(self.people.get(self.joe_id).name, 'Joe')
+        self.assertEqual(
+            sorted(p.name for p in self.people.find(age=gt(25))),
+            ['Ann', 'Joe'])
+        kim_id = self.people.put(Person(name='Kim', age=25))
+        self.assertEqual(len(self.people), 4)
+        self.people.delete(kim_id)
+        self.assertEqual(
+            list(self.db('select count(*) from attributes where kind=%s',
+                         'person'))[0][0], 0)
+
+        class Visit(Entity):
+            pass
+
+        class Visits(EntityStore):
+            partitioned = True
+
+        visits = Visits(self.db, Visit)
+        self.addCleanup(merge, self.db, 'visit')
+        self.addCleanup(visits.zap)
+        visits.put(Visit(path='/home'))
+        self.assertEqual(lookup(self.db, 'visit').entities, 'entities_visit')
+        self.assertEqual([v.path for v in visits], ['/home'])
@@ -0,0 +1,126 @@
+"""
+    entify.py
+
+    benchmark for decoding EntityStore attribute rows
+
+    Decodes a synthetic attribute result set with the legacy if/elif
+    decoder and with zoom.store.entify and reports rows per second.
+
+    usage:
+        python entify.py [rows]
+
+"""
+import sys
+import json
+import time
+import decimal
+import datetime
+
+import zoom.jsonz
+from zoom.store import entify, Entity, EntityList
+
+
+class Person(Entity):
+    pass
+
+
+def legacy_entify(rs, klass):
+    """the if/elif decoder entify replaced, kept for comparison"""
+    entities = {}
+
+    for _, _, row_id, attribute, datatype, value in rs:
+
+        if datatype == 'str':
+            pass
+
+        elif datatype == 'unicode' and isinstance(value, unicode):
+            pass
+
+        elif datatype == 'unicode':
+            value = value.decode('utf8')
+
+        elif datatype == "long":
+            value = long(value)
+
+        elif datatype == "int":
+            value = int(value)
+
+        elif datatype == 'float':
+            value = float(value)
+
+        elif datatype == 'decimal.Decimal':
+            value = decimal.Decimal(value)
+
+        elif datatype == "datetime.date":
+            y = int(value[:4])
+            m = int(value[5:7])
+            d = int(value[8:10])
+            value = datetime.date(y, m, d)
+
+        elif datatype == "datetime.datetime":
+            y = int(value[:4])
+            m = int(value[5:7])
+            d = int(value[8:10])
+            hr = int(value[11:13])
+            mn = int(value[14:16])
+            sc = int(value[17:19])
+            value = datetime.datetime(y, m, d, hr, mn, sc)
+
+        elif datatype == 'bool':
+            value = (value == '1' or value == 'True')
+
+        elif datatype == 'NoneType':
+            value = None
+
+        elif datatype in ['list', 'tuple']:
+            value = json.loads(value, object_hook=zoom.jsonz._handler)
+
+        entities.setdefault(row_id, klass(_id=row_id))[attribute] = value
+
+    return EntityList(entities.values())
+
+
+def attribute_rows(count):
+    """generate count attribute rows for a typical kind"""
+    attributes = [
+        ('name', 'str', lambda n: 'Person %s' % n),
+        ('email', 'str', lambda n: 'person%s@example.com' % n),
+        ('age', 'int', lambda n: str(n % 90)),
+        ('salary', 'decimal.Decimal', lambda n: '%s.00' % (n % 1000)),
+        ('birthdate', 'datetime.date',
+            lambda n: '19%02d-%02d-%02d' % (n % 100, n % 12 + 1, n % 28 + 1)),
+        ('created', 'datetime.datetime',
+            lambda n: '2016-%02d-%02d %02d:%02d:%02d' % (
+                n % 12 + 1, n % 28 + 1, n % 24, n % 60, n % 60)),
+        ('active', 'bool', lambda n: str(n % 2)),
+        ('notes', 'NoneType', lambda n: None),
+        ('score', 'float', lambda n: str(n / 7.0)),
+        ('tags', 'list', lambda n: '["a", "b"]'),
+    ]
+    rows = []
+    for n in xrange(count):
+        row_id = long(n / len(attributes) + 1)
+        attribute, datatype, value = attributes[n % len(attributes)]
+        rows.append((n, 'person', row_id, attribute, datatype, value(n)))
+    return rows
+
+
+def measure(label, function, rows):
+    """decode the rows and report the rate"""
+    start = time.time()
+    entities = function(rows, Person)
+    elapsed = time.time() - start
+    print '{:<10} {:>10,} rows {:>8,} entities {:8.2f}s {:>12,.0f} rows/sec'.format(
+        label, len(rows), len(entities), elapsed, len(rows) / elapsed)
+    return entities
+
+
+def main(count=1000000):
+    rows = attribute_rows(count)
+    before = measure('before', legacy_entify, rows)
+    after = measure('after', lambda rs, klass: entify(rs, klass, 'person'), rows)
+    assert sorted(before) == sorted(after)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,88 @@
+"""
+    rows.py
+
+    benchmark for reading RecordStore results as records and as rows
+
+    Builds records and zoom.rows rows from a synthetic result set the
+    way zoom.records.get_result_iterator does and reports the time to
+    build them, their size and the time to read their columns as
+    attributes and as items.  Sizes are of the objects alone, not the
+    values they share.
+
+    usage:
+        python rows.py [rows]
+
+"""
+import sys
+import time
+import datetime
+import decimal
+
+from zoom.records import Record
+from zoom.rows import row_class
+
+
+class Person(Record):
+    pass
+
+
+NAMES = ['_id', 'name', 'email', 'age', 'salary', 'birthdate', 'notes']
+
+
+def result_rows(count):
+    """generate count rows of a typical table"""
+    birthdate = datetime.date(1990, 5, 5)
+    return [
+        (long(n), 'Person %s' % n, 'person%s@example.com' % n, n % 90,
+         decimal.Decimal(n % 1000), birthdate, None)
+        for n in xrange(1, count + 1)
+    ]
+
+
+def records(rows):
+    return [
+        Person((k, v) for k, v in zip(NAMES, rec) if v is not None)
+        for rec in rows
+    ]
+
+
+def slotted(rows):
+    row = row_class(NAMES, 'Person')
+    return [row(rec) for rec in rows]
+
+
+def by_attribute(items):
+    for item in items:
+        item.name, item.age, item.salary
+
+
+def by_item(items):
+    for item in items:
+        item['name'], item['age'], item['salary']
+
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+
+def measure(label, function, rows):
+    """build the items and report their cost"""
+    items, build = timed(function, rows)
+    size = sum(sys.getsizeof(item) for item in items)
+    _, attributes = timed(by_attribute, items)
+    _, keys = timed(by_item, items)
+    print '{:<8} {:>10,} rows build {:6.2f}s {:>8,} bytes/row ' \
+        'attributes {:6.2f}s items {:6.2f}s'.format(
+            label, len(items), build, size / len(items), attributes, keys)
+
+
+def main(count=1000000):
+    rows = result_rows(count)
+    measure('records', records, rows)
+    measure('rows', slotted, rows)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -17,6 +17,11 @@ __all__ = [
     'auto',
     'server',
     'publish',
+    'reindex',
+    'materialize',
+    'partition',
+    'purge',
+    'retain',
 ]
 
 
@@ -148,3 +153,96 @@ def unpublish(options, path, server='git@dsilabs.ca'):
             print('fatal: {} does not exist in {}'.format(name, dest))
         else:
             run('ssh {} "rm -rf dev/{}/{}"'.format(server, kind, name))
+
+
+def reindex(options, kind, index='search', instance=None):
+    """rebuild the search, typed index or catalog entry of an entity kind"""
+    import zoom
+    import zoom.catalog
+    from zoom.store import EntityStore
+    if index not in ['search', 'typed', 'catalog', 'all']:
+        raise Exception(
+            'fatal: index must be one of search, typed, catalog or all')
+    zoom.system.setup(instance)
+    store = EntityStore(zoom.system.db, kind)
+    store.searchable = index in ['search', 'all']
+    store.typed_index = index in ['typed', 'all']
+    start = time.time()
+    if index in ['catalog', 'all']:
+        count = zoom.catalog.rebuild(zoom.system.db, kind)
+    if index != 'catalog':
+        count = store.reindex()
+    print '{} {} entities indexed in {:.2f}s'.format(
+        count, kind, time.time() - start)
+
+
+def materialize(options, kind, step='start', instance=None):
+    """move an entity kind to or from a table of its own"""
+    import zoom
+    import zoom.materialize
+    steps = ['start', 'verify', 'complete', 'revert']
+    if step not in steps:
+        raise Exception('fatal: step must be one of ' + ', '.join(steps))
+    zoom.system.setup(instance)
+    db = zoom.system.db
+    start = time.time()
+    if step == 'verify':
+        differ = zoom.materialize.verify(db, kind)
+        print '{} {} entities differ{}'.format(
+            len(differ), kind, differ and ': ' + ', '.join(map(str, differ)) or '')
+    else:
+        count = getattr(zoom.materialize, step)(db, kind)
+        print '{} {} entities in {:.2f}s ({})'.format(
+            count, kind, time.time() - start,
+            zoom.materialize.state(db, kind) or 'attributes')
+
+
+def partition(options, kind, step='move', instance=None):
+    """move an entity kind to or from tables of its own"""
+    import zoom
+    import zoom.partitions
+    steps = ['move', 'merge']
+    if step not in steps:
+        raise Exception('fatal: step must be one of ' + ', '.join(steps))
+    zoom.system.setup(instance)
+    db = zoom.system.db
+    start = time.time()
+    count = getattr(zoom.partitions, step)(db, kind)
+    print '{} {} entities in {:.2f}s ({})'.format(
+        count, kind, time.time() - start,
+        zoom.partitions.lookup(db, kind).attributes)
+
+
+def purge(options, topic='*', instance=None):
+    """remove old queue messages and reclaim their space"""
+    import zoom
+    import zoom.retention
+    zoom.system.setup(instance)
+    db = zoom.system.db
+    start = time.time()
+    before = zoom.retention.space(db)
+    if topic == '*':
+        removed, replies = zoom.retention.sweep(db)
+    else:
+        removed, replies = {topic: zoom.retention.purge(db, topic)}, 0
+    for name, count in sorted(removed.items()):
+        print '{} messages removed from {}'.format(count, name)
+    zoom.retention.compact(db)
+    print '{} messages and {} replies removed in {:.2f}s ' \
+        '({:,} bytes reclaimed)'.format(
+            sum(removed.values()), replies, time.time() - start,
+            before - zoom.retention.space(db))
+
+
+def retain(options, topic, max_age='', max_count='', instance=None):
+    """set the retention policy of queue topics"""
+    import zoom
+    import zoom.retention
+    zoom.system.setup(instance)
+    db = zoom.system.db
+    zoom.retention.retain(
+        db, topic,
+        int(max_age) if max_age != '' else None,
+        int(max_count) if max_count != '' else None)
+    for policy in zoom.retention.policies(db):
+        print '{:<30} max_age={} max_count={}'.format(*policy)
@@ -0,0 +1,292 @@
+"""
+    zoom.catalog
+
+    entity kind catalog
+
+    The catalog keeps the number of entities of each kind, the attributes
+    and datatypes they have been stored with and when the kind last
+    changed, so stores can answer len() and get_attributes() and admin
+    pages can list kinds without scanning the attributes table.
+
+    Keeping the catalog costs a few writes per put and delete, so sites
+    turn it on (catalog = 1 in the database section of the site config)
+    and EntityStore then keeps it up to date as it puts and deletes
+    entities.  The entry of a kind is built from the stored entities the
+    first time the kind is used, so existing sites only need the
+    entity_kinds and entity_kind_attributes tables.  Sites without them
+    don't keep a catalog.
+
+    Attributes stay in the catalog once they have been stored, so a kind
+    can list attributes none of its entities still have.  Code that
+    changes the attributes table directly should rebuild the entry of
+    the kind.
+"""
+
+import zoom.utils
+from zoom.db import missing_table
+
+
+def setup_test():
+    from zoom.store import setup_test
+    db = setup_test()
+    enable(db)
+    return db
+
+
+class KindEntry(object):
+    """the catalog entry of a kind
+
+        >>> db = setup_test()
+        >>> entry = KindEntry(db, 'person')
+        >>> entry.load(lambda: (2, [('name', 'str'), ('age', 'int')]))
+        >>> len(entry), entry.attributes()
+        (2, ['age', 'name'])
+        >>> entry.change(1, ['name', 'birthdate'], ['unicode', 'datetime.date'])
+        >>> len(entry), entry.attributes()
+        (3, ['birthdate', 'name', 'age'])
+        >>> sorted(entry.datatypes().items())
+        [('age', ['int']), ('birthdate', ['datetime.date']), ('name', ['str', 'unicode'])]
+        >>> entry.clear()
+        >>> len(entry), entry.attributes()
+        (0, [])
+        >>> db.close()
+
+    """
+
+    def __init__(self, db, kind):
+        self.db = db
+        self.kind = kind
+        self.observed = set()
+        self.survey = None
+
+    def load(self, survey):
+        """read the entry of the kind, building it with survey if the
+        catalog does not have it yet
+
+        survey returns the number of entities of the kind and the
+        (attribute, datatype) pairs they hold.
+        """
+        self.survey = survey
+        cmd = 'select attribute, datatype from entity_kind_attributes where kind=%s'
+        self.observed = set(tuple(rec) for rec in self.db(cmd, self.kind))
+        cmd = 'select entities from entity_kinds where kind=%s'
+        if not list(self.db(cmd, self.kind)):
+            count, attributes = survey()
+            self.db(
+                'insert ignore into entity_kinds (kind, entities, updated) '
+                'values (%s, %s, now())', self.kind, count
+            )
+            self.observe(attributes)
+
+    def observe(self, pairs):
+        """add (attribute, datatype) pairs not yet in the catalog"""
+        new = []
+        for pair in pairs:
+            if pair not in self.observed:
+                self.observed.add(pair)
+                new.append((self.kind,) + tuple(pair))
+        if new:
+            cmd = (
+                'insert ignore into entity_kind_attributes '
+                '(kind, attribute, datatype) values (%s, %s, %s)'
+            )
+            self.db.cursor().executemany(cmd, new)
+
+    def change(self, delta, keys=(), datatypes=()):
+        """record a change to the kind
+
+        delta is the change in the number of entities and keys and
+        datatypes are those of the attributes written.
+        """
+        self.observe(zip(keys, datatypes))
+        self.db(
+            'update entity_kinds set entities=entities+%s, updated=now() '
+            'where kind=%s', delta, self.kind
+        )
+
+    def clear(self):
+        """record that all entities of the kind were deleted"""
+        self.db('delete from entity_kind_attributes where kind=%s', self.kind)
+        self.db(
+            'update entity_kinds set entities=0, updated=now() where kind=%s',
+            self.kind
+        )
+        self.observed = set()
+
+    def attributes(self):
+        """returns the attribute names of the kind, newest first"""
+        cmd = (
+            'select attribute from entity_kind_attributes '
+            'where kind=%s order by id desc'
+        )
+        names = []
+        for rec in self.db(cmd, self.kind):
+            if rec[0] not in names:
+                names.append(rec[0])
+        return names
+
+    def datatypes(self):
+        """returns the datatypes stored in each attribute"""
+        cmd = (
+            'select attribute, datatype from entity_kind_attributes '
+            'where kind=%s order by id'
+        )
+        result = {}
+        for attribute, datatype in self.db(cmd, self.kind):
+            result.setdefault(attribute, []).append(datatype)
+        return result
+
+    def __len__(self):
+        """the number of entities of the kind, as the catalog has it now
+
+        An entry removed since it was loaded, by a rebuild elsewhere for
+        instance, is built again.
+        """
+        cmd = 'select entities from entity_kinds where kind=%s'
+        for rec in self.db(cmd, self.kind):
+            return int(rec[0])
+        if self.survey is not None:
+            self.load(self.survey)
+            for rec in self.db(cmd, self.kind):
+                return int(rec[0])
+        return 0
+
+
+def enable(db):
+    """
+    keep the catalog on a database connection
+
+    Returns False, leaving the catalog off, if the site doesn't have the
+    catalog tables.
+    """
+    try:
+        db('select kind from entity_kinds limit 1')
+    except Exception as error:
+        if not missing_table(error):
+            raise
+        return False
+    if entries(db) is None:
+        db.kind_catalog = {}
+    return True
+
+
+def entries(db):
+    """
+    returns the catalog entries read on a database connection or None if
+    the catalog is not kept on it (see enable)
+
+    Entries are kept with the connection so each kind is read once per
+    connection.
+    """
+    return getattr(db, 'kind_catalog', None)
+
+
+def lookup(db, kind, survey):
+    """returns the catalog entry of a kind or None if the site keeps no
+    catalog"""
+    catalog = entries(db)
+    if catalog is None:
+        return None
+    entry = catalog.get(kind)
+    if entry is None:
+        entry = KindEntry(db, kind)
+        entry.load(survey)
+        catalog[kind] = entry
+    return entry
+
+
+def kinds(db):
+    """
+    returns the catalogued kinds
+
+        >>> db = setup_test()
+        >>> from zoom.store import EntityStore
+        >>> people = EntityStore(db, 'person')
+        >>> people.put_many([dict(name='Sam'), dict(name='Sally', age=5)])
+        [1L, 2L]
+        >>> [(k.kind, k.entities, k.names) for k in kinds(db)]
+        [('person', 2, ['age', 'name'])]
+        >>> db.close()
+
+    """
+    cmd = (
+        'select k.kind, k.entities, k.updated, a.attribute '
+        'from entity_kinds k '
+        'left join entity_kind_attributes a on a.kind=k.kind '
+        'order by k.kind, a.attribute'
+    )
+    result = []
+    for kind, entities, updated, attribute in db(cmd):
+        if not result or result[-1].kind != kind:
+            result.append(zoom.utils.Record(
+                kind=kind, entities=int(entities), updated=updated, names=[],
+            ))
+        if attribute and attribute not in result[-1].names:
+            result[-1].names.append(attribute)
+    return result
+
+
+def rebuild(db, kind):
+    """
+    rebuild the catalog entry of a kind from its stored entities
+
+        >>> db = setup_test()
+        >>> from zoom.store import EntityStore
+        >>> people = EntityStore(db, 'person')
+        >>> people.put_many([dict(name='Sam'), dict(name='Sally', age=5)])
+        [1L, 2L]
+        >>> db('delete from attributes where attribute=%s', 'age')
+        0L
+        >>> people.get_attributes()
+        ['age', 'name']
+        >>> rebuild(db, 'person')
+        2
+        >>> people.get_attributes()
+        ['name']
+        >>> db.close()
+
+    """
+    from zoom.store import EntityStore
+    catalog = entries(db)
+    if catalog is None:
+        return 0
+    db('delete from entity_kinds where kind=%s', kind)
+    db('delete from entity_kind_attributes where kind=%s', kind)
+    catalog.pop(kind, None)
+    return len(EntityStore(db, kind).catalog)
+
+
+def build(db):
+    """
+    catalog the kinds in the entities table that are not catalogued yet
+
+    Returns the kinds added.
+
+        >>> db = setup_test()
+        >>> db('insert into entities (kind) values (%s)', 'person')
+        1L
+        >>> db('insert into attributes (kind, row_id, attribute, datatype, value) '
+        ...    'values (%s, %s, %s, %s, %s)', 'person', 1, 'name', 'str', 'Sam')
+        1L
+        >>> build(db)
+        ['person']
+        >>> build(db)
+        []
+        >>> [(k.kind, k.entities, k.names) for k in kinds(db)]
+        [('person', 1, ['name'])]
+        >>> db.close()
+
+    """
+    from zoom.store import EntityStore
+    from zoom.partitions import partitioned
+    if entries(db) is None:
+        return []
+    known = set(rec.kind for rec in kinds(db))
+    stored = [rec[0] for rec in db('select distinct kind from entities')]
+    added = [
+        kind for kind in stored + sorted(partitioned(db))
+        if kind not in known
+    ]
+    for kind in added:
+        EntityStore(db, kind).catalog
+    return added
@@ -0,0 +1,258 @@
+"""
+    zoom.changes
+
+    change log for stores
+
+    Stores that log changes (log_changes = True) append a row to the
+    changes table for every entity or record they put or delete, giving
+    the kind, the id, the operation, the names of the attributes that
+    changed where they are known and a sequence number that increases
+    with every change.  Zapping a kind logs a single zap change with no
+    id.
+
+    Consumers read the log from a named cursor kept in the
+    change_cursors table, so work such as updating caches or copying
+    changes to a reporting database only touches what changed since it
+    last ran.
+
+    Sequence numbers are taken when a change is logged but a change is
+    only seen once it is committed, so on transactional tables a change
+    can turn up after changes with higher numbers.  A cursor moved past
+    it would never see it, so consumers stop short of a gap in the
+    sequence until the gap is GAP_TIMEOUT seconds old.  An older gap is
+    taken to be one that will never fill, such as the number of a
+    rolled back change.  A change committed later than that is missed.
+
+        >>> db = setup_test()
+        >>> from zoom.store import Entity, EntityStore
+        >>> class Person(Entity): pass
+        >>> people = EntityStore(db, Person)
+        >>> people.log_changes = True
+        >>> sam, sally = people.put_many(
+        ...     [dict(name='Sam'), dict(name='Sally')])
+        >>> reporting = Consumer(db, 'reporting')
+        >>> [(c.row_id, c.operation, c.names) for c in reporting.read()]
+        [(1L, 'put', ['name']), (2L, 'put', ['name'])]
+        >>> reporting.consume(lambda changes: None)
+        2
+        >>> sally = people.get(sally)
+        >>> sally.age = 25
+        >>> people.put(sally)
+        2L
+        >>> people.delete(sam)
+        [1L]
+        >>> [(c.row_id, c.operation, c.names) for c in reporting.read()]
+        [(2L, 'put', ['age']), (1L, 'delete', None)]
+        >>> Consumer(db, 'reporting').position
+        2L
+        >>> db.close()
+
+"""
+
+import datetime
+
+import zoom.utils
+
+# seconds a gap in the sequence is waited on before it is passed over
+GAP_TIMEOUT = 60
+
+
+def setup_test():
+    from zoom.store import setup_test
+    db = setup_test()
+    db('drop table if exists changes')
+    db("""
+        create table if not exists changes (
+            seq       int not null auto_increment,
+            kind      varchar(100),
+            row_id    int,
+            operation varchar(10),
+            attributes text,
+            changed   datetime,
+            PRIMARY KEY (seq),
+            KEY `kind_key` (`kind`, `seq`)
+            )
+        """)
+    db('drop table if exists change_cursors')
+    db("""
+        create table if not exists change_cursors (
+            name      varchar(100) not null,
+            seq       int not null default 0,
+            updated   datetime,
+            PRIMARY KEY (name)
+            )
+        """)
+    return db
+
+
+def log(db, kind, operation, changes):
+    """
+    append changes to the log
+
+    changes are (row_id, attributes) pairs where attributes is the list
+    of the attributes that changed or None if they are not known.
+    """
+    rows = [
+        (kind, row_id, operation,
+         None if attributes is None else ','.join(attributes))
+        for row_id, attributes in changes
+    ]
+    if rows:
+        cmd = (
+            'insert into changes '
+            '(kind, row_id, operation, attributes, changed) '
+            'values (%s, %s, %s, %s, now())'
+        )
+        db.cursor().executemany(cmd, rows)
+
+
+def _change(rec):
+    seq, kind, row_id, operation, attributes, changed = rec
+    if attributes is not None:
+        attributes = attributes and attributes.split(',') or []
+    return zoom.utils.Record(
+        seq=seq,
+        kind=kind,
+        row_id=row_id,
+        operation=operation,
+        names=attributes,
+        changed=changed,
+    )
+
+
+class Consumer(object):
+    """reads the change log from a durable cursor
+
+    A consumer only sees changes to the kinds it is given, or to all
+    kinds if it is given none, but its cursor moves past every change
+    it has read.
+    """
+
+    def __init__(self, db, name, kinds=None):
+        self.db = db
+        self.name = name
+        self.kinds = kinds and list(kinds) or None
+
+    @property
+    def position(self):
+        """the sequence number of the last change consumed"""
+        cmd = 'select seq from change_cursors where name=%s'
+        for rec in self.db(cmd, self.name):
+            return rec[0]
+        return 0
+
+    def horizon(self, after):
+        """
+        returns the first sequence number after a gap that may still
+        fill, or None if there is no such gap after after
+
+        Gaps left by prune are not waited on.
+
+            >>> db = setup_test()
+            >>> log(db, 'person', 'put', [(1, None), (2, None), (3, None)])
+            >>> db('delete from changes where seq=2')
+            0L
+            >>> consumer = Consumer(db, 'reporting')
+            >>> consumer.horizon(0) == 3, [c.row_id for c in consumer.read()]
+            (True, [1L])
+            >>> old = datetime.datetime(2017, 1, 1)
+            >>> db('update changes set changed=%s', old)
+            0L
+            >>> consumer.horizon(0), [c.row_id for c in consumer.read()]
+            (None, [1L, 3L])
+            >>> db.close()
+
+        """
+        cmd = (
+            'select min(c.seq) from changes c '
+            'left join changes p on p.seq=c.seq-1 '
+            'where c.seq>%s and p.seq is null '
+            'and c.seq>coalesce((select min(seq) from change_cursors), 0)+1 '
+            'and c.changed>date_sub(now(), interval %s second)'
+        )
+        return list(self.db(cmd, after + 1, GAP_TIMEOUT))[0][0]
+
+    def read(self, limit=100, after=None):
+        """returns up to limit changes after the cursor without
+        consuming them, stopping short of any gap that may still fill"""
+        if after is None:
+            after = self.position
+        cmd = (
+            'select seq, kind, row_id, operation, attributes, changed '
+            'from changes where seq>%s'
+        )
+        params = [after]
+        horizon = self.horizon(after)
+        if horizon is not None:
+            cmd += ' and seq<%s'
+            params.append(horizon)
+        if self.kinds:
+            cmd += ' and kind in ({})'.format(
+                ','.join(['%s'] * len(self.kinds)))
+            params.extend(self.kinds)
+        cmd += ' order by seq limit {:d}'.format(limit)
+        return [_change(rec) for rec in self.db(cmd, *params)]
+
+    def advance(self, seq):
+        """move the cursor to seq"""
+        self.db(
+            'replace into change_cursors (name, seq, updated) '
+            'values (%s, %s, now())', self.name, seq
+        )
+
+    def consume(self, handler, batch_size=100):
+        """
+        pass the changes after the cursor to handler in batches
+
+        The cursor is advanced after each batch is handled, so a batch
+        that fails is read again on the next run.  Returns the number
+        of changes consumed.
+        """
+        count = 0
+        after = self.position
+        while True:
+            changes = self.read(batch_size, after)
+            if not changes:
+                return count
+            handler(changes)
+            after = changes[-1].seq
+            self.advance(after)
+            count += len(changes)
+
+    def __iter__(self):
+        """iterate through the changes after the cursor, advancing it
+        as each change is read"""
+        after = self.position
+        while True:
+            changes = self.read(after=after)
+            if not changes:
+                break
+            for change in changes:
+                yield change
+                after = change.seq
+                self.advance(after)
+
+
+def prune(db):
+    """
+    remove the changes every consumer has read
+
+    Returns the number of changes removed.
+
+        >>> db = setup_test()
+        >>> log(db, 'person', 'put', [(1, ['name']), (2, None)])
+        >>> Consumer(db, 'a').advance(1)
+        >>> Consumer(db, 'b').advance(2)
+        >>> prune(db)
+        1
+        >>> [c.seq for c in Consumer(db, 'c').read()]
+        [2L]
+        >>> db.close()
+
+    """
+    cmd = 'select min(seq) from change_cursors'
+    seq = list(db(cmd))[0][0]
+    if seq is None:
+        return 0
+    db('delete from changes where seq<=%s', seq)
+    return db.rowcount
@@ -146,6 +146,8 @@ class Database(object):
                 }
         self.debug = False
         self.log = []
+        self.queries = 0
+        self.identity_map = None
 
     def __getattr__(self, name):
         if self.__connection is None:
@@ -181,6 +183,7 @@ class Database(object):
         cursor return value (whatever that is!)."""
         cursor = self.cursor()
 
+        self.queries += 1
         start = timeit.default_timer()
         try:
             result = cursor.execute(sql, args)
@@ -203,6 +206,7 @@ class Database(object):
         args are '%' substituted into query beforehand."""
         cursor = self.cursor()
 
+        self.queries += 1
         start = timeit.default_timer()
         try:
             result = cursor.execute(sql,params)
@@ -16,6 +16,30 @@ ERROR_TPL = """
   message: {}
 """
 
+# the MySQL error number for a table that does not exist
+NO_SUCH_TABLE = 1146
+
+
+def missing_table(error):
+    """returns True if error reports that a table does not exist
+
+    Works for the errors of the database drivers and for the
+    DatabaseExceptions raised for them.
+
+        >>> missing_table(Exception(1146, "Table 'test.x' doesn't exist"))
+        True
+        >>> missing_table(Exception('no such table: x'))
+        True
+        >>> missing_table(Exception(2006, 'MySQL server has gone away'))
+        False
+
+    """
+    error = getattr(error, 'error', error)
+    args = getattr(error, 'args', ())
+    if args and args[0] == NO_SUCH_TABLE:
+        return True
+    return 'no such table' in str(error)
+
 
 class Result(object):
     """database query result"""
@@ -173,6 +197,8 @@ class Database(object):
         self.log = []
         self.rowcount = None
         self.lastrowid = None
+        self.queries = 0
+        self.identity_map = None
 
     def __getattr__(self, name):
         if self.__connection is None:
@@ -181,6 +207,7 @@ class Database(object):
 
     def _execute(self, cursor, method, command, *args):
         """execute the SQL command"""
+        self.queries += 1
         start = timeit.default_timer()
         params = len(args) == 1 and \
             hasattr(args[0], 'items') and \
@@ -189,7 +216,10 @@ class Database(object):
         try:
             method(command, params)
         except Exception as error:
-            raise DatabaseException(ERROR_TPL.format(command, args, error))
+            message = ERROR_TPL.format(command, args, error)
+            exception = DatabaseException(message)
+            exception.error = error
+            raise exception
         else:
             self.rowcount = cursor.rowcount
         finally:
@@ -220,6 +250,26 @@ class Database(object):
     def __call__(self, command, *args):
         return self.execute(command, *args)
 
+    @property
+    def engine(self):
+        """the kind of database connected to, sqlite or mysql, for the
+        statements that are written differently for each
+
+            >>> import sqlite3
+            >>> Database(sqlite3.connect, database=':memory:').engine
+            'sqlite'
+
+        """
+        module = getattr(self.__factory, '__module__', None) or ''
+        return 'sqlite' in module and 'sqlite' or 'mysql'
+
+    @property
+    def key(self):
+        """identifies the database connected to so what is known about
+        it can be shared by the Database objects that connect to it"""
+        names = ['host', 'port', 'unix_socket', 'db', 'database']
+        return tuple(self.__keywords.get(name) for name in names) + self.__args
+
     def use(self, name):
         """use another database on the same instance"""
         # pylint: disable=star-args
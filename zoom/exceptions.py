@@ -14,3 +14,6 @@ class TypeException(Exception):
     """unsupported type"""
     pass
 
+class PartialException(Exception):
+    """partial entity"""
+    pass
@@ -31,6 +31,44 @@ eq = Equal
 ne = NotEqual
 occurs = Occurs
 
+# the operators of name__operator keywords (see lookup)
+LOOKUPS = {
+    'eq': Equal,
+    'ne': NotEqual,
+    'lt': LessThan,
+    'lte': LessThanOrEqualTo,
+    'gt': GreaterThan,
+    'gte': GreaterThanOrEqualTo,
+    'in': Occurs,
+}
+
+
+def lookup(key, value):
+    """
+    split a name__operator keyword into the name and its search term
+
+        >>> name, term = lookup('age__gt', 30)
+        >>> name, term.operator, term.value
+        ('age', '>', 30)
+        >>> lookup('name', 'Joe')
+        ('name', 'Joe')
+        >>> lookup('kids__isnull', True)
+        ('kids', None)
+        >>> lookup('age__between', 3)
+        Traceback (most recent call last):
+        ...
+        ValueError: unknown operator between in age__between
+
+    """
+    name, _, operator = key.rpartition('__')
+    if not name:
+        return key, value
+    if operator == 'isnull':
+        return name, None if value else NotEqual(None)
+    if operator not in LOOKUPS:
+        raise ValueError('unknown operator {} in {}'.format(operator, key))
+    return name, LOOKUPS[operator](value)
+
 
 def sql_query(table, *a, **k):
     """
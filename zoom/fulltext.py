@@ -0,0 +1,264 @@
+"""
+    zoom.fulltext
+
+    inverted index of the words stored in entities and records
+
+    Stores opt in by setting searchable to True.  The words in each
+    stored item are kept in a table of (kind, term, row_id, hits)
+    postings that is updated when items are put or deleted, so a search
+    looks up matching terms instead of scanning every item of a kind.
+"""
+
+import re
+
+
+def setup_test():
+    def create_test_tables(db):
+        db("""
+        create table if not exists search_terms (
+            id int not null auto_increment,
+            kind      varchar(100),
+            row_id    int not null,
+            term      varchar(50),
+            hits      int,
+            PRIMARY KEY (id),
+            KEY `term_key` (`kind`, `term`),
+            KEY `row_id_key` (`kind`, `row_id`)
+            )
+        """)
+
+    def delete_test_tables(db):
+        db('drop table if exists search_terms')
+
+    from zoom.db import database
+
+    db = database(
+        'mysql',
+        host='database',
+        db='test',
+        user='testuser',
+        passwd='password'
+    )
+    delete_test_tables(db)
+    create_test_tables(db)
+    return db
+
+
+MAX_TERM_LENGTH = 50
+
+_words = re.compile(r'\w+', re.UNICODE)
+
+
+def _text(value):
+    """returns the searchable text of a value"""
+    if value is None:
+        return u''
+    if isinstance(value, (list, tuple)):
+        return u' '.join(_text(v) for v in value)
+    if isinstance(value, str):
+        return value.decode('utf8', 'ignore')
+    if isinstance(value, dict):
+        return _text(value.values())
+    return unicode(value)
+
+
+def tokenize(*values):
+    """returns the search terms found in values
+
+        >>> tokenize('Sally Mary Smith', 55)
+        [u'sally', u'mary', u'smith', u'55']
+        >>> tokenize(u'Caf\\xe9', None, ['Red', 'Blue'])
+        [u'caf\\xe9', u'red', u'blue']
+        >>> tokenize('')
+        []
+
+    """
+    return [
+        word[:MAX_TERM_LENGTH]
+        for word in _words.findall(u' '.join(_text(v) for v in values).lower())
+    ]
+
+
+def _query_terms(text):
+    """returns the distinct terms of a query
+
+    A term that is a prefix of another term adds nothing to a query
+    where every term must match so it is dropped.
+
+        >>> _query_terms('sm smi Bob')
+        [u'bob', u'smi']
+        >>> _query_terms('')
+        []
+
+    """
+    terms = sorted(set(tokenize(text)))
+    return [
+        term for n, term in enumerate(terms)
+        if not (n + 1 < len(terms) and terms[n + 1].startswith(term))
+    ]
+
+
+def _prefix(term):
+    """returns a like pattern matching the words that begin with term
+
+        >>> _prefix(u'snake_case')
+        u'snake!_case%'
+
+    """
+    escaped = term.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+    return escaped + '%'
+
+
+class SearchIndex(object):
+    """an inverted index of the terms stored in a kind
+
+        >>> db = setup_test()
+        >>> index = SearchIndex(db, 'person')
+        >>> index.update(1, ['Sam Adam Jones', 25])
+        >>> index.update(2, ['Sally Mary Smith', 55])
+        >>> index.update(3, ['Bob Marvin Smith', 25])
+        >>> index.search('smi')
+        [2L, 3L]
+        >>> index.search('bo SMI')
+        [3L]
+        >>> index.search('smi 55')
+        [2L]
+        >>> index.search('smith smithers')
+        []
+        >>> index.search('')
+        []
+        >>> index.update(6, ['snake_case', 'snakeXcase'])
+        >>> index.update(7, ['snakeXcase'])
+        >>> index.search('snake_c')
+        [6L]
+        >>> index.remove([6, 7])
+
+        >>> index.update(2, ['Sally Mary Smith-Smith', 55])
+        >>> index.search('smith', rank=True)
+        [2L, 3L]
+        >>> index.search('smith', limit=1)
+        [2L]
+
+        >>> index.update_many([(5, ['Smithers']), (3, ['Bob'])])
+        >>> index.search('smi')
+        [2L, 5L]
+
+        >>> index.remove([2])
+        >>> index.search('smi')
+        [5L]
+        >>> index.rebuild([(4, ['Joe'])])
+        1
+        >>> index.search('smi'), index.search('joe')
+        ([], [4L])
+        >>> index.clear()
+        >>> index.search('joe')
+        []
+
+    """
+
+    def __init__(self, db, kind):
+        self.db = db
+        self.kind = kind
+
+    def _insert(self, rows):
+        if rows:
+            cmd = (
+                'insert into search_terms (kind, row_id, term, hits) '
+                'values (%s,%s,%s,%s)'
+            )
+            self.db.cursor().executemany(cmd, rows)
+
+    def _postings(self, row_id, values):
+        counts = {}
+        for term in tokenize(*values):
+            counts[term] = counts.get(term, 0) + 1
+        return [(self.kind, row_id, t, n) for t, n in counts.items()]
+
+    def update(self, row_id, values):
+        """index the values stored under row_id"""
+        self.remove([row_id])
+        self._insert(self._postings(row_id, values))
+
+    def update_many(self, items):
+        """index the values of (row_id, values) pairs"""
+        items = list(items)
+        self.remove([row_id for row_id, _ in items])
+        rows = []
+        for row_id, values in items:
+            rows.extend(self._postings(row_id, values))
+        self._insert(rows)
+
+    def remove(self, ids):
+        """remove the postings of the given row ids"""
+        if ids:
+            cmd = (
+                'delete from search_terms '
+                'where kind=%s and row_id in ({})'
+            ).format(','.join(['%s'] * len(ids)))
+            self.db(cmd, self.kind, *ids)
+
+    def clear(self):
+        """remove all postings for the kind"""
+        self.db('delete from search_terms where kind=%s', self.kind)
+
+    def rebuild(self, items, batch_size=1000):
+        """replace the index with postings for (row_id, values) pairs
+
+        Returns the number of items indexed.
+        """
+        self.clear()
+        count = 0
+        rows = []
+        for row_id, values in items:
+            rows.extend(self._postings(row_id, values))
+            count += 1
+            if len(rows) >= batch_size:
+                self._insert(rows)
+                rows = []
+        self._insert(rows)
+        return count
+
+    def query(self, text, rank=False, limit=None):
+        """returns a (cmd, params) statement selecting matching row ids
+
+        The statement selects row_id and score columns so it can be
+        joined to the stored items.  Returns None if text has no terms.
+        """
+        terms = _query_terms(text)
+        if not terms:
+            return None
+
+        match = "term like %s escape '!'"
+        cases = ' '.join(
+            'when {} then {}'.format(match, n) for n in range(len(terms))
+        )
+        likes = ' or '.join([match] * len(terms))
+        patterns = [_prefix(term) for term in terms]
+        cmd = (
+            'select row_id, sum(hits) as score from search_terms '
+            'where kind=%s and ({likes}) '
+            'group by row_id '
+            'having count(distinct case {cases} end)={n} '
+            'order by {order}'
+        ).format(
+            likes=likes,
+            cases=cases,
+            n=len(terms),
+            order=rank and 'score desc, row_id' or 'row_id',
+        )
+        if limit is not None:
+            cmd += ' limit {:d}'.format(limit)
+        return cmd, [self.kind] + patterns + patterns
+
+    def search(self, text, rank=False, limit=None):
+        """returns the ids of the rows containing every term in text
+
+        Terms match the beginning of indexed words.  Results are in row
+        order unless rank is True, in which case rows where the terms
+        occur most often come first.
+        """
+        query = self.query(text, rank, limit)
+        if query is None:
+            return []
+        cmd, params = query
+        return [rec[0] for rec in self.db(cmd, *params)]
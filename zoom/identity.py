@@ -0,0 +1,134 @@
+"""
+    zoom.identity
+
+    per-request identity map
+
+    When a site turns on the identity map (identity_map = 1 in the
+    database section of the site config) the stores keep every entity
+    and record they read during a request in a map keyed by (kind, id).
+    Repeat reads of the same item are then served from memory and
+    return the same object.  Items are mapped separately for each space,
+    the type of store and the class it reads items as, so a store never
+    gets an item read by a store of another type or class, while
+    discarding an item discards it from every space.  The map is
+    attached to the database connections and is cleared when the system
+    is released at the end of the request.
+"""
+
+
+def key(kind, id):
+    """returns the map key of an item
+
+        >>> key('person', '2'), key('account', 'abc')
+        (('person', 2L), ('account', 'abc'))
+
+    """
+    try:
+        return kind, long(id)
+    except (TypeError, ValueError):
+        return kind, id
+
+
+class IdentityMap(object):
+    """maps (kind, id) to the items read or written in a request
+
+        >>> items = IdentityMap()
+        >>> joe = dict(_id=1L, name='Joe')
+        >>> items.add('person', 1L, joe) is joe
+        True
+        >>> items.get('person', 1) is joe
+        True
+        >>> items.get('person', 2)
+        >>> items.identify('person', [dict(_id=1L, name='Joe'), dict(_id=2L)])
+        [{'_id': 1L, 'name': 'Joe'}, {'_id': 2L}]
+        >>> items.get('person', 2)
+        {'_id': 2L}
+        >>> items.get('person', 2, space='records')
+        >>> items.add('person', 2, dict(_id=2L, name='Sam'), space='records')
+        {'_id': 2L, 'name': 'Sam'}
+        >>> items.get('person', 2), len(items)
+        ({'_id': 2L}, 3)
+        >>> items.discard('person', [1, 2])
+        >>> items.get('person', 1), items.get('person', 2, space='records')
+        (None, None)
+        >>> items.hits, items.misses
+        (3, 4)
+        >>> items.add('person', 3, dict(_id=3L), space='records')
+        {'_id': 3L}
+        >>> items.clear('person')
+        >>> len(items)
+        0
+
+    """
+
+    def __init__(self):
+        # {(kind, id): {space: item}}
+        self.items = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind, id, space=None):
+        """return the item of kind with id if it is in the map"""
+        item = self.items.get(key(kind, id), {}).get(space)
+        if item is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return item
+
+    def add(self, kind, id, item, space=None):
+        """map an item, replacing any item already mapped"""
+        self.items.setdefault(key(kind, id), {})[space] = item
+        return item
+
+    def identify(self, kind, items, id_name='_id', space=None):
+        """returns items with ones already mapped replaced by the mapped
+        item and the others added to the map"""
+        mapped = self.items
+        result = []
+        for item in items:
+            spaces = mapped.setdefault(key(kind, item[id_name]), {})
+            result.append(spaces.setdefault(space, item))
+        return result
+
+    def discard(self, kind, ids):
+        """remove items from the map, in every space"""
+        for id in ids:
+            self.items.pop(key(kind, id), None)
+
+    def clear(self, kind=None):
+        """remove all items, or all items of a kind, from the map"""
+        if kind is None:
+            self.items.clear()
+        else:
+            for k in [k for k in self.items if k[0] == kind]:
+                del self.items[k]
+
+    def __len__(self):
+        return sum(len(spaces) for spaces in self.items.values())
+
+    def report(self, queries=None):
+        """produce an identity map report
+
+        Given the number of queries run in the request the report also
+        shows how many would have run without the map.
+
+            >>> items = IdentityMap()
+            >>> items.hits, items.misses = 5, 2
+            >>> print items.report(12)
+              Identity Map
+             --------------------
+              5 reads served from memory, 2 read from the database
+              12 queries, 17 without the identity map
+            <BLANKLINE>
+
+        """
+        lines = [
+            '  Identity Map\n --------------------\n',
+            '  {} reads served from memory, {} read from the database\n'
+            .format(self.hits, self.misses),
+        ]
+        if queries is not None:
+            lines.append('  {} queries, {} without the identity map\n'.format(
+                queries, queries + self.hits))
+        return ''.join(lines)
@@ -12,6 +12,29 @@ from decimal import Decimal
 from datetime import datetime, date
 
 
+def _handler(obj):
+    """handles extra converters"""
+    # pylint: disable=invalid-name
+    if '__type__' in obj:
+        t = obj['__type__']
+        if t == 'datetime':
+            try:
+                return datetime.strptime(obj['value'],
+                                         '%Y-%m-%dT%H:%M:%S.%f')
+            except ValueError:
+                return datetime.strptime(obj['value'],
+                                         '%Y-%m-%dT%H:%M:%S')
+        elif t == 'date':
+            return datetime.strptime(obj['value'], '%Y-%m-%d').date()
+        elif t == 'decimal':
+            return Decimal(str(obj['value']))
+    return obj
+
+
+# building a decoder is a large part of decoding short values so reuse one
+_decoder = json.JSONDecoder(object_hook=_handler)
+
+
 def loads(text):
     """load JSON from a string
 
@@ -32,26 +55,7 @@ def loads(text):
     ... )
     {u'timestamp': datetime.datetime(2015, 1, 1, 10, 40, 10, 234200)}
     """
-
-    def dhandler(obj):
-        """handles extra converters"""
-        # pylint: disable=invalid-name
-        if '__type__' in obj:
-            t = obj['__type__']
-            if t == 'datetime':
-                try:
-                    return datetime.strptime(obj['value'],
-                                             '%Y-%m-%dT%H:%M:%S.%f')
-                except ValueError:
-                    return datetime.strptime(obj['value'],
-                                             '%Y-%m-%dT%H:%M:%S')
-            elif t == 'date':
-                return datetime.strptime(obj['value'], '%Y-%m-%d').date()
-            elif t == 'decimal':
-                return Decimal(str(obj['value']))
-        return obj
-
-    return json.loads(text, object_hook=dhandler)
+    return _decoder.decode(text)
 
 
 def dumps(data, *a, **k):
@@ -0,0 +1,105 @@
+"""
+    zoom.layouts
+
+    versions of the layouts of entity kinds
+
+    Stores read how kinds are laid out, such as which of them are
+    materialized (see zoom.materialize) or partitioned (see
+    zoom.partitions), once per database connection and keep it on the
+    connection, so writes don't pay for looking it up.  Code that
+    changes the layout of a kind calls changed, which bumps the version
+    kept in the store_versions table.
+
+    Web requests each get a connection of their own, so they read the
+    layouts as they are when the request starts.  Processes that keep
+    a connection, such as queue workers, call check once per unit of
+    work to forget what their connection has read when another
+    connection has changed a layout since.  Sites without the table
+    keep what their connections have read.
+
+        >>> db = setup_test()
+        >>> check(db)
+        >>> db.materialized_kinds = {}
+        >>> check(db)
+        >>> db.materialized_kinds
+        {}
+        >>> changed(db)
+        >>> version(db)
+        1
+        >>> check(db)
+        >>> db.materialized_kinds = {}
+        >>> check(db)
+        >>> db.materialized_kinds
+        {}
+        >>> cmd = 'update store_versions set version=version+1'
+        >>> result = db(cmd)
+        >>> check(db)
+        >>> print db.materialized_kinds
+        None
+        >>> db.close()
+
+"""
+
+from zoom.db import missing_table
+
+# the name of the version row of the layouts
+VERSION = 'layouts'
+
+# the attributes of a connection that keep what stores have read
+CACHES = ['materialized_kinds', 'entity_partitions']
+
+
+def setup_test():
+    from zoom.store import setup_test
+    db = setup_test()
+    db('drop table if exists store_versions')
+    db("""
+        create table if not exists store_versions (
+            name    varchar(100) NOT NULL,
+            version int NOT NULL default 0,
+            PRIMARY KEY (name)
+            )
+        """)
+    return db
+
+
+def forget(db):
+    """forget the layouts read on a connection"""
+    for name in CACHES:
+        setattr(db, name, None)
+
+
+def version(db):
+    """returns the version of the layouts or None if the site has no
+    store_versions table"""
+    cmd = 'select version from store_versions where name=%s'
+    try:
+        rows = list(db(cmd, VERSION))
+    except Exception as error:
+        if not missing_table(error):
+            raise
+        return None
+    return rows and int(rows[0][0]) or 0
+
+
+def changed(db):
+    """record that the layout of a kind has changed"""
+    try:
+        db(
+            'insert into store_versions (name, version) values (%s, 1) '
+            'on duplicate key update version=version+1', VERSION
+        )
+    except Exception as error:
+        if not missing_table(error):
+            raise
+    forget(db)
+    db.layout_version = None
+
+
+def check(db):
+    """forget the layouts read on a connection if they have changed
+    since they were read"""
+    current = version(db)
+    if current != getattr(db, 'layout_version', None):
+        forget(db)
+        db.layout_version = current
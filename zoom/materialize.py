@@ -0,0 +1,755 @@
+"""
+    zoom.materialize
+
+    wide tables for entity kinds
+
+    An entity kind normally keeps one attributes row per value.  A
+    materialized kind keeps one row per entity in a table of its own
+    with a typed column per attribute, which EntityStore reads and
+    writes in place of the attributes table so app code doesn't change.
+
+    Kinds move to their table in steps so sites can keep running:
+
+        start     create the table, copy the entities into it and
+                  write to both the attributes and the table
+        verify    compare the table to the attributes
+        complete  repair any differences, then read and write only the
+                  table and remove the attributes rows
+        revert    move the entities back into the attributes table
+
+    Each step is available as a function here and as the
+    'zoom materialize <kind> <step>' command.  Stores look up the state
+    of their kind in the materialized_kinds table once per database
+    connection.  Each step records the change with zoom.layouts so
+    connections that are kept open, such as those of queue workers,
+    read the new state the next time they check.
+"""
+
+import datetime
+import decimal
+
+import zoom.jsonz
+import zoom.layouts
+import zoom.partitions
+from zoom.db import missing_table
+from zoom.exceptions import TypeException
+
+
+def setup_test():
+    from zoom.store import setup_test
+    db = setup_test()
+    db('drop table if exists materialized_kinds')
+    db("""
+        create table if not exists materialized_kinds (
+            kind       varchar(100) not null,
+            state      varchar(10),
+            table_name varchar(100),
+            columns    text,
+            PRIMARY KEY (kind)
+            )
+        """)
+    db('drop table if exists person_entities')
+    return db
+
+
+COLUMN_TYPES = {
+    'str': 'mediumtext',
+    'unicode': 'mediumtext',
+    'int': 'bigint',
+    'long': 'bigint',
+    'float': 'double',
+    # decimals are kept as text so they come back exactly as they were put
+    'decimal.Decimal': 'varchar(100)',
+    'datetime.date': 'date',
+    'datetime.datetime': 'datetime',
+    'bool': 'tinyint',
+    'list': 'mediumtext',
+    'tuple': 'mediumtext',
+    'NoneType': 'mediumtext',
+}
+
+# datatypes that share a column and the datatype the column takes
+COMPATIBLE = {
+    'int': 'int',
+    'long': 'int',
+    'str': 'str',
+    'unicode': 'str',
+    'list': 'list',
+    'tuple': 'list',
+}
+
+# the type decimals are cast to when they are compared
+NUMERIC = 'decimal(65,15)'
+
+
+def _date(value):
+    if isinstance(value, datetime.date):
+        return value
+    from zoom.store import _date
+    return _date(str(value))
+
+
+def _datetime(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    from zoom.store import _datetime
+    return _datetime(str(value))
+
+
+def _unicode(value):
+    if isinstance(value, unicode):
+        return value
+    return value.decode('utf8')
+
+
+def _str(value):
+    if isinstance(value, unicode):
+        return value.encode('utf8')
+    return value
+
+
+CONVERTERS = {
+    'str': _str,
+    'unicode': _unicode,
+    'int': int,
+    'long': long,
+    'float': float,
+    'decimal.Decimal': lambda v: decimal.Decimal(str(v)),
+    'datetime.date': _date,
+    'datetime.datetime': _datetime,
+    'bool': bool,
+    'list': zoom.jsonz.loads,
+    'tuple': zoom.jsonz.loads,
+    'NoneType': lambda v: None,
+}
+
+
+def merge(kind, attribute, datatypes):
+    """returns the column datatype for values of the given datatypes
+
+        >>> merge('person', 'age', ['int', 'long', 'NoneType'])
+        'int'
+        >>> merge('person', 'name', ['str', 'unicode'])
+        'unicode'
+        >>> merge('person', 'notes', ['NoneType'])
+        'NoneType'
+        >>> merge('person', 'age', ['int', 'str'])
+        Traceback (most recent call last):
+        ...
+        TypeException: person.age holds values of types int, str
+
+    """
+    merged = set(
+        COMPATIBLE.get(t, t) for t in datatypes if t != 'NoneType'
+    )
+    if len(merged) > 1:
+        msg = '{}.{} holds values of types {}'.format(
+            kind, attribute, ', '.join(sorted(set(datatypes) - {'NoneType'})))
+        raise TypeException(msg)
+    if 'unicode' in datatypes:
+        return 'unicode'
+    return merged and merged.pop() or 'NoneType'
+
+
+def quote(name):
+    """quote a column name"""
+    return '`{}`'.format(name.replace('`', '``'))
+
+
+def key(attribute, datatype):
+    """returns the definition of the index of a column
+
+        >>> key('name', 'str')
+        'KEY `name_key` (`name`(100))'
+        >>> key('age', 'int')
+        'KEY `age_key` (`age`)'
+
+    """
+    prefix = COLUMN_TYPES[datatype] == 'mediumtext' and '(100)' or ''
+    return 'KEY {} ({}{})'.format(
+        quote(attribute + '_key'), quote(attribute), prefix)
+
+
+class WideTable(object):
+    """the table of a materialized kind"""
+
+    def __init__(self, db, kind, name, state, columns):
+        self.db = db
+        self.kind = kind
+        self.name = name
+        self.state = state
+        self.columns = list(columns)
+        self.datatypes = dict(columns)
+
+    def _expression(self, attribute, alias=''):
+        """the SQL expression comparing the values of an attribute"""
+        if self.datatypes[attribute] == 'decimal.Decimal':
+            return 'cast({}{} as {})'.format(alias, quote(attribute), NUMERIC)
+        return alias + quote(attribute)
+
+    def _add_columns(self, attributes):
+        """add columns for attributes the table does not have yet"""
+        for attribute, datatype in attributes:
+            cmd = 'alter table {} add column {} {}'.format(
+                quote(self.name), quote(attribute), COLUMN_TYPES[datatype])
+            self.db(cmd)
+            self.db('alter table {} add {}'.format(
+                quote(self.name), key(attribute, datatype)))
+            self.columns.append((attribute, datatype))
+            self.datatypes[attribute] = datatype
+        self.db(
+            'update materialized_kinds set columns=%s where kind=%s',
+            zoom.jsonz.dumps(self.columns), self.kind
+        )
+
+    def _row(self, entity, added):
+        """returns the stored values of an entity by attribute"""
+        from zoom.store import encode, fixval
+        keys, datatypes, values = encode(entity)
+        row = {}
+        for key, datatype, value in zip(keys, datatypes, values):
+            if value is None:
+                # clears the column of an attribute set back to None
+                row[key] = None
+                continue
+            if key in added:
+                column = added[key]
+                if column == 'str' and datatype == 'unicode':
+                    column = added[key] = datatype
+            elif key not in self.datatypes:
+                column = added[key] = datatype
+            else:
+                column = self.datatypes[key]
+                if column == 'NoneType' or column == 'str' and datatype == 'unicode':
+                    self._retype(key, datatype)
+                    column = datatype
+            if COMPATIBLE.get(datatype, datatype) != COMPATIBLE.get(column, column):
+                msg = 'unsupported type {} for {}.{} ({})'.format(
+                    datatype, self.kind, key, column)
+                raise TypeException(msg)
+            row[key] = fixval(value)
+        return row
+
+    def _retype(self, attribute, datatype):
+        """change the datatype of a column that has not held the values
+        of another"""
+        if COLUMN_TYPES[datatype] != COLUMN_TYPES[self.datatypes[attribute]]:
+            cmd = 'alter table {} drop key {}, modify column {} {}, add {}'.format(
+                quote(self.name), quote(attribute + '_key'), quote(attribute),
+                COLUMN_TYPES[datatype], key(attribute, datatype))
+            self.db(cmd)
+        self.datatypes[attribute] = datatype
+        self.columns = [
+            (name, name == attribute and datatype or t)
+            for name, t in self.columns
+        ]
+        self.db(
+            'update materialized_kinds set columns=%s where kind=%s',
+            zoom.jsonz.dumps(self.columns), self.kind
+        )
+
+    def write(self, entities):
+        """replace the rows of entities that have ids"""
+        added = {}
+        rows = [(entity['_id'], self._row(entity, added)) for entity in entities]
+        if not rows:
+            return
+        if added:
+            self._add_columns(sorted(added.items()))
+        names = [name for name, _ in self.columns]
+        cmd = 'replace into {} ({}) values ({})'.format(
+            quote(self.name),
+            ', '.join(quote(name) for name in ['_id'] + names),
+            ','.join(['%s'] * (len(names) + 1)),
+        )
+        self.db.cursor().executemany(cmd, [
+            [id] + [row.get(name) for name in names] for id, row in rows
+        ])
+
+    def entities(self, rs, klass):
+        """returns the entities stored in rows"""
+        from zoom.store import EntityList
+        names = [d[0] for d in rs.cursor.description]
+        converters = [
+            name != '_id' and CONVERTERS[self.datatypes[name]] or long
+            for name in names
+        ]
+        result = EntityList()
+        for rec in rs:
+            result.append(klass(
+                (name, convert(value))
+                for name, convert, value in zip(names, converters, rec)
+                if value is not None
+            ))
+        return result
+
+    def _select(self, fields, alias=''):
+        """returns the columns to select, all of them if fields is None"""
+        if fields is None:
+            return alias + '*'
+        return ', '.join(
+            alias + quote(name) for name in ['_id'] + [
+                field for field in fields if field in self.datatypes
+            ]
+        )
+
+    def get(self, ids, klass, fields=None):
+        """returns the entities with the given ids"""
+        cmd = 'select {} from {} where _id in ({})'.format(
+            self._select(fields), quote(self.name),
+            ','.join(['%s'] * len(ids)))
+        return self.entities(self.db(cmd, *ids), klass)
+
+    def all(self, klass, fields=None):
+        """returns all entities in id order"""
+        cmd = 'select {} from {} order by _id'.format(
+            self._select(fields), quote(self.name))
+        return self.entities(self.db(cmd), klass)
+
+    def join(self, cmd, params, order, klass, fields=None):
+        """returns the entities selected by a row_id statement"""
+        cmd = (
+            'select {} from {} w '
+            'join ({}) f on f.row_id=w._id '
+            'order by {}'
+        ).format(
+            self._select(fields, 'w.'), quote(self.name), cmd,
+            order or 'f.row_id')
+        return self.entities(self.db(cmd, *params), klass)
+
+    def aggregate(self, source, params, groups, count, measures):
+        """
+        compute aggregates of the entities selected by a row_id statement
+
+        See EntityStore.aggregate.
+        """
+        from zoom.store import EntityList, measured, NUMBER_TYPES
+        import zoom.utils
+
+        def column(name):
+            if name in self.datatypes:
+                return self._expression(name, 'w.')
+            return 'null'
+
+        columns = [column(name) for name in groups]
+        if count:
+            columns.append('count(*)')
+        columns.extend(
+            '{}({})'.format(function, column(name))
+            for function, name in measures
+        )
+        cmd = 'select {} from ({}) f join {} w on w._id=f.row_id'.format(
+            ', '.join(columns), source, quote(self.name))
+        if groups:
+            cmd += ' group by ' + ', '.join(column(name) for name in groups)
+
+        rows = []
+        for rec in self.db(cmd, *params):
+            values = iter(rec)
+            row = zoom.utils.Record()
+            for name in groups:
+                value = next(values)
+                if value is not None:
+                    value = CONVERTERS[self.datatypes[name]](value)
+                row[name] = value
+            if count:
+                row['count'] = int(next(values))
+            for function, name in measures:
+                value = next(values)
+                datatype = self.datatypes.get(name, 'NoneType')
+                if function in ['sum', 'avg'] or datatype in NUMBER_TYPES:
+                    value = measured(function, value, [datatype])
+                elif value is not None:
+                    value = CONVERTERS[datatype](value)
+                row[function + '_' + name] = value
+            rows.append(row)
+
+        return EntityList(sorted(
+            rows, key=lambda row: [row[name] for name in groups]
+        ))
+
+    def value(self, id, attribute):
+        """returns the value of an attribute of an entity as it is stored"""
+        if attribute in self.datatypes:
+            cmd = 'select {} from {} where _id=%s'.format(
+                quote(attribute), quote(self.name))
+            for rec in self.db(cmd, id):
+                return rec[0]
+
+    def exists(self, ids):
+        """returns the ids that are in the table"""
+        cmd = 'select _id from {} where _id in ({})'.format(
+            quote(self.name), ','.join(['%s'] * len(ids)))
+        return [rec[0] for rec in self.db(cmd, *ids)]
+
+    def delete(self, ids):
+        cmd = 'delete from {} where _id in ({})'.format(
+            quote(self.name), ','.join(['%s'] * len(ids)))
+        self.db(cmd, *ids)
+
+    def clear(self):
+        self.db('delete from {}'.format(quote(self.name)))
+
+    def count(self):
+        cmd = 'select count(*) n from {}'.format(quote(self.name))
+        return int(list(self.db(cmd))[0][0])
+
+    def finder(self, kv, descending=False, limit=None, order_by=None):
+        """
+        compile search criteria into a statement selecting row_ids
+
+        The statement selects the same columns as EntityStore._finder so
+        the stores can treat them alike.
+        """
+        from zoom.store import fixval
+        import zoom.expressions as expressions
+
+        clauses = []
+        params = []
+        for name, value in kv.items():
+            name = name.lower()
+            if isinstance(value, expressions.Equal):
+                value = value.value
+            elif isinstance(value, expressions.Occurs):
+                value = list(value.value)
+            if value is None:
+                continue
+            if name not in self.datatypes:
+                return None
+            column = self._expression(name)
+            if isinstance(value, expressions.SearchTerm):
+                clauses.append('{}{}%s'.format(column, value.operator))
+                params.append(fixval(value.value))
+            elif isinstance(value, (list, tuple)):
+                if not value:
+                    return None
+                clauses.append('{} in ({})'.format(
+                    column, ','.join(['%s'] * len(value))))
+                params.extend(fixval(v) for v in value)
+            else:
+                clauses.append('{}=%s'.format(column))
+                params.append(fixval(value))
+
+        if not clauses:
+            return None
+
+        direction = descending and ' desc' or ''
+        value = 'null'
+        if order_by:
+            direction = order_by.startswith('-') and ' desc' or ''
+            attribute = order_by.lstrip('-').lower()
+            if attribute in self.datatypes:
+                value = self._expression(attribute)
+
+        cmd = (
+            'select _id as row_id, null as number, {value} as value '
+            'from {table} where {where} '
+            'order by {order}'
+        ).format(
+            value=value,
+            table=quote(self.name),
+            where=' and '.join(clauses),
+            order=order_by and 'value{0}, row_id{0}' or 'row_id{0}',
+        ).format(direction)
+        if limit is not None:
+            cmd += ' limit {:d}'.format(limit)
+        return cmd, params
+
+    def pager(self, after, size, order_by=None):
+        """
+        compile a statement selecting a page of row_ids
+
+        Returns the statement, its parameters and the order of the page.
+        """
+        params = []
+        if order_by:
+            descending = order_by.startswith('-')
+            attribute = order_by.lstrip('-').lower()
+            op, direction = descending and ('<', ' desc') or ('>', '')
+            if attribute not in self.datatypes:
+                return 'select _id as row_id from {} where 0=1'.format(
+                    quote(self.name)), [], None
+            column = self._expression(attribute)
+            cmd = 'select _id as row_id, {0} as value from {1} where {0} is not null'.format(
+                column, quote(self.name))
+            if after is not None:
+                value, row_id = after
+                cmd += ' and ({0}{1}%s or ({0}=%s and _id{1}%s))'.format(column, op)
+                params.extend([value, value, row_id])
+            cmd += ' order by value{0}, row_id{0} limit {1:d}'.format(
+                direction, size)
+            return cmd, params, 'f.value{0}, f.row_id{0}'.format(direction)
+
+        cmd = 'select _id as row_id from {}'.format(quote(self.name))
+        if after is not None:
+            cmd += ' where _id>%s'
+            params.append(after)
+        cmd += ' order by _id limit {:d}'.format(size)
+        return cmd, params, None
+
+    def slicer(self, offset, limit):
+        """compile a statement selecting row_ids by position"""
+        return (
+            'select _id as row_id from {} order by _id limit {:d} offset {:d}'
+        ).format(quote(self.name), limit, offset)
+
+
+def _tables(db, rows):
+    return dict(
+        (name, WideTable(
+            db, name, table_name, state, zoom.jsonz.loads(columns)))
+        for name, state, table_name, columns in rows
+    )
+
+
+def lookup(db, kind):
+    """
+    returns the WideTable of a kind or None if it is not materialized
+
+    The materialized kinds are read once per database connection and
+    read again once zoom.layouts has forgotten them.  A site without
+    the materialized_kinds table has none.
+
+        >>> db = setup_test()
+        >>> lookup(db, 'person')
+        >>> cmd = 'insert into materialized_kinds values (%s,%s,%s,%s)'
+        >>> id = db(cmd, 'person', 'dual', 'person_entities', '[]')
+        >>> lookup(db, 'person')
+        >>> zoom.layouts.forget(db)
+        >>> lookup(db, 'person').state
+        'dual'
+        >>> _refresh(db)
+
+    """
+    cmd = 'select kind, state, table_name, columns from materialized_kinds'
+    kinds = getattr(db, 'materialized_kinds', None)
+    if kinds is None:
+        try:
+            kinds = _tables(db, db(cmd))
+        except Exception as error:
+            if not missing_table(error):
+                raise
+            kinds = False
+        db.materialized_kinds = kinds
+    if kinds is not False:
+        return kinds.get(kind)
+
+
+def _refresh(db):
+    db.materialized_kinds = None
+
+
+def attribute_types(db, kind):
+    """returns the (attribute, datatype) columns a kind needs"""
+    cmd = (
+        'select attribute, datatype from {} '
+        'where kind=%s group by attribute, datatype order by attribute'
+    ).format(zoom.partitions.lookup(db, kind).attributes)
+    found = {}
+    for attribute, datatype in db(cmd, kind):
+        found.setdefault(attribute, []).append(datatype)
+    return [
+        (attribute, merge(kind, attribute, datatypes))
+        for attribute, datatypes in sorted(found.items())
+    ]
+
+
+def _entity_store(db, kind):
+    from zoom.store import EntityStore
+    store = EntityStore(db, kind)
+    store.use_identity_map = False
+    return store
+
+
+def _copy(db, table, kind, ids=None):
+    """copy entities from the attributes table to the wide table"""
+    store = _entity_store(db, kind)
+    if ids is None:
+        count = 0
+        for page in _pages(store):
+            table.write(page)
+            count += len(page)
+        return count
+    entities = store.get(list(ids))
+    table.write(entities)
+    return len(entities)
+
+
+def _pages(store, size=1000):
+    after = None
+    while True:
+        page, after = store.page(after, size)
+        if page:
+            yield page
+        if after is None:
+            break
+
+
+def start(db, kind, table_name=None):
+    """
+    start materializing a kind
+
+    Creates the table, registers the kind for dual writes and copies
+    the existing entities.  Returns the number of entities copied.
+
+        >>> db = setup_test()
+        >>> from zoom.store import EntityStore
+        >>> people = EntityStore(db, 'person')
+        >>> people.put_many([
+        ...     dict(name='Sam', age=25, born=datetime.date(1990, 1, 1)),
+        ...     dict(name='Sally', age=55, salary=decimal.Decimal('10.50')),
+        ... ])
+        [1L, 2L]
+        >>> start(db, 'person')
+        2
+        >>> state(db, 'person')
+        'dual'
+        >>> people.put(dict(name='Bob', age=25))
+        3L
+        >>> verify(db, 'person')
+        []
+        >>> complete(db, 'person')
+        3
+        >>> people = EntityStore(db, 'person')
+        >>> sally = people.first(name='Sally')
+        >>> sally['_id'], sally['salary'], sally['age']
+        (2L, Decimal('10.50'), 55)
+        >>> [p['name'] for p in people.find(age=25)]
+        ['Sam', 'Bob']
+        >>> people.put(dict(name=u'Ann', born=datetime.date(2001, 2, 3)))
+        4L
+        >>> people.get(4)['born']
+        datetime.date(2001, 2, 3)
+        >>> print db('select count(*) from attributes where kind=%s', 'person').first()[0]
+        0
+        >>> revert(db, 'person')
+        4
+        >>> state(db, 'person')
+        >>> len(EntityStore(db, 'person').find(age=25))
+        2
+
+    """
+    if lookup(db, kind) is not None:
+        raise TypeException('{} is already materialized'.format(kind))
+
+    columns = attribute_types(db, kind)
+    name = table_name or kind + '_entities'
+    definitions = ['`_id` int not null'] + [
+        '{} {}'.format(quote(attribute), COLUMN_TYPES[datatype])
+        for attribute, datatype in columns
+    ] + ['PRIMARY KEY (`_id`)'] + [
+        key(attribute, datatype) for attribute, datatype in columns
+    ]
+    db('create table {} (\n    {}\n    )'.format(
+        quote(name), ',\n    '.join(definitions)))
+
+    db(
+        'insert into materialized_kinds (kind, state, table_name, columns) '
+        'values (%s,%s,%s,%s)',
+        kind, 'dual', name, zoom.jsonz.dumps(columns)
+    )
+    zoom.layouts.changed(db)
+    return _copy(db, lookup(db, kind), kind)
+
+
+def state(db, kind):
+    """returns the materialization state of a kind"""
+    _refresh(db)
+    table = lookup(db, kind)
+    return table and table.state
+
+
+def verify(db, kind, repair=False):
+    """
+    compare the wide table of a kind with its attributes
+
+    Returns the ids of the entities that differ.  If repair is True they
+    are copied again and rows without entities are removed.
+    """
+    table = lookup(db, kind)
+    if table is None or table.state != 'dual':
+        raise TypeException('{} is not being materialized'.format(kind))
+
+    def differs(entity, row):
+        # null columns hold attributes that are None or that are missing
+        if row is None:
+            return True
+        names = set(entity) | set(row) | set(table.datatypes)
+        return any(entity.get(name) != row.get(name) for name in names)
+
+    store = _entity_store(db, kind)
+    differ = []
+    seen = set()
+    for page in _pages(store):
+        ids = [entity['_id'] for entity in page]
+        seen.update(ids)
+        rows = dict((row['_id'], row) for row in table.get(ids, dict))
+        differ.extend(
+            entity['_id'] for entity in page
+            if differs(entity, rows.get(entity['_id']))
+        )
+
+    cmd = 'select _id from {}'.format(quote(table.name))
+    extra = [rec[0] for rec in db(cmd) if rec[0] not in seen]
+
+    if repair:
+        if differ:
+            _copy(db, table, kind, differ)
+        if extra:
+            table.delete(extra)
+
+    return sorted(differ + extra)
+
+
+def complete(db, kind):
+    """
+    finish materializing a kind
+
+    Repairs any differences, switches the kind to its table and removes
+    its attributes rows.  Returns the number of entities in the table.
+    """
+    verify(db, kind, repair=True)
+    db('update materialized_kinds set state=%s where kind=%s', 'wide', kind)
+    attributes = zoom.partitions.lookup(db, kind).attributes
+    db('delete from {} where kind=%s'.format(attributes), kind)
+    zoom.layouts.changed(db)
+    return lookup(db, kind).count()
+
+
+def revert(db, kind, drop=True):
+    """
+    move a materialized kind back into the attributes table
+
+    Returns the number of entities moved.  Stores of kinds that keep a
+    typed index should be reindexed afterwards as the index is not
+    kept while the kind is in its table.
+    """
+    from zoom.store import encode, attribute_rows
+
+    table = lookup(db, kind)
+    if table is None:
+        raise TypeException('{} is not materialized'.format(kind))
+
+    count = 0
+    if table.state == 'wide':
+        attributes = zoom.partitions.lookup(db, kind).attributes
+        db('delete from {} where kind=%s'.format(attributes), kind)
+        cmd = (
+            'insert into {} ('
+            '    kind, row_id, attribute, datatype, value'
+            ') values (%s,%s,%s,%s,%s)'
+        ).format(attributes)
+        for entity in table.all(dict):
+            keys, datatypes, values = encode(entity)
+            db.cursor().executemany(
+                cmd, attribute_rows(kind, entity['_id'], keys, datatypes, values)
+            )
+            count += 1
+    else:
+        count = table.count()
+
+    db('delete from materialized_kinds where kind=%s', kind)
+    if drop:
+        db('drop table {}'.format(quote(table.name)))
+    zoom.layouts.changed(db)
+    return count
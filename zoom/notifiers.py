@@ -0,0 +1,291 @@
+"""
+    zoom.notifiers
+
+    wake-ups for queue consumers
+
+    Consumers waiting for messages listen for a notification that a
+    message was put in their topic, checking the topic again when one
+    arrives or when a delay passes.  The delay doubles each time it
+    passes without a notification, up to MAX_DELAY, and starts over
+    when a message turns up, so an idle consumer rarely queries the
+    database and a notified consumer gets its message right away.
+
+    Notifications only reach consumers on the same machine:
+
+        Notifier        sends none, so consumers only back off
+        LocalNotifier   reaches consumers in the same process
+        SocketNotifier  reaches consumers in any process through
+                        Unix domain sockets kept in a directory
+
+    Consumers out of reach of the notifier still get their messages
+    once their delay passes.
+"""
+
+import errno
+import os
+import select
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+from zoom.exceptions import SystemException
+
+# the first and the longest delay between checks of an idle topic
+DELAY = 0.1
+MAX_DELAY = 5
+
+
+class Listener(object):
+    """waits for notifications, backing off while there are none"""
+
+    def __init__(self, delay=DELAY, max_delay=MAX_DELAY):
+        self.initial = delay
+        self.delay = delay
+        self.max_delay = max_delay
+
+    def _wait(self, delay):
+        time.sleep(delay)
+        return False
+
+    def wait(self, timeout=None):
+        """
+        wait for a notification for at most the current delay or timeout
+
+        Returns True if notified.  The delay starts over after a
+        notification and doubles otherwise.
+
+            >>> listener = Notifier().listen('jobs', delay=0.01)
+            >>> listener.wait(), listener.wait(), listener.delay
+            (False, False, 0.04)
+            >>> listener.reset()
+            >>> listener.delay
+            0.01
+
+        """
+        delay = self.delay
+        if timeout is not None:
+            delay = max(min(delay, timeout), 0)
+        notified = self._wait(delay)
+        if notified:
+            self.reset()
+        else:
+            self.delay = min(self.delay * 2, self.max_delay)
+        return notified
+
+    def reset(self):
+        """start the delay over, as when a message has been found"""
+        self.delay = self.initial
+
+    def close(self):
+        """stop listening"""
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Notifier(object):
+    """a notifier that sends no notifications"""
+
+    def listen(self, topic, delay=DELAY):
+        """returns a Listener for the messages put in topic, or in any
+        topic if topic is None
+
+        Consumers should listen before they check the topic so a
+        message put in between still wakes them.
+        """
+        return Listener(delay)
+
+    def notify(self, topic):
+        """wake the consumers listening to topic"""
+        pass
+
+
+class LocalListener(Listener):
+    """listens for notifications from the same process"""
+
+    def __init__(self, notifier, topic, delay=DELAY):
+        Listener.__init__(self, delay)
+        self.notifier = notifier
+        self.topic = topic
+        self.seen = notifier.versions.get(topic, 0)
+
+    def _wait(self, delay):
+        condition = self.notifier.condition
+        versions = self.notifier.versions
+        condition.acquire()
+        try:
+            if versions.get(self.topic, 0) == self.seen:
+                condition.wait(delay)
+            version = versions.get(self.topic, 0)
+            notified, self.seen = version != self.seen, version
+            return notified
+        finally:
+            condition.release()
+
+
+class LocalNotifier(Notifier):
+    """
+    notifies consumers in the same process
+
+        >>> notifier = LocalNotifier()
+        >>> listener = notifier.listen('jobs')
+        >>> everything = notifier.listen(None)
+        >>> notifier.notify('jobs')
+        >>> listener.wait(), everything.wait()
+        (True, True)
+        >>> notifier.notify('mail')
+        >>> listener.wait(0.01), everything.wait(0.01)
+        (False, True)
+
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.versions = {}
+
+    def listen(self, topic, delay=DELAY):
+        return LocalListener(self, topic, delay)
+
+    def notify(self, topic):
+        self.condition.acquire()
+        try:
+            for key in set([topic, None]):
+                self.versions[key] = self.versions.get(key, 0) + 1
+            self.condition.notify_all()
+        finally:
+            self.condition.release()
+
+
+class SocketListener(Listener):
+    """listens for notifications on a Unix domain socket of its own"""
+
+    def __init__(self, path, topic, delay=DELAY):
+        Listener.__init__(self, delay)
+        self.topic = topic
+        self.address = os.path.join(
+            path, '{}-{}.sock'.format(os.getpid(), uuid.uuid4().hex[:8]))
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(self.address)
+        self.socket.setblocking(0)
+
+    def _received(self):
+        """read the notifications waiting on the socket and return True
+        if any of them was for the topic"""
+        notified = False
+        while True:
+            try:
+                topic = self.socket.recv(1024).decode('utf8')
+            except socket.error:
+                return notified
+            notified = notified or self.topic in (None, topic or None)
+
+    def _wait(self, delay):
+        deadline = time.time() + delay
+        while True:
+            remaining = deadline - time.time()
+            try:
+                readable = select.select(
+                    [self.socket], [], [], max(remaining, 0))[0]
+            except select.error as error:
+                if error.args[0] != errno.EINTR:
+                    raise
+                readable = []
+            if readable and self._received():
+                return True
+            if time.time() >= deadline:
+                return False
+
+    def close(self):
+        self.socket.close()
+        try:
+            os.remove(self.address)
+        except OSError:
+            pass
+
+
+class SocketNotifier(Notifier):
+    """
+    notifies consumers in any process on the machine
+
+    Each listener binds a datagram socket in the directory and
+    notify sends the topic to every socket there.
+
+        >>> import shutil
+        >>> path = tempfile.mkdtemp()
+        >>> notifier = SocketNotifier(path)
+        >>> listener = notifier.listen('jobs')
+        >>> SocketNotifier(path).notify('jobs')
+        >>> listener.wait()
+        True
+        >>> notifier.notify('mail')
+        >>> listener.wait(0.01)
+        False
+        >>> listener.close()
+        >>> os.listdir(path)
+        []
+        >>> shutil.rmtree(path)
+
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(tempfile.gettempdir(), 'zoom-queues')
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                if not os.path.isdir(self.path):
+                    raise
+
+    def listen(self, topic, delay=DELAY):
+        return SocketListener(self.path, topic, delay)
+
+    def notify(self, topic):
+        message = (topic or u'').encode('utf8')
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sender.setblocking(0)
+        try:
+            for name in os.listdir(self.path):
+                if not name.endswith('.sock'):
+                    continue
+                address = os.path.join(self.path, name)
+                try:
+                    sender.sendto(message, address)
+                except socket.error as error:
+                    if error.args[0] == errno.ECONNREFUSED:
+                        # left behind by a listener that didn't close
+                        try:
+                            os.remove(address)
+                        except OSError:
+                            pass
+        finally:
+            sender.close()
+
+
+# shared by the queues of a process that don't name a notifier
+local = LocalNotifier()
+
+
+def notifier(name='local', path=None):
+    """
+    returns a notifier by name
+
+        >>> path = tempfile.gettempdir()
+        >>> notifier('socket', path).path == path
+        True
+        >>> notifier() is local
+        True
+
+    """
+    if name == 'socket':
+        return SocketNotifier(path)
+    elif name == 'local':
+        return local
+    elif name in ('none', '', None):
+        return Notifier()
+    raise SystemException('unknown notifier {!r}'.format(name))
@@ -0,0 +1,285 @@
+"""
+    zoom.partitions
+
+    per-kind entity tables
+
+    Entity kinds normally share the entities and attributes tables, so a
+    kind with a great many entities slows down the lookups of every
+    other kind.  A partitioned kind keeps its entities and attributes in
+    tables of its own with the same columns and indexes, which
+    EntityStore reads and writes in place of the shared tables so app
+    code doesn't change.
+
+    Kinds are partitioned in one of two ways:
+
+        stores with partitioned = True create the tables of their kind
+        when they first use a kind that has nothing stored yet
+
+        move copies the entities of an existing kind into tables of its
+        own and removes them from the shared tables; merge moves them
+        back
+
+    Both are available as the 'zoom partition <kind> move|merge'
+    command.  Stores look up the partitioned kinds in the
+    entity_partitions table once per database connection.  Partitioning
+    records the change with zoom.layouts so connections that are kept
+    open read the new tables the next time they check.  Sites without
+    the table share the tables between all kinds.
+
+    Entity ids are only unique within a table, so a partitioned kind
+    can reuse the ids of other kinds.
+"""
+
+import re
+
+import zoom.layouts
+from zoom.db import missing_table
+from zoom.exceptions import TypeException
+
+
+def setup_test():
+    from zoom.store import setup_test
+    db = setup_test()
+    for kind in ['person', 'account']:
+        db('drop table if exists entities_{}'.format(kind))
+        db('drop table if exists attributes_{}'.format(kind))
+    return db
+
+
+class Partition(object):
+    """the entities and attributes tables of a kind"""
+
+    def __init__(self, entities='entities', attributes='attributes'):
+        self.entities = entities
+        self.attributes = attributes
+
+    @property
+    def shared(self):
+        """True if the tables are the ones shared by all kinds"""
+        return self.entities == 'entities'
+
+
+SHARED = Partition()
+
+
+def names(kind):
+    """returns the default table names of a partitioned kind
+
+        >>> names('person')
+        ('entities_person', 'attributes_person')
+        >>> names('my-app.message')
+        ('entities_my_app_message', 'attributes_my_app_message')
+
+    """
+    base = re.sub(r'\W', '_', kind)
+    return 'entities_' + base, 'attributes_' + base
+
+
+def _registry(db):
+    """the partitioned kinds read on a database connection or None if the
+    site has no entity_partitions table"""
+    kinds = getattr(db, 'entity_partitions', None)
+    if kinds is None:
+        try:
+            rows = list(db(
+                'select kind, entities_table, attributes_table '
+                'from entity_partitions'
+            ))
+            kinds = dict(
+                (kind, Partition(entities, attributes))
+                for kind, entities, attributes in rows
+            )
+        except Exception as error:
+            if not missing_table(error):
+                raise
+            kinds = False
+        db.entity_partitions = kinds
+    if kinds is not False:
+        return kinds
+
+
+def _stored(db, kind):
+    cmd = 'select id from entities where kind=%s limit 1'
+    return bool(list(db(cmd, kind)))
+
+
+def lookup(db, kind, create=False):
+    """
+    returns the Partition of a kind
+
+    Kinds that are not partitioned get the shared tables.  If create is
+    True and nothing of the kind is stored in the shared tables its
+    tables are created.  The partitioned kinds are read once per
+    connection and read again once zoom.layouts has forgotten them.
+
+        >>> db = setup_test()
+        >>> lookup(db, 'person').shared
+        True
+        >>> cmd = (
+        ...     'insert into entity_partitions '
+        ...     '(kind, entities_table, attributes_table) values (%s, %s, %s)')
+        >>> id = db(cmd, 'person', 'entities_person', 'attributes_person')
+        >>> lookup(db, 'person').shared
+        True
+        >>> zoom.layouts.forget(db)
+        >>> lookup(db, 'person').entities
+        'entities_person'
+        >>> db.close()
+
+    """
+    kinds = _registry(db)
+    if kinds is None:
+        return SHARED
+    partition = kinds.get(kind)
+    if partition is not None:
+        return partition
+    if not create:
+        return SHARED
+    if _stored(db, kind):
+        # remember the kind is shared so it is checked once per connection
+        kinds[kind] = SHARED
+        return SHARED
+    return partition_kind(db, kind)
+
+
+def partitioned(db):
+    """returns the partitioned kinds and their Partitions"""
+    kinds = _registry(db) or {}
+    return dict(
+        (kind, partition) for kind, partition in kinds.items()
+        if not partition.shared
+    )
+
+
+def partition_kind(db, kind, entities=None, attributes=None):
+    """
+    create the tables of a kind and use them for it from now on
+
+    The tables are named after the kind unless names are given.  Tables
+    that already exist are used as they are.
+
+        >>> db = setup_test()
+        >>> partition = partition_kind(db, 'person')
+        >>> partition.entities, partition.attributes
+        ('entities_person', 'attributes_person')
+        >>> lookup(db, 'person').attributes
+        'attributes_person'
+        >>> lookup(db, 'account').attributes
+        'attributes'
+        >>> db.close()
+
+    """
+    if not lookup(db, kind).shared:
+        raise TypeException('{} is already partitioned'.format(kind))
+    default_entities, default_attributes = names(kind)
+    partition = Partition(
+        entities or default_entities,
+        attributes or default_attributes,
+    )
+    db('create table if not exists {} like entities'.format(
+        partition.entities))
+    db('create table if not exists {} like attributes'.format(
+        partition.attributes))
+    db(
+        'insert into entity_partitions '
+        '(kind, entities_table, attributes_table) values (%s, %s, %s)',
+        kind, partition.entities, partition.attributes
+    )
+    zoom.layouts.changed(db)
+    return lookup(db, kind)
+
+
+def move(db, kind, entities=None, attributes=None):
+    """
+    move a kind out of the shared tables into tables of its own
+
+    Returns the number of entities moved.  The kind should not be
+    written to while it is moved.
+
+        >>> db = setup_test()
+        >>> from zoom.store import EntityStore
+        >>> people = EntityStore(db, 'person')
+        >>> people.put_many([dict(name='Sam', age=25), dict(name='Sally')])
+        [1L, 2L]
+        >>> EntityStore(db, 'account').put(dict(name='Bank'))
+        3L
+        >>> move(db, 'person')
+        2
+        >>> print db('select count(*) from attributes').first()[0]
+        1
+        >>> people = EntityStore(db, 'person')
+        >>> [p['name'] for p in people.find(age=25)]
+        ['Sam']
+        >>> people.put(dict(name='Bob'))
+        3L
+        >>> merge(db, 'person')
+        Traceback (most recent call last):
+        ...
+        TypeException: person ids are in use in the shared tables: 3
+        >>> EntityStore(db, 'account').delete(3)
+        [3]
+        >>> merge(db, 'person')
+        3
+        >>> lookup(db, 'person').shared
+        True
+        >>> sorted(p['name'] for p in EntityStore(db, 'person'))
+        ['Bob', 'Sally', 'Sam']
+        >>> db.close()
+
+    """
+    partition = partition_kind(db, kind, entities, attributes)
+    db(
+        'insert into {} (id, kind) '
+        'select id, kind from entities where kind=%s order by id'.format(
+            partition.entities), kind
+    )
+    db(
+        'insert into {} (id, kind, row_id, attribute, datatype, value) '
+        'select id, kind, row_id, attribute, datatype, value '
+        'from attributes where kind=%s order by id'.format(
+            partition.attributes), kind
+    )
+    db('delete from attributes where kind=%s', kind)
+    db('delete from entities where kind=%s', kind)
+    cmd = 'select count(*) from {} where kind=%s'.format(partition.entities)
+    return int(list(db(cmd, kind))[0][0])
+
+
+def merge(db, kind, drop=True):
+    """
+    move a partitioned kind back into the shared tables
+
+    Entity ids have to be free in the shared tables.  Returns the number
+    of entities moved.
+    """
+    partition = lookup(db, kind)
+    if partition.shared:
+        raise TypeException('{} is not partitioned'.format(kind))
+
+    cmd = (
+        'select p.id from {} p join entities e on e.id=p.id '
+        'order by p.id limit 10'
+    ).format(partition.entities)
+    taken = [str(rec[0]) for rec in db(cmd)]
+    if taken:
+        raise TypeException('{} ids are in use in the shared tables: {}'.format(
+            kind, ', '.join(taken)))
+
+    db(
+        'insert into entities (id, kind) '
+        'select id, kind from {} order by id'.format(partition.entities)
+    )
+    db(
+        'insert into attributes (kind, row_id, attribute, datatype, value) '
+        'select kind, row_id, attribute, datatype, value '
+        'from {} order by id'.format(partition.attributes)
+    )
+    cmd = 'select count(*) from {}'.format(partition.entities)
+    count = int(list(db(cmd))[0][0])
+
+    db('delete from entity_partitions where kind=%s', kind)
+    if drop:
+        db('drop table if exists {}'.format(partition.attributes))
+        db('drop table if exists {}'.format(partition.entities))
+    zoom.layouts.changed(db)
+    return count
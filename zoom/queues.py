@@ -2,6 +2,18 @@
     zoom.queues
 
     message queues
+
+    Messages are kept in the messages table, one row per message, with
+    the topic, a status, the time the message becomes visible to
+    consumers, the number of times it has been claimed and its JSON
+    payload.  A consumer claims the next ready message of a topic with
+    a single update that marks it with a token of its own, so any
+    number of consumers can pop from a topic without two of them
+    getting the same message.
+
+    Consumers reply to a message in the replies table, keyed by the id
+    of the message, where senders waiting on any number of messages
+    collect them together (see gather).
 """
 
 import uuid
@@ -9,7 +21,8 @@ import time
 import datetime
 import platform
 import logging
-from zoom import json, Record, EntityStore
+from zoom import json, Record
+import zoom.notifiers
 
 __all__ = [
     'Queues',
@@ -19,12 +32,25 @@ __all__ = [
     'StopListening',
     'StopHandling',
     'StopProcessing',
+    'Delivery',
     ]
 
 DELAY = 0.1
 
+# seconds a claimed message stays hidden from other consumers
+VISIBILITY = 60
+
+# the newest message of a topic that reads every message it has
+START = -1
+
 now = datetime.datetime.now
 
+INSERT = (
+    'insert into messages '
+    '(topic, status, visible_at, attempts, node, created, payload) '
+    'values (%s, "ready", now(), 0, %s, now(), %s)'
+)
+
 
 class EmptyException(Exception):
     pass
@@ -51,6 +77,84 @@ def response_topic_name(topic, id):
     return '%s.response.%s' % (topic, id)
 
 
+# the notifications that replies have arrived
+REPLIES = 'zoom.replies'
+
+
+def dead_letter_topic_name(topic):
+    """calculate the name of the topic failed messages are moved to"""
+    return '%s.dead' % topic
+
+
+class Delivery(Record):
+    """a claimed message"""
+    pass
+
+
+def reply(db, replies, notifier=None):
+    """
+    store (message id, reply) pairs for the senders of the messages
+
+    A message gets one reply, so a message that is handled twice
+    keeps its first.
+    """
+    rows = [(row_id, json.dumps(message)) for row_id, message in replies]
+    if rows:
+        db.execute_many(
+            'insert ignore into replies (correlation_id, payload, created) '
+            'values (%s, %s, now())', rows
+        )
+        (notifier or zoom.notifiers.local).notify(REPLIES)
+
+
+def gather(db, jobs, timeout=15, notifier=None, delay=DELAY):
+    """
+    wait for the replies to the messages with ids in jobs
+
+    Returns a dict of the replies received before timeout, keyed by
+    message id, and removes them.  Each check for replies is one select
+    however many are awaited, and one delete if any have arrived.
+
+        >>> messages = setup_test()
+        >>> reply(messages.db, [(1, 'one'), (3, None)])
+        >>> sorted(gather(messages.db, [1, 2, 3], timeout=0.1).items())
+        [(1L, u'one'), (3L, None)]
+        >>> gather(messages.db, [1, 2, 3], timeout=0.1)
+        {}
+
+    """
+    waiting = set(long(job) for job in jobs)
+    replies = {}
+    deadline = time.time() + timeout
+    notifier = notifier or zoom.notifiers.local
+    with notifier.listen(REPLIES, delay) as listener:
+        while waiting:
+            ids = sorted(waiting)
+            cmd = (
+                'select correlation_id, payload from replies '
+                'where correlation_id in ({})'
+            ).format(','.join(['%s'] * len(ids)))
+            found = dict(
+                (long(row_id), json.loads(payload))
+                for row_id, payload in db(cmd, *ids)
+            )
+            if found:
+                db(
+                    'delete from replies where correlation_id in ({})'.format(
+                        ','.join(['%s'] * len(found))),
+                    *found.keys()
+                )
+                replies.update(found)
+                waiting.difference_update(found)
+                listener.reset()
+                continue
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            listener.wait(remaining)
+    return replies
+
+
 class SystemMessage(Record):
     pass
 
@@ -61,6 +165,33 @@ Message = SystemMessage
 def setup_test():
     from zoom.store import setup_test
     db = setup_test()
+    db('drop table if exists replies')
+    db("""
+        create table if not exists replies (
+            correlation_id int not null,
+            payload        longtext,
+            created        datetime,
+            PRIMARY KEY (correlation_id)
+            )
+        """)
+    db('drop table if exists messages')
+    db("""
+        create table if not exists messages (
+            id         int not null auto_increment,
+            topic      varchar(100),
+            status     varchar(10) not null default 'ready',
+            visible_at datetime,
+            attempts   int not null default 0,
+            claimant   varchar(32),
+            node       varchar(100),
+            created    datetime,
+            payload    longtext,
+            PRIMARY KEY (id),
+            KEY `topic_key` (`topic`, `status`, `id`),
+            KEY `status_key` (`status`, `id`),
+            KEY `claimant_key` (`claimant`)
+            )
+        """)
     return Queues(db)
 
 
@@ -84,41 +215,57 @@ class TopicIterator(object):
 class Topic(object):
     """
     message topic
+
+        >>> messages = setup_test()
+        >>> a, b = messages.get('jobs'), messages.get('jobs')
+        >>> a.send('one', 'two')
+        [1L, 2L]
+        >>> a.pop(), b.pop(), a.pop()
+        (u'one', u'two', None)
+
+    A topic reads the messages put after it was created unless newest
+    is given, in which case it reads the messages after that id.  START
+    reads every message of the topic, while 0, like None, reads only
+    the ones put after the topic was created.
+
+        >>> messages.get('jobs').send('three')
+        [3L]
+        >>> messages.get('jobs', START).peek(), messages.get('jobs', 0).peek()
+        (u'three', None)
     """
 
-    def __init__(self, name, newest=None, db=None):
+    def __init__(self, name, newest=None, db=None, notifier=None):
         self.name = name
         self.db = db
-        self.messages = EntityStore(db, Message)
-        self.newest = newest is not None and newest or self.last() or -1
+        self.notifier = notifier or zoom.notifiers.local
+        self.newest = newest or self.last() or START
 
-    def last(self):
-        """get row_id of the last (newest) message in the topic"""
+    def _where(self, *conditions):
+        """the criteria selecting messages of the topic"""
         if self.name:
-            cmd = """
-                select max(row_id) n
-                from attributes
-                where kind=%s and attribute="topic" and value=%s
-                """
-            rec = self.db(cmd, self.messages.kind, self.name)
+            conditions = ('topic=%s',) + conditions
+            params = [self.name]
         else:
-            cmd = 'select max(row_id) n from attributes where kind=%s'
-            rec = self.db(cmd, self.messages.kind)
-        if type(rec) == long:
-            return 0
-        row_id = rec.first()[0]
-        return row_id or 0
+            params = []
+        where = conditions and ' where ' + ' and '.join(conditions) or ''
+        return where, params
+
+    def last(self):
+        """get row_id of the last (newest) message in the topic"""
+        where, params = self._where()
+        cmd = 'select max(id) n from messages' + where
+        return self.db(cmd, *params).first()[0] or 0
+
+    def _topic(self, name, newest=None):
+        """returns another topic on the same database and notifier"""
+        return Topic(name, newest, self.db, self.notifier)
 
     def put(self, message):
         """put a message in the topic"""
-        return self.messages.put(
-                Message(
-                    topic=self.name,
-                    timestamp=now(),
-                    node=platform.node(),
-                    body=json.dumps(message),
-                    )
-                )
+        row_id = self.db(
+            INSERT, self.name, platform.node(), json.dumps(message))
+        self.notifier.notify(self.name)
+        return row_id
 
     def send(self, *messages):
         """send list of messages
@@ -134,33 +281,22 @@ class Topic(object):
         """
         return [self.put(message) for message in messages]
 
-    def _peek(self, newest=None):
+    def _peek_many(self, limit, newest=None):
         top_one = newest is not None and newest or self.newest or 0
-        db = self.db
-        if self.last() > self.newest:
-            if self.name:
-                cmd = """
-                    select min(row_id) as row_id
-                    from attributes
-                    where
-                        kind=%s and attribute="topic" and
-                        value=%s and row_id>%s
-                    """
-                rec = db(cmd, self.messages.kind, self.name, top_one)
-            else:
-                cmd = """
-                    select min(row_id) as row_id
-                    from attributes where kind=%s and row_id>%s
-                    """
-                rec = db(cmd, self.messages.kind, top_one)
-            if type(rec) == long:
-                row_id = 0
-            else:
-                row_id = rec.first()[0]
-            if row_id:
-                message = self.messages.get(row_id)
-                if message:
-                    return row_id, message.topic, json.loads(message.body)
+        where, params = self._where(
+            'status="ready"', 'visible_at<=now()', 'id>%s')
+        cmd = (
+            'select id, topic, payload from messages{} '
+            'order by id limit {:d}'
+        ).format(where, limit)
+        return [
+            (row_id, topic, json.loads(payload))
+            for row_id, topic, payload in self.db(cmd, *(params + [top_one]))
+        ]
+
+    def _peek(self, newest=None):
+        for message in self._peek_many(1, newest):
+            return message
         raise EmptyException
 
     def peek(self, newest=None):
@@ -184,6 +320,21 @@ class Topic(object):
         except EmptyException:
             return None
 
+    def peek_many(self, limit, newest=None):
+        """
+        return up to limit of the next messages but don't remove them
+
+            >>> messages = setup_test()
+            >>> t = messages.get('test_topic')
+            >>> t.send('hey!', 'you!', 'there!')
+            [1L, 2L, 3L]
+            >>> t.peek_many(2)
+            [u'hey!', u'you!']
+            >>> t.peek_many(5)
+            [u'hey!', u'you!', u'there!']
+        """
+        return [message for _, _, message in self._peek_many(limit, newest)]
+
     def _poll(self, newest=None):
         r = self._peek(newest)
         self.newest = r[0]
@@ -222,18 +373,60 @@ class Topic(object):
         """
         return self._poll(newest)[2]
 
+    def _claim(self, limit=1, timeout=VISIBILITY, after=None):
+        """
+        claim up to limit of the next messages for this consumer
+
+        The claim is a single update, so consumers racing for a message
+        can't both get it.  Claimed messages are hidden from other
+        consumers for timeout seconds.  Only messages after the newest
+        one seen are claimed unless after is given.  Returns the claim
+        token or None if there was nothing to claim.
+        """
+        if after is None:
+            after = self.newest or 0
+        token = uuid.uuid4().hex
+        where, params = self._where(
+            'status="ready"', 'visible_at<=now()', 'id>%s')
+        cmd = (
+            'update messages '
+            'set status="claimed", claimant=%s, attempts=attempts+1, '
+            'visible_at=date_add(now(), interval %s second){} '
+            'order by id limit {:d}'
+        ).format(where, limit)
+        self.db(cmd, *([token, timeout] + params + [after]))
+        if self.db.rowcount > 0:
+            return token
+
+    def _claimed(self, limit):
+        """claim and read up to limit messages, returning the claim
+        token and the messages"""
+        token = self._claim(limit)
+        if token is None:
+            return None, []
+        cmd = (
+            'select id, topic, payload from messages '
+            'where claimant=%s order by id'
+        )
+        messages = [
+            (row_id, topic, json.loads(payload))
+            for row_id, topic, payload in self.db(cmd, token)
+        ]
+        self.newest = messages[-1][0]
+        return token, messages
+
+    def _pop_many(self, limit):
+        """claim, read and remove up to limit messages in three
+        statements however many there are"""
+        token, messages = self._claimed(limit)
+        if messages:
+            self.db('delete from messages where claimant=%s', token)
+        return messages
+
     def _pop(self):
-        r = self._peek()
-        row_id = r[0]
-        self.messages.delete(row_id)
-        if self.messages.db.rowcount > 0:
-            self.newest = row_id
-            return r
-        else:
-            # If we were unable to delete it then soneone else
-            # has already deleted it between the time that
-            # we saw it and the time we attempted to delete it.
-            raise EmptyException
+        for message in self._pop_many(1):
+            return message
+        raise EmptyException
 
     def pop(self):
         """
@@ -272,6 +465,128 @@ class Topic(object):
         except EmptyException:
             return None
 
+    def pop_many(self, limit):
+        """
+        read up to limit of the next messages and remove them from
+        the topic
+
+            >>> messages = setup_test()
+            >>> t = messages.get('test_topic')
+            >>> t.send('hey!', 'you!', 'there!')
+            [1L, 2L, 3L]
+            >>> t.pop_many(2)
+            [u'hey!', u'you!']
+            >>> t.pop_many(2)
+            [u'there!']
+            >>> t.pop_many(2)
+            []
+        """
+        return [message for _, _, message in self._pop_many(limit)]
+
+    def claim(self, limit=1, timeout=VISIBILITY):
+        """
+        claim up to limit of the next messages without removing them
+
+        Returns a Delivery for each message.  Messages that are not
+        acknowledged within timeout seconds are delivered again by
+        redeliver.  Claims take the oldest messages of the topic, so
+        messages put back by retry or redeliver are claimed again.
+
+            >>> messages = setup_test()
+            >>> t = messages.get('test_topic', START)
+            >>> t.send('hey!', 'you!')
+            [1L, 2L]
+            >>> hey, = t.claim(timeout=0)
+            >>> hey.message, hey.attempts
+            (u'hey!', 1)
+            >>> t.redeliver()
+            1
+            >>> hey, you = t.claim(2)
+            >>> hey.attempts, t.peek()
+            (2, None)
+            >>> t.acknowledge(hey)
+            1
+            >>> t.retry(you, delay=0)
+            >>> t.peek()
+            u'you!'
+            >>> you, = t.claim()
+            >>> t.dead_letter(you)
+            >>> messages.get('test_topic.dead', START).pop()
+            u'you!'
+        """
+        token = self._claim(limit, timeout, after=0)
+        if token is None:
+            return []
+        cmd = (
+            'select id, topic, payload, attempts from messages '
+            'where claimant=%s order by id'
+        )
+        return [
+            Delivery(
+                id=row_id,
+                topic=topic,
+                message=json.loads(payload),
+                attempts=attempts,
+                claimant=token,
+            )
+            for row_id, topic, payload, attempts in self.db(cmd, token)
+        ]
+
+    def acknowledge(self, *deliveries):
+        """
+        remove claimed messages once they have been handled
+
+        Messages whose claim has expired and been taken by another
+        consumer are left alone.  The messages are removed with one
+        statement.  Returns the number removed.
+        """
+        claims = {}
+        for delivery in deliveries:
+            claims.setdefault(delivery.claimant, []).append(delivery.id)
+        if not claims:
+            return 0
+        clauses, params = [], []
+        for claimant, ids in claims.items():
+            clauses.append('(claimant=%s and id in ({}))'.format(
+                ','.join(['%s'] * len(ids))))
+            params.append(claimant)
+            params.extend(ids)
+        self.db('delete from messages where ' + ' or '.join(clauses), *params)
+        return self.db.rowcount
+
+    def retry(self, delivery, delay=0):
+        """put a claimed message back to be delivered after delay seconds"""
+        self.db(
+            'update messages '
+            'set status="ready", claimant=null, '
+            'visible_at=date_add(now(), interval %s second) '
+            'where id=%s and claimant=%s',
+            delay, delivery.id, delivery.claimant
+        )
+        if not delay:
+            self.notifier.notify(delivery.topic)
+
+    def dead_letter(self, delivery):
+        """move a claimed message to the dead-letter topic of its topic"""
+        topic = dead_letter_topic_name(delivery.topic)
+        self.db(
+            'update messages '
+            'set topic=%s, status="ready", claimant=null, visible_at=now() '
+            'where id=%s and claimant=%s',
+            topic, delivery.id, delivery.claimant
+        )
+        self.notifier.notify(topic)
+
+    def redeliver(self):
+        """make the messages whose claims have expired ready to be
+        claimed again and return the number of them"""
+        where, params = self._where('status="claimed"', 'visible_at<=now()')
+        self.db(
+            'update messages set status="ready", claimant=null' + where,
+            *params
+        )
+        return self.db.rowcount
+
     def len(self, newest=None):
         """
         return the number of messages in the topic
@@ -285,24 +600,26 @@ class Topic(object):
             >>> t.len()
             2L
         """
-        if self.last() > self.newest:
-            if self.name:
-                cmd = """
-                    select count(row_id) as n
-                    from attributes
-                    where kind=%s and attribute="topic" and
-                    value=%s and row_id>%s
-                    """
-                t = self.db(cmd, self.messages.kind, self.name, self.newest)
-            else:
-                cmd = """select count(row_id) as n
-                    from attributes
-                    where kind=%s and row_id>%s
-                    """
-                t = self.db(cmd, self.messages.kind, self.newest)
-            n = t.first()[0] or 0L
-            return n
-        return 0L
+        where, params = self._where('status="ready"', 'id>%s')
+        cmd = 'select count(*) n from messages' + where
+        return long(self.db(cmd, *(params + [self.newest])).first()[0])
+
+    def clear(self):
+        """
+        remove all the messages of the topic
+
+            >>> messages = setup_test()
+            >>> t = messages.get('test_topic')
+            >>> t.send('hey!', 'you!')
+            [1L, 2L]
+            >>> t.clear()
+            2
+            >>> t.len()
+            0L
+        """
+        where, params = self._where()
+        self.db('delete from messages' + where, *params)
+        return self.db.rowcount
 
     def __len__(self):
         """
@@ -353,16 +670,16 @@ class Topic(object):
             (2L, 'test_topic', u'you!')
         """
         deadline = time.time() + timeout
-        while True:
-            try:
-                msg = self._pop()
-            except EmptyException:
-                msg = None
-            if msg:
-                return msg
-            time.sleep(delay)
-            if time.time() > deadline:
-                raise WaitException
+        with self.notifier.listen(self.name, delay) as listener:
+            while True:
+                try:
+                    return self._pop()
+                except EmptyException:
+                    pass
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise WaitException
+                listener.wait(remaining)
 
     def wait(self, delay=DELAY, timeout=15):
         """
@@ -378,15 +695,12 @@ class Topic(object):
             u'hey!'
             >>> t.wait()
             u'you!'
+            >>> t.wait(timeout=0.2)
+            Traceback (most recent call last):
+            ...
+            WaitException
         """
-        deadline = time.time() + timeout
-        while True:
-            msg = self.pop()
-            if msg:
-                return msg
-            time.sleep(delay)
-            if time.time() > deadline:
-                raise WaitException
+        return self._wait(delay, timeout)[2]
 
     def listen(self, f, delay=DELAY, meta=False):
         """
@@ -425,50 +739,122 @@ class Topic(object):
         """
         n = 0L
         done = False
-        while not done:
-            try:
-                more_to_do = True
-                while more_to_do:
-                    try:
-                        p = self._poll()
-                    except EmptyException:
-                        more_to_do = False
-                    else:
-                        if meta:
-                            done = f(p)
+        with self.notifier.listen(self.name, delay) as listener:
+            while not done:
+                try:
+                    more_to_do = True
+                    while more_to_do:
+                        try:
+                            p = self._poll()
+                        except EmptyException:
+                            more_to_do = False
                         else:
-                            done = f(p[2])
-                        n += 1
-            except StopListening:
-                return n
-            else:
-                time.sleep(delay)
+                            if meta:
+                                done = f(p)
+                            else:
+                                done = f(p[2])
+                            n += 1
+                            listener.reset()
+                except StopListening:
+                    return n
+                else:
+                    if not done:
+                        listener.wait()
         return n
 
     def responder(self, job_id):
+        """the response topic of a job, from before replies were kept
+        in the replies table"""
         response_topic = response_topic_name(self.name, job_id)
-        return Topic(response_topic, 1, self.db)
+        return self._topic(response_topic, START)
 
     def respond(self, job_id, message):
-        return self.responder(job_id).send(message)
+        """reply to a message"""
+        self._reply([(job_id, message)])
 
-    def join(self, jobs):
-        """wait for responses from consumers"""
-        return [
-                Topic(
-                    response_topic_name(self.name, job),
-                    newest=job,
-                    db=self.db,
-                    ).wait() for job in jobs
-                ]
+    def _reply(self, replies):
+        reply(self.db, replies, self.notifier)
+
+    def gather(self, jobs, timeout=15):
+        """wait for responses from consumers and return those received
+        before timeout in a dict keyed by job"""
+        return gather(self.db, jobs, timeout, self.notifier)
+
+    def join(self, jobs, timeout=15):
+        """
+        wait for responses from consumers
+
+            >>> messages = setup_test()
+            >>> t = messages.get('test_topic')
+            >>> jobs = t.send(2, 3)
+            >>> t.process(lambda n: n * n)
+            2L
+            >>> t.join(jobs)
+            [4, 9]
+            >>> t.join(jobs, timeout=0.1)
+            Traceback (most recent call last):
+            ...
+            WaitException: 2 of 2 responses missing
+        """
+        replies = self.gather(jobs, timeout)
+        missing = len(jobs) - len(replies)
+        if missing:
+            raise WaitException('{} of {} responses missing'.format(
+                missing, len(jobs)))
+        return [replies[long(job)] for job in jobs]
 
     def call(self, *messages):
         """send messages and wait for responses"""
         return self.join(self.send(*messages))
 
-    def handle(self, f, timeout=0, delay=DELAY, one_pass=False):
+    def _release(self, token, first):
+        """put claimed messages back for the next consumer"""
+        self.db(
+            'update messages '
+            'set status="ready", claimant=null, visible_at=now() '
+            'where claimant=%s', token
+        )
+        self.newest = first - 1
+
+    def _handle_next(self, f, batch_size=None):
+        """handle the next message, or the next batch of messages, and
+        return the number handled
+
+        The messages are claimed while f runs and only removed once it
+        returns, or raises StopHandling.  If f fails they are put back
+        for the next consumer, and if the process dies their claim
+        expires (see redeliver).
+        """
+        token, batch = self._claimed(batch_size or 1)
+        if not batch:
+            raise EmptyException
+        try:
+            if batch_size:
+                results = f([message for _, _, message in batch])
+                if results is None:
+                    results = [None] * len(batch)
+            else:
+                results = [f(batch[0][2])]
+        except StopHandling:
+            self.db('delete from messages where claimant=%s', token)
+            raise
+        except BaseException:
+            self._release(token, batch[0][0])
+            raise
+        self._reply(
+            (row, result) for (row, _, _), result in zip(batch, results))
+        self.db('delete from messages where claimant=%s', token)
+        return len(batch)
+
+    def handle(self, f, timeout=0, delay=DELAY, one_pass=False,
+               batch_size=None):
         """respond to and consume messages
 
+        Given a batch_size, f is passed lists of up to batch_size
+        messages, claimed and removed together, and returns a list of
+        the responses to them or None.  Messages are only removed once
+        f has handled them.
+
             >>> messages = setup_test()
             >>> t = messages.get('test_topic')
             >>> def echo(m):
@@ -484,39 +870,57 @@ class Topic(object):
             got u'hey!'
             got u'you!'
             2L
+
+            >>> t.send('hey!', 'you!', 'there!')
+            [4L, 5L, 6L]
+            >>> def shout(batch):
+            ...     print 'got', len(batch)
+            ...     if batch[-1] == 'there!': raise StopHandling
+            ...     return [m.upper() for m in batch]
+            >>> t.handle(shout, batch_size=2)
+            got 2
+            got 1
+            2L
+            >>> t.join([5])
+            [u'YOU!']
         """
         deadline = timeout and time.time() + timeout
         done = False
         n = 0L
-        while not done:
-            try:
+        listener = self.notifier.listen(self.name, delay)
+        try:
+            while not done:
                 try:
-                    more_to_do = True
-                    while more_to_do:
-                        try:
-                            row, topic, message = self._pop()
-                            result = f(message)
-                            response_topic = response_topic_name(topic, row)
-                            t = Topic(response_topic, None, self.db)
-                            t.send(result)
-                            deadline = timeout and time.time() + timeout
-                            n += 1
-                        except EmptyException:
-                            more_to_do = False
-                        time.sleep(0)
-                except StopHandling:
+                    try:
+                        more_to_do = True
+                        while more_to_do:
+                            try:
+                                n += self._handle_next(f, batch_size)
+                                deadline = timeout and time.time() + timeout
+                                listener.reset()
+                            except EmptyException:
+                                more_to_do = False
+                            time.sleep(0)
+                    except StopHandling:
+                        done = True
+                    else:
+                        remaining = timeout and deadline - time.time()
+                        listener.wait(remaining if timeout else None)
+                except KeyboardInterrupt:
                     done = True
-                else:
-                    time.sleep(delay)
-            except KeyboardInterrupt:
-                done = True
-            if timeout and time.time() > deadline:
-                done = True
+                if timeout and time.time() > deadline:
+                    done = True
+        finally:
+            listener.close()
         return n
 
     def process(self, f):
         """respond to and consume current messages
 
+        Each message is claimed while f runs and only removed once it
+        returns, or raises StopProcessing.  If f fails the message is
+        put back for the next consumer.
+
             >>> messages = setup_test()
             >>> t = messages.get('test_topic')
             >>> def echo(m):
@@ -536,22 +940,25 @@ class Topic(object):
             0L
         """
         n = 0L
-        more_to_do = True
-        while more_to_do:
+        while True:
+            token, batch = self._claimed(1)
+            if not batch:
+                break
+            row, _, message = batch[0]
             try:
-                row, topic, message = self._pop()
                 if message is None:
                     result = f()
                 else:
                     result = f(message)
-                response_topic = response_topic_name(topic, row)
-                t = Topic(response_topic, None, self.db)
-                t.put(result)
-                n += 1
             except StopProcessing:
-                more_to_do = False
-            except EmptyException:
-                more_to_do = False
+                self.db('delete from messages where claimant=%s', token)
+                break
+            except BaseException:
+                self._release(token, row)
+                raise
+            self._reply([(row, result)])
+            self.db('delete from messages where claimant=%s', token)
+            n += 1
             time.sleep(0)
         return n
 
@@ -570,43 +977,44 @@ class Queues(object):
         u'hey!'
     """
 
-    def __init__(self, db=None):
+    def __init__(self, db=None, notifier=None):
         self.db = db
+        self.notifier = notifier
+
+    def join(self, jobs, timeout=15):
+        """wait for the responses to jobs sent to any topics"""
+        return Topic(None, 0, self.db, self.notifier).join(jobs, timeout)
 
     def get(self, name, newest=None):
-        return Topic(name, newest, self.db)
+        return Topic(name, newest, self.db, self.notifier)
 
     def topic(self, name, newest=None):
-        return Topic(name, newest, self.db)
+        return Topic(name, newest, self.db, self.notifier)
 
     def topics(self):
-        cmd = """
-            select distinct value
-            from attributes
-            where kind=%s and attribute="topic"
-            order by value
-            """
-        kind = EntityStore(self.db, Message).kind
-        return [a for a, in self.db(cmd, kind)]
+        cmd = 'select distinct topic from messages order by topic'
+        return [a for a, in self.db(cmd)]
 
     def stats(self):
         cmd = """
-            select value, count(*) as count
-            from attributes
-            where kind=%s and attribute="topic"
-            group by value
+            select topic, count(*) as count
+            from messages
+            group by topic
             """
-        kind = EntityStore(self.db, Message).kind
-        return self.db(cmd, kind)
+        return self.db(cmd)
 
     def clear(self):
-        return EntityStore(self.db, Message).zap()
+        self.db('delete from messages')
+        return self.db.rowcount
 
     def __call__(self, name, newest=None):
-        return Topic(name, newest, self.db)
+        return Topic(name, newest, self.db, self.notifier)
 
     def __str__(self):
-        return str(EntityStore(self.db, Message))
+        return str(self.db(
+            'select id, topic, status, attempts, node, created '
+            'from messages order by id'
+        ))
 
 
 if __name__ == '__main__':
@@ -4,10 +4,16 @@
     record store
 """
 
+import copy
 import datetime
 import decimal
+import re
 
+import zoom.changes
 import zoom.exceptions
+import zoom.expressions
+import zoom.fulltext
+import zoom.rows
 from zoom.utils import Record, RecordList, kind
 
 
@@ -32,11 +38,24 @@ def setup_test():
             PRIMARY KEY (account_id)
             )
         """)
+        db("""
+        create table if not exists search_terms (
+            id int not null auto_increment,
+            kind      varchar(100),
+            row_id    int not null,
+            term      varchar(50),
+            hits      int,
+            PRIMARY KEY (id),
+            KEY `term_key` (`kind`, `term`),
+            KEY `row_id_key` (`kind`, `row_id`)
+            )
+        """)
 
     def delete_test_tables(db):
         """drop test tables"""
         db('drop table if exists person')
         db('drop table if exists account')
+        db('drop table if exists search_terms')
 
     from zoom.db import database
 
@@ -49,26 +68,34 @@ def setup_test():
     )
     delete_test_tables(db)
     create_test_tables(db)
+    forget_schema(db)
     return db
 
 
-def get_result_iterator(rows, cls):
+def get_result_iterator(rows, cls, use_rows=False):
     """returns an iterator that iterates over the rows and zips the names onto
-    the items being iterated so they come back as dicts"""
+    the items being iterated so they come back as dicts, or as rows of a
+    class named after cls if use_rows is True (see zoom.rows)"""
     names = [d[0] == 'id' and '_id' or d[0] for d in rows.cursor.description]
-    for rec in rows:
-        yield cls((k, v) for k, v in zip(names, rec) if v is not None)
+    if use_rows:
+        row = zoom.rows.row_class(names, cls.__name__)
+        for rec in rows:
+            yield row(rec)
+    else:
+        for rec in rows:
+            yield cls((k, v) for k, v in zip(names, rec) if v is not None)
 
 
 class Result(object):
     """rows resulting from a method call"""
     # pylint: disable=too-few-public-methods
-    def __init__(self, rows, cls=dict):
+    def __init__(self, rows, cls=dict, use_rows=False):
         self.rows = rows
         self.cls = cls
+        self.use_rows = use_rows
 
     def __iter__(self):
-        return get_result_iterator(self.rows, self.cls)
+        return get_result_iterator(self.rows, self.cls, self.use_rows)
 
     def __len__(self):
         return self.rows.cursor.rowcount
@@ -80,6 +107,179 @@ class Result(object):
         return str(RecordList(self))
 
 
+def _name(name):
+    """returns name if it is a plain column name"""
+    if not re.match(r'^\w+$', name):
+        raise ValueError('invalid column name {!r}'.format(name))
+    return name
+
+
+def ordering(order_by, column=_name):
+    """compile an order by clause from a column or list of columns,
+    descending if they start with '-' or end with ' desc'
+
+    The names are checked with column, which raises ValueError for a
+    name that is not a column.
+
+        >>> ordering(['-age', 'name asc', 'kids DESC'])
+        'age desc, name, kids desc'
+        >>> ordering('-age;')
+        Traceback (most recent call last):
+        ...
+        ValueError: invalid column name 'age;'
+        >>> ordering('name; drop table person')
+        Traceback (most recent call last):
+        ...
+        ValueError: invalid order by 'name; drop table person'
+
+    """
+    if isinstance(order_by, basestring):
+        order_by = [order_by]
+    clauses = []
+    for name in order_by:
+        words = name.split()
+        descending = name.startswith('-')
+        if descending:
+            words[0] = words[0][1:]
+        elif len(words) == 2 and words[1].lower() in ('asc', 'desc'):
+            descending = words.pop().lower() == 'desc'
+        if len(words) != 1:
+            raise ValueError('invalid order by {!r}'.format(name))
+        clause = column(words[0])
+        clauses.append(descending and clause + ' desc' or clause)
+    return ', '.join(clauses)
+
+
+def like(term):
+    """returns a like pattern matching values that contain term
+
+        >>> like('100%_sure!')
+        '%100!%!_sure!!%'
+
+    """
+    escaped = term.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+    return '%' + escaped + '%'
+
+
+class Written(list):
+    """the ids of the records written by put_many"""
+
+    # the number of rows the database reports written, which for MySQL
+    # counts rows updated by on_conflict='update' twice
+    written = 0
+
+
+def consecutive_ids(db):
+    """returns True if the rows of a multi-row insert get consecutive
+    ids on a database
+
+    MySQL only hands out consecutive ids when innodb_autoinc_lock_mode
+    is 0 or 1; with 2, the default of MySQL 8, the ids of concurrent
+    inserts can interleave.
+    """
+    result = getattr(db, 'consecutive_ids', None)
+    if result is None:
+        if db.engine == 'sqlite':
+            result = True
+        else:
+            cmd = 'select @@innodb_autoinc_lock_mode'
+            result = int(list(db(cmd))[0][0]) < 2
+        db.consecutive_ids = result
+    return result
+
+
+# the limit of statements with an offset but no limit
+MAX_ROWS = 2 ** 63 - 1
+
+# the python types that can be stored
+VALID_TYPES = set([
+    str,
+    unicode,
+    long,
+    int,
+    float,
+    datetime.date,
+    datetime.datetime,
+    bool,
+    type(None),
+    decimal.Decimal,
+])
+
+_schemas = {}
+
+
+class Schema(object):
+    """the columns of a table and the statements that write them
+
+        >>> schema = Schema('person', ['name', 'age'])
+        >>> schema.insert(('name', 'age'))
+        'insert into person (name, age) values (%s,%s)'
+        >>> schema.update(('age',), 'id')
+        'update person set age=%s where id=%s'
+
+    """
+
+    def __init__(self, table, columns):
+        self.table = table
+        self.columns = columns
+        self.names = set(columns)
+        self.statements = {}
+
+    def insert(self, keys):
+        """returns the insert statement for a tuple of columns"""
+        cmd = self.statements.get(('insert', keys))
+        if cmd is None:
+            cmd = self.statements['insert', keys] = (
+                'insert into {} ({}) values ({})'.format(
+                    self.table, ', '.join(keys), ','.join(['%s'] * len(keys)))
+            )
+        return cmd
+
+    def update(self, keys, key):
+        """returns the statement updating a tuple of columns of the
+        row with a key"""
+        cmd = self.statements.get(('update', keys, key))
+        if cmd is None:
+            cmd = self.statements['update', keys, key] = (
+                'update {} set {} where {}=%s'.format(
+                    self.table, ', '.join('%s=%%s' % k for k in keys), key)
+            )
+        return cmd
+
+
+def schema(db, table):
+    """
+    returns the Schema of a table
+
+    Schemas are read once per process and shared by the stores of the
+    database, so code that changes a table should call forget_schema.
+    """
+    key = db.key, table
+    result = _schemas.get(key)
+    if result is None:
+        columns = [rec[0] for rec in db('describe %s' % table) if rec[0] != 'id']
+        result = _schemas[key] = Schema(table, columns)
+    return result
+
+
+def forget_schema(db, table=None):
+    """forget the schema of a table, or of all tables, of a database
+
+        >>> db = setup_test()
+        >>> schema(db, 'person').columns
+        ['name', 'age', 'kids', 'birthdate']
+        >>> db('alter table person add column city varchar(100)')
+        0L
+        >>> forget_schema(db, 'person')
+        >>> schema(db, 'person').columns
+        ['name', 'age', 'kids', 'birthdate', 'city']
+
+    """
+    for key in list(_schemas):
+        if key[0] == db.key and table in (None, key[1]):
+            del _schemas[key]
+
+
 class RecordStore(object):
     """stores records
 
@@ -210,6 +410,28 @@ class RecordStore(object):
 
         """
 
+    # maintain a search index of the stored values (see zoom.fulltext)
+    searchable = False
+
+    # number of records read or written per statement by the batch methods
+    batch_size = 1000
+
+    # share records through the request identity map (see zoom.identity)
+    use_identity_map = True
+
+    # the columns read, or None for all of them (see only)
+    fields = None
+
+    # columns with a MySQL FULLTEXT index for search to match words in,
+    # or None to search all columns with like (see search)
+    fulltext = None
+
+    # append puts and deletes to the change log (see zoom.changes)
+    log_changes = False
+
+    # read lightweight read-only rows in place of records (see rows)
+    use_rows = False
+
     def __init__(self, db, record_class=dict, name=None, key='id'):
         # pylint: disable=invalid-name
         self.db = db
@@ -217,6 +439,61 @@ class RecordStore(object):
         self.kind = name or kind(record_class())
         self.key = key
 
+    @property
+    def index(self):
+        """the search index of the table"""
+        return zoom.fulltext.SearchIndex(self.db, self.kind)
+
+    @property
+    def schema(self):
+        """the schema of the table (see forget_schema)"""
+        return schema(self.db, self.kind)
+
+    def _column(self, name):
+        """returns name if it is a column of the table, so names from
+        callers can be put in statements
+
+            >>> db = setup_test()
+            >>> people = RecordStore(db, Record, 'person')
+            >>> people._column('age')
+            'age'
+            >>> people._column('age=age or 1')
+            Traceback (most recent call last):
+            ...
+            ValueError: age=age or 1 is not a column of person
+            >>> db.close()
+
+        """
+        if name in (self.key, 'id') or name in self.schema.names:
+            return name
+        # the table may have changed since its schema was read
+        forget_schema(self.db, self.kind)
+        if name in self.schema.names:
+            return name
+        raise ValueError('{} is not a column of {}'.format(name, self.kind))
+
+    @property
+    def identity_map(self):
+        """the identity map of the request, if there is one"""
+        if self.use_identity_map and self.fields is None and not self.use_rows:
+            return getattr(self.db, 'identity_map', None)
+
+    def _columns(self, alias=''):
+        """the columns to select"""
+        if self.fields is None:
+            return alias + '*'
+        names = [self.key] + [f for f in self.fields if f != self.key]
+        return ', '.join(alias + name for name in names)
+
+    def _result(self, rows):
+        """the records or rows of a query result"""
+        return Result(rows, self.record_class, self.use_rows)
+
+    @property
+    def _space(self):
+        """the identity map space of the records the store reads"""
+        return 'records', self.record_class
+
     @property
     def id_name(self):
         return self.key == 'id' and '_id' or self.key
@@ -253,50 +530,235 @@ class RecordStore(object):
             <Person {'name': 'James', 'age': 15}>
         """
 
-        table_attributes = self.get_attributes()
-        keys = [k for k in record.keys() if k != '_id' and k in table_attributes]
+        table = self.schema
+        keys = tuple(
+            k for k in record.keys() if k != '_id' and k in table.names
+        )
         values = [record[k] for k in keys]
-        datatypes = [type(i) for i in values]
-        values = [i for i in values]
-        valid_types = [
-            str,
-            unicode,
-            long,
-            int,
-            float,
-            datetime.date,
-            datetime.datetime,
-            bool,
-            type(None),
-            decimal.Decimal,
-        ]
-
-        # pylint: disable=star-args
 
-        for atype in datatypes:
-            if atype not in valid_types:
-                msg = 'unsupported type <type %s>' % atype
+        for value in values:
+            if type(value) not in VALID_TYPES:
+                msg = 'unsupported type <type %s>' % type(value)
                 raise zoom.exceptions.TypeException(msg)
 
-        if self.id_name in record:
-            _id = record[self.id_name]
-            set_clause = ', '.join('%s=%s' % (i, '%s') for i in keys)
-            cmd = 'update %s set %s where %s=%d' % (
-                self.kind,
-                set_clause,
-                self.key,
-                _id
+        try:
+            if self.id_name in record:
+                _id = record[self.id_name]
+                self.db(table.update(keys, self.key), *(values + [_id]))
+            else:
+                _id = self.db(table.insert(keys), *values)
+                record['_id'] = _id
+        except zoom.exceptions.DatabaseException:
+            # the table may have changed since its schema was read
+            forget_schema(self.db, self.kind)
+            raise
+
+        if self.searchable:
+            self.index.update(_id, values)
+
+        if self.identity_map is not None:
+            self.identity_map.discard(self.kind, [_id])
+
+        if self.log_changes:
+            zoom.changes.log(self.db, self.kind, 'put', [(_id, keys)])
+
+        return _id
+
+    def put_many(self, records, on_conflict=None):
+        """
+        stores records in batches
+
+        New records with the same columns are inserted with one
+        statement per batch and take their ids from it, or one statement
+        each where the database does not give the rows of an insert
+        consecutive ids (see consecutive_ids).  Returns the ids in the
+        order given, with the number of rows the database reports
+        written as their written attribute.
+
+            >>> db = setup_test()
+            >>> class Person(Record): pass
+            >>> people = RecordStore(db, Person)
+            >>> people.put_many([
+            ...     Person(name='Sam', age=25),
+            ...     Person(name='Sally', age=55),
+            ...     Person(name='Bob', age=25),
+            ... ])
+            [1L, 2L, 3L]
+            >>> sally = people.get(2)
+            >>> sally.age += 1
+            >>> people.put_many([sally, Person(name='Ann', age=9)])
+            [2L, 4L]
+            >>> print people
+            person
+            _id name  age
+            --- ----- ---
+              1 Sam    25
+              2 Sally  56
+              3 Bob    25
+              4 Ann     9
+            4 person records
+
+        Records with keys are updated one statement each unless
+        on_conflict is 'update', which inserts them in batches, updating
+        the rows that already have their key.  That is how imports write
+        records whose keys may or may not be stored yet.  The statement
+        is written for the engine of the database, MySQL or sqlite.
+
+            >>> ids = people.put_many([
+            ...     Person(_id=4, name='Ann', age=10),
+            ...     Person(_id=7, name='Joe', age=70),
+            ...     Person(name='Kim', age=5),
+            ... ], on_conflict='update')
+            >>> ids, ids.written > 0
+            ([4, 7, 5L], True)
+            >>> [(p.name, p.age) for p in people.find(age=[10, 70, 5], order_by='id')]
+            [('Ann', 10), ('Kim', 5), ('Joe', 70)]
+
+        """
+        if on_conflict not in (None, 'update'):
+            raise ValueError('on_conflict must be None or update')
+
+        records = list(records)
+        table_attributes = self.schema.names
+        size = self.batch_size
+        written = 0
+
+        inserts, updates, upserts = {}, {}, {}
+        for record in records:
+            keys = tuple(
+                k for k in record.keys()
+                if k != '_id' and k in table_attributes
             )
-            self.db(cmd, *values)
+            if self.id_name not in record:
+                inserts.setdefault(keys, []).append(record)
+            elif on_conflict:
+                keys = (self.key,) + tuple(k for k in keys if k != self.key)
+                upserts.setdefault(keys, []).append(record)
+            else:
+                updates.setdefault(keys, []).append(record)
+
+        sqlite = self.db.engine == 'sqlite'
+        # ids are only known for every row of an insert if they are
+        # consecutive, otherwise rows are inserted one at a time
+        step = inserts and consecutive_ids(self.db) and size or 1
+        for keys, group in inserts.items():
+            row = '({})'.format(','.join(['%s'] * len(keys)))
+            for n in range(0, len(group), step):
+                batch = group[n:n + step]
+                cmd = 'insert into %s (%s) values %s' % (
+                    self.kind, ', '.join(keys), ','.join([row] * len(batch)))
+                self.db(cmd, *[rec[k] for rec in batch for k in keys])
+                written += self.db.rowcount
+                first = self.db.lastrowid
+                if sqlite:
+                    # sqlite reports the id of the last row
+                    first -= len(batch) - 1
+                for offset, record in enumerate(batch):
+                    record['_id'] = first + offset
+
+        if sqlite:
+            conflict = 'on conflict ({}) do update set '.format(self.key)
+            value = '{0}=excluded.{0}'
         else:
-            names = ', '.join(keys)
-            placeholders = ','.join(['%s'] * len(keys))
-            cmd = 'insert into %s (%s) values (%s)' % (
-                self.kind, names, placeholders)
-            _id = self.db(cmd, *values)
-            record['_id'] = _id
+            conflict = 'on duplicate key update '
+            value = '{0}=values({0})'
+        for keys, group in upserts.items():
+            row = '({})'.format(','.join(['%s'] * len(keys)))
+            changes = ', '.join(value.format(k) for k in keys[1:] or keys)
+            for n in range(0, len(group), size):
+                batch = group[n:n + size]
+                cmd = 'insert into {} ({}) values {} {}{}'.format(
+                    self.kind, ', '.join(keys), ','.join([row] * len(batch)),
+                    conflict, changes)
+                self.db(cmd, *[
+                    rec[self.id_name] if k == self.key else rec[k]
+                    for rec in batch for k in keys
+                ])
+                written += self.db.rowcount
+
+        for keys, group in updates.items():
+            if keys:
+                cmd = self.schema.update(keys, self.key)
+                cursor = self.db.cursor()
+                cursor.executemany(cmd, [
+                    [rec[k] for k in keys] + [rec[self.id_name]]
+                    for rec in group
+                ])
+                written += cursor.rowcount
+
+        ids = Written(
+            record[self.id_name] if self.id_name in record else record['_id']
+            for record in records
+        )
+        ids.written = written
+
+        if self.identity_map is not None:
+            self.identity_map.discard(self.kind, ids)
+
+        if self.log_changes:
+            zoom.changes.log(self.db, self.kind, 'put', [
+                (id, [k for k in record.keys()
+                      if k != '_id' and k in table_attributes])
+                for id, record in zip(ids, records)
+            ])
+
+        if self.searchable:
+            self.index.update_many(
+                (id, [v for k, v in record.items()
+                      if k not in ('_id', self.id_name)])
+                for id, record in zip(ids, records)
+            )
 
-        return _id
+        return ids
+
+    def get_many(self, keys):
+        """
+        retrieves records in the order of keys
+
+        Keys that are not found come back as None.
+
+            >>> db = setup_test()
+            >>> class Person(Record): pass
+            >>> people = RecordStore(db, Person)
+            >>> people.put_many([Person(name='Sam'), Person(name='Sally')])
+            [1L, 2L]
+            >>> people.get_many([2, 3, 1])
+            [<Person {'name': 'Sally'}>, None, <Person {'name': 'Sam'}>]
+
+        """
+        keys = [long(key) for key in keys]
+        found = {}
+        size = self.batch_size
+        for n in range(0, len(keys), size):
+            for record in self.get(keys[n:n + size]):
+                found[record[self.id_name]] = record
+        return [found.get(key) for key in keys]
+
+    def delete_many(self, keys):
+        """
+        delete records in batches
+
+        Keys can be ids or records.  Returns the ids in the order given.
+
+            >>> db = setup_test()
+            >>> class Person(Record): pass
+            >>> people = RecordStore(db, Person)
+            >>> sam, sally, bob = people.put_many(
+            ...     Person(name=name) for name in ['Sam', 'Sally', 'Bob'])
+            >>> people.delete_many([bob, people.get(sam)])
+            [3L, 1L]
+            >>> people.all()
+            [<Person {'name': 'Sally'}>]
+
+        """
+        ids = [
+            hasattr(key, 'get') and key[self.id_name] or key
+            for key in keys
+        ]
+        size = self.batch_size
+        for n in range(0, len(ids), size):
+            self._delete(ids[n:n + size])
+        return ids
 
     def get(self, keys):
         # pylint: disable=trailing-whitespace
@@ -339,11 +801,13 @@ class RecordStore(object):
 
         if not isinstance(keys, (list, tuple)):
             keys = (keys, )
-            cmd = 'select * from '+self.kind+' where ' + self.key + '=%s'
+            cmd = 'select {} from {} where {}=%s'.format(
+                self._columns(), self.kind, self.key)
             as_list = 0
         else:
             keys = [long(key) for key in keys]
-            cmd = 'select * from {} where {} in ({})'.format(
+            cmd = 'select {} from {} where {} in ({})'.format(
+                self._columns(),
                 self.kind,
                 self.key,
                 ','.join(['%s'] * len(keys))
@@ -356,12 +820,20 @@ class RecordStore(object):
             else:
                 return None
 
+        identity_map = self.identity_map
+        if identity_map is not None and not as_list:
+            rec = identity_map.get(self.kind, keys[0], self._space)
+            if rec is not None:
+                return rec
+
         rows = self.db(cmd, *keys)
 
         if as_list:
-            return Result(rows, self.record_class)
+            return self._result(rows)
 
-        for rec in Result(rows, self.record_class):
+        for rec in self._result(rows):
+            if identity_map is not None:
+                identity_map.add(self.kind, keys[0], rec, self._space)
             return rec
 
     def get_attributes(self):
@@ -380,9 +852,7 @@ class RecordStore(object):
             ['name', 'age', 'kids', 'birthdate']
 
         """
-        cmd = 'describe %s' % self.kind
-        rows = self.db(cmd)
-        return [rec[0] for rec in rows if rec[0] != 'id']
+        return list(self.schema.columns)
 
     def _delete(self, ids):
         if ids:
@@ -390,6 +860,13 @@ class RecordStore(object):
             cmd = 'delete from {} where {} in ({})'.format(
                 self.kind, self.key, spots)
             self.db(cmd, *ids)
+            if self.searchable:
+                self.index.remove(ids)
+            if self.identity_map is not None:
+                self.identity_map.discard(self.kind, ids)
+            if self.log_changes:
+                zoom.changes.log(
+                    self.db, self.kind, 'delete', [(id, None) for id in ids])
             return ids
 
     def delete(self, *args, **kwargs):
@@ -526,6 +1003,12 @@ class RecordStore(object):
         """
         cmd = 'delete from ' + self.kind
         self.db(cmd)
+        if self.searchable:
+            self.index.clear()
+        if self.identity_map is not None:
+            self.identity_map.clear(self.kind)
+        if self.log_changes:
+            zoom.changes.log(self.db, self.kind, 'zap', [(None, None)])
 
     def __len__(self):
         """
@@ -550,18 +1033,8 @@ class RecordStore(object):
         """
         Find keys that meet search critieria
         """
-        items = kv.items()
-        clause = ' and '.join('%s=%s' % (k, '%s') for k, v in items)
-        cmd = ' '.join([
-            'select distinct',
-            self.key,
-            'from',
-            self.kind,
-            'where',
-            clause,
-        ])
-        result = self.db(cmd, *[v for _, v in items])
-        return [i[0] for i in result]
+        cmd, params = self._select('distinct ' + self.key, kv)
+        return [i[0] for i in self.db(cmd, *params)]
 
     def find(self, **kv):
         """
@@ -589,12 +1062,124 @@ class RecordStore(object):
             >>> len(people.find(name='Sam'))
             1
 
+        Only the columns named in fields are read if it is given (see
+        only).
+
+            >>> people.find(age=25, fields=['name'])
+            [<Person {'name': 'Sam'}>, <Person {'name': 'Bob'}>]
+
+        Criteria can be expressions from zoom.expressions, lists of
+        values and None, which selects nulls.  Records can be ordered by
+        one or more columns, descending if they start with '-', and
+        limited in number.
+
+            >>> from zoom.expressions import gt, ne
+            >>> people.find(age=gt(30))
+            [<Person {'name': 'Sally', 'age': 55}>]
+            >>> [p.name for p in people.find(name=['Sam', 'Bob'], order_by='-name')]
+            ['Sam', 'Bob']
+            >>> [p.name for p in people.find(kids=None, order_by=['age', '-name'], limit=2)]
+            ['Sam', 'Bob']
+            >>> people.find(kids=ne(None))
+            []
+
+        """
+        fields = kv.pop('fields', None)
+        if fields is not None:
+            return self.only(*fields).find(**kv)
+        order_by = kv.pop('order_by', None)
+        limit = kv.pop('limit', None)
+        cmd, params = self._select(self._columns(), kv, order_by, limit)
+        return self._result(self.db(cmd, *params))
+
+    def where(self, **kv):
+        """
+        returns a Query of the records that meet criteria
+
+        Criteria are values or zoom.expressions terms by column, or
+        name__operator keywords (see zoom.expressions.lookup).
+
+            >>> db = setup_test()
+            >>> class Person(Record): pass
+            >>> people = RecordStore(db, Person)
+            >>> people.put_many([
+            ...     Person(name='Sam', age=25),
+            ...     Person(name='Sally', age=55),
+            ...     Person(name='Bob', age=35),
+            ... ])
+            [1L, 2L, 3L]
+            >>> [p.name for p in people.where(age__gt=30).order_by('-age')]
+            ['Sally', 'Bob']
+            >>> people.where(age__lt=30).count()
+            1
+            >>> people.where(name__in=['Ann', 'Joe']).exists()
+            False
+
+        """
+        return Query(self).where(**kv)
+
+    def only(self, *fields):
+        """
+        returns a view of the store that reads only the named columns
+
+        Records read through the view have their id and whichever of the
+        fields are not null.  Putting them writes just the columns they
+        have, so the other columns keep their values.
+
+            >>> db = setup_test()
+            >>> class Person(Record): pass
+            >>> people = RecordStore(db, Person)
+            >>> people.put_many([
+            ...     Person(name='Sam', age=25), Person(name='Sally', age=55)
+            ... ])
+            [1L, 2L]
+            >>> names = people.only('name')
+            >>> list(names)
+            [<Person {'name': 'Sam'}>, <Person {'name': 'Sally'}>]
+            >>> sam = names.get(1)
+            >>> sam.name = 'Samuel'
+            >>> people.put(sam)
+            1L
+            >>> people.get(1)
+            <Person {'name': 'Samuel', 'age': 25}>
+
+        """
+        view = copy.copy(self)
+        view.fields = list(fields)
+        return view
+
+    def rows(self):
         """
-        items = kv.items()
-        where_clause = ' and '.join('%s=%s' % (k, '%s') for k, v in items)
-        cmd = 'select * from ' + self.kind + ' where ' + where_clause
-        result = self.db(cmd, *[v for _, v in items])
-        return Result(result, self.record_class)
+        returns a view of the store that reads read-only rows
+
+        Rows take less memory and are quicker to read than records,
+        which suits reading large numbers of records without changing
+        them (see zoom.rows).
+
+            >>> db = setup_test()
+            >>> class Person(Record): pass
+            >>> people = RecordStore(db, Person)
+            >>> people.put_many([
+            ...     Person(name='Sam', age=25), Person(name='Sally', age=55)
+            ... ])
+            [1L, 2L]
+            >>> rows = people.rows()
+            >>> list(rows.where(age__gt=30))
+            [<Person {'name': 'Sally', 'age': 55}>]
+            >>> sam = rows.get(1)
+            >>> sam.name, sam['age'], sam.get('kids', 0)
+            ('Sam', 25, 0)
+            >>> print rows.find(name='Sam')
+            person
+            _id name age
+            --- ---- ---
+              1 Sam   25
+            1 person records
+
+        """
+        view = copy.copy(self)
+        view.use_rows = True
+        return view
 
     def first(self, **kv):
         """
@@ -612,7 +1197,7 @@ class RecordStore(object):
             <Person {'name': 'Sam', 'age': 25}>
 
         """
-        for item in self.find(**kv):
+        for item in self.find(limit=1, **kv):
             return item
 
     def last(self, **kv):
@@ -631,12 +1216,117 @@ class RecordStore(object):
             <Person {'name': 'Bob', 'age': 25}>
 
         """
-        rows = self._find(**kv)
-        if rows:
-            return self.get(rows[-1])
-        return None
+        for item in self.find(order_by='-' + self.key, limit=1, **kv):
+            return item
+
+    def _select(self, columns, criteria, order_by=None, limit=None,
+                offset=None):
+        """compile a select statement of the records that meet criteria"""
+        cmd = 'select {} from {}'.format(columns, self.kind)
+        clause, params = self._where(criteria)
+        if clause:
+            cmd += ' where ' + clause
+        if order_by:
+            cmd += ' order by ' + ordering(order_by, self._column)
+        if limit is not None or offset is not None:
+            cmd += ' limit {:d}'.format(limit is None and MAX_ROWS or limit)
+        if offset:
+            cmd += ' offset {:d}'.format(offset)
+        return cmd, params
+
+    def _where(self, criteria):
+        """compile criteria, a dict or list of (column, value) pairs, into
+        a where clause and its parameters"""
+        clauses = []
+        params = []
+        if hasattr(criteria, 'items'):
+            criteria = criteria.items()
+        for name, value in criteria:
+            name = self._column(name)
+            if isinstance(value, zoom.expressions.Equal):
+                value = value.value
+            elif isinstance(value, zoom.expressions.Occurs):
+                value = list(value.value)
+            if value is None:
+                clauses.append('{} is null'.format(name))
+            elif isinstance(value, zoom.expressions.NotEqual) and value.value is None:
+                clauses.append('{} is not null'.format(name))
+            elif isinstance(value, zoom.expressions.SearchTerm):
+                clauses.append('{}{}%s'.format(name, value.operator))
+                params.append(value.value)
+            elif isinstance(value, (list, tuple)):
+                if not value:
+                    clauses.append('0=1')
+                else:
+                    clauses.append('{} in ({})'.format(
+                        name, ','.join(['%s'] * len(value))))
+                    params.extend(value)
+            else:
+                clauses.append('{}=%s'.format(name))
+                params.append(value)
+        return ' and '.join(clauses), params
+
+    def aggregate(self, group_by=None, count=False, where=None,
+                  sum=None, avg=None, min=None, max=None):
+        """
+        compute aggregates of the records in one statement
+
+        Records can be grouped by one or more columns and are counted,
+        and have the columns named by sum, avg, min and max aggregated,
+        in each group.  Records can be selected with where, a dict of
+        values or zoom.expressions terms by column.  Returns a Record for
+        each group, in order of the group values, with the aggregates as
+        the database computes them.
+
+            >>> db = setup_test()
+            >>> class Person(Record): pass
+            >>> people = RecordStore(db, Person)
+            >>> people.put_many([
+            ...     Person(name='Sam', age=25, kids=1),
+            ...     Person(name='Sally', age=55, kids=2),
+            ...     Person(name='Bob', age=25),
+            ... ])
+            [1L, 2L, 3L]
+            >>> for row in people.aggregate('age', count=True, sum='kids'):
+            ...     print row.age, row.count, int(row.sum_kids)
+            25 2 1
+            55 1 2
+            >>> row = people.aggregate(count=True, max='name',
+            ...     where=dict(age=zoom.expressions.lt(30)))[0]
+            >>> row.count, row.max_name
+            (2, 'Sam')
 
-    def search(self, text):
+        """
+        from zoom.store import AGGREGATES, listed
+
+        groups = [self._column(name) for name in listed(group_by)]
+        columns = list(groups)
+        if count:
+            columns.append('count(*) as count')
+        columns.extend(
+            '{0}({1}) as {0}_{1}'.format(function, name)
+            for function, names in zip(AGGREGATES, [sum, avg, min, max])
+            for name in map(self._column, listed(names))
+        )
+        cmd = 'select {} from {}'.format(', '.join(columns), self.kind)
+        params = []
+        if where:
+            clause, params = self._where(where)
+            cmd += ' where ' + clause
+        if groups:
+            cmd += ' group by {0} order by {0}'.format(', '.join(groups))
+
+        rows = self.db(cmd, *params)
+        names = [d[0] for d in rows.cursor.description]
+        result = []
+        for rec in rows:
+            row = Record(zip(names, rec))
+            if count:
+                row['count'] = int(row['count'])
+            result.append(row)
+        return RecordList(result)
+
+    def search(self, text, rank=False, limit=None):
         """
         search for records that match text
 
@@ -660,17 +1350,101 @@ class RecordStore(object):
             >>> list(people.search('smi 55'))
             [<Person {'name': 'Sally Mary Smith', 'age': 55}>]
 
+        Records are matched in the database, which looks for each word
+        of the text in any of the columns.  Stores with fulltext columns
+        match whole words and word prefixes through their MySQL FULLTEXT
+        index instead, ranking records by relevance if rank is True.
+
+        Searchable stores look up the words of the text in their search
+        index instead of scanning the table.
+
+            >>> people.searchable = True
+            >>> people.reindex()
+            3
+            >>> list(people.search('bo smi'))
+            [<Person {'name': 'Bob Marvin Smith', 'age': 25}>]
+            >>> id = people.put(Person(name='Joe Smith Smithers', age=30))
+            >>> [p.name for p in people.search('smith', rank=True)]
+            ['Joe Smith Smithers', 'Sally Mary Smith', 'Bob Marvin Smith']
+            >>> people.delete(id)
+            [4L]
+            >>> [p.name for p in people.search('smith', limit=1)]
+            ['Sally Mary Smith']
+
         """
-        def matches(item, terms):
-            """returns True if an item matches the given search terms"""
-            values = [str(i).lower() for i in item.values()]
-            return all(any(t in s for s in values) for t in terms)
+        if self.searchable:
+            query = self.index.query(text, rank, limit)
+            if query:
+                cmd, params = query
+                cmd = (
+                    'select {columns} from {kind} r '
+                    'join ({cmd}) f on f.row_id=r.{key} '
+                    'order by {order}'
+                ).format(
+                    columns=self._columns('r.'),
+                    kind=self.kind,
+                    cmd=cmd,
+                    key=self.key,
+                    order=rank and 'f.score desc, f.row_id' or 'f.row_id',
+                )
+                rows = self.db(cmd, *params)
+                for rec in self._result(rows):
+                    yield rec
 
-        search_terms = list(set([i.lower() for i in text.strip().split()]))
-        for rec in self:
-            if matches(rec, search_terms):
+        else:
+            cmd, params = self._matching(text, rank)
+            if limit is not None:
+                cmd += ' limit {:d}'.format(limit)
+            for rec in self._result(self.db(cmd, *params)):
                 yield rec
 
+    def _matching(self, text, rank=False):
+        """compile a statement selecting the records that match text"""
+        terms = sorted(set(text.lower().split()))
+        if not terms:
+            return 'select {} from {} where 0=1'.format(
+                self._columns(), self.kind), []
+
+        if self.fulltext:
+            words = [re.sub(r'[^\w]', '', term, flags=re.U) for term in terms]
+            match = 'match ({}) against (%s in boolean mode)'.format(
+                ', '.join(self.fulltext))
+            query = ' '.join('+{}*'.format(word) for word in words if word)
+            cmd = 'select {} from {} where {}'.format(
+                self._columns(), self.kind, match)
+            params = [query]
+            if rank:
+                cmd += ' order by {} desc, {}'.format(match, self.key)
+                params.append(query)
+            else:
+                cmd += ' order by {}'.format(self.key)
+            return cmd, params
+
+        columns = [self.key] + [c for c in self.schema.columns if c != self.key]
+        clause = '({})'.format(' or '.join(
+            "lower({}) like %s escape '!'".format(name) for name in columns
+        ))
+        cmd = 'select {} from {} where {} order by {}'.format(
+            self._columns(),
+            self.kind,
+            ' and '.join([clause] * len(terms)),
+            self.key,
+        )
+        params = [like(term) for term in terms for _ in columns]
+        return cmd, params
+
+    def reindex(self):
+        """
+        rebuild the search index from the stored records
+
+        Returns the number of records indexed.
+        """
+        id_name = self.id_name
+        return self.index.rebuild(
+            (rec[id_name], [v for k, v in rec.items() if k != id_name])
+            for rec in self
+        )
+
     def filter(self, function):
         """
         finds records that satisfiy filter
@@ -720,9 +1494,9 @@ class RecordStore(object):
             105
 
         """
-        cmd = 'select * from '+self.kind
+        cmd = 'select {} from {}'.format(self._columns(), self.kind)
         rows = self.db(cmd)
-        return get_result_iterator(rows, self.record_class)
+        return iter(self._result(rows))
 
     def __getitem__(self, index):
         """
@@ -801,3 +1575,138 @@ class RecordStore(object):
 
         """
         return repr(self.all())
+
+
+class Query(object):
+    """
+    a query of the records of a store
+
+    Queries are built by chaining where, order_by, limit and offset,
+    each of which returns a new query, and run when they are iterated
+    through, streaming the records, or when they are counted.  Each
+    query runs as one statement.
+
+        >>> db = setup_test()
+        >>> class Person(Record): pass
+        >>> people = RecordStore(db, Person)
+        >>> people.put_many(
+        ...     Person(name=name, age=age) for name, age in
+        ...     [('Sam', 25), ('Sally', 55), ('Bob', 35), ('Ann', 45)]
+        ... )
+        [1L, 2L, 3L, 4L]
+        >>> older = people.where(age__gte=30).order_by('name')
+        >>> [p.name for p in older.where(name__ne='Bob')]
+        ['Ann', 'Sally']
+        >>> page = older.limit(2).offset(1)
+        >>> page.statement()
+        ('select * from person where age>=%s order by name limit 2 offset 1', [30])
+        >>> [p.name for p in page], page.count(), older.count()
+        (['Bob', 'Sally'], 2, 3)
+        >>> older.first().name
+        'Ann'
+        >>> people.where(age__lt=20).first()
+
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.criteria = []
+        self.ordering = []
+        self.rows = None
+        self.skip = None
+
+    def _copy(self):
+        query = copy.copy(self)
+        query.criteria = list(self.criteria)
+        query.ordering = list(self.ordering)
+        return query
+
+    def where(self, **kv):
+        """returns a query selecting the records that also meet criteria
+
+        Names that are not columns raise ValueError when the query is
+        built rather than when it runs.
+        """
+        query = self._copy()
+        for key, value in kv.items():
+            name, term = zoom.expressions.lookup(key, value)
+            query.criteria.append((self.store._column(name), term))
+        return query
+
+    def order_by(self, *names):
+        """returns a query ordered by columns, descending if they start
+        with '-' or end with ' desc'
+
+            >>> db = setup_test()
+            >>> people = RecordStore(db, Record, 'person')
+            >>> people.where().order_by('age desc', '-name').statement()
+            ('select * from person order by age desc, name desc', [])
+            >>> people.where().order_by('age; drop table person')
+            Traceback (most recent call last):
+            ...
+            ValueError: invalid order by 'age; drop table person'
+            >>> db.close()
+
+        """
+        ordering(names, self.store._column)
+        query = self._copy()
+        query.ordering.extend(names)
+        return query
+
+    def limit(self, rows):
+        """returns a query selecting at most rows records"""
+        query = self._copy()
+        query.rows = rows
+        return query
+
+    def offset(self, rows):
+        """returns a query that skips the first rows records"""
+        query = self._copy()
+        query.skip = rows
+        return query
+
+    def statement(self, columns=None):
+        """returns the statement of the query and its parameters"""
+        return self.store._select(
+            columns or self.store._columns(),
+            self.criteria,
+            self.ordering,
+            self.rows,
+            self.skip,
+        )
+
+    def __iter__(self):
+        cmd, params = self.statement()
+        rows = self.store.db(cmd, *params)
+        return iter(self.store._result(rows))
+
+    def all(self):
+        """returns the records as a list"""
+        return RecordList(self)
+
+    def first(self):
+        """returns the first record or None"""
+        for record in self.limit(1):
+            return record
+
+    def count(self):
+        """returns the number of records without reading them"""
+        if self.rows is None and not self.skip:
+            query = self._copy()
+            query.ordering = []
+            cmd, params = query.statement('count(*)')
+        else:
+            cmd, params = self.statement('1')
+            cmd = 'select count(*) from ({}) q'.format(cmd)
+        return int(list(self.store.db(cmd, *params))[0][0])
+
+    def exists(self):
+        """returns True if any record meets the criteria"""
+        query = self.limit(1)
+        if self.skip is None:
+            query.ordering = []
+        cmd, params = query.statement('1')
+        return bool(list(self.store.db(cmd, *params)))
+
+    def __repr__(self):
+        return repr(self.all())
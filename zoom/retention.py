@@ -0,0 +1,205 @@
+"""
+    zoom.retention
+
+    queue retention
+
+    Messages nobody pops, such as those only ever peeked at or those
+    left on dead-letter topics, and replies nobody waits for would
+    otherwise stay in the messages and replies tables for good.  Topics
+    can be given a retention policy, kept in the queue_retention table,
+    that limits how old their ready messages get (max_age, in seconds)
+    and how many of them are kept (max_count).  A policy applies to
+    the topics its topic matches as a SQL like pattern, so '%.dead'
+    covers every dead-letter topic.
+
+    sweep enforces the policies, and removes replies older than
+    REPLY_AGE, with a few set based statements per policy.  Sites run
+    it with the 'zoom purge' command, from a Sweeper thread or by
+    giving a worker Pool a sweep_interval.
+
+        >>> db = setup_test()
+        >>> from zoom.queues import Queues
+        >>> log = Queues(db).topic('log')
+        >>> log.send(*range(5))
+        [1L, 2L, 3L, 4L, 5L]
+        >>> retain(db, 'log', max_count=2)
+        >>> policies(db)
+        [('log', None, 2)]
+        >>> sweep(db)
+        ({'log': 3}, 0)
+        >>> log.peek_many(5)
+        [3, 4]
+
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger('zoom.retention')
+
+# seconds replies are kept for senders to collect
+REPLY_AGE = 24 * 60 * 60
+
+# seconds between sweeps by a Sweeper
+SWEEP_INTERVAL = 15 * 60
+
+
+def setup_test():
+    from zoom.queues import setup_test
+    db = setup_test().db
+    db('drop table if exists queue_retention')
+    db("""
+        create table if not exists queue_retention (
+            topic     varchar(100) not null,
+            max_age   int,
+            max_count int,
+            PRIMARY KEY (topic)
+            )
+        """)
+    return db
+
+
+def retain(db, topic, max_age=None, max_count=None):
+    """set the retention policy of the topics matching topic, removing
+    it if there are no limits"""
+    if max_age is None and max_count is None:
+        db('delete from queue_retention where topic=%s', topic)
+    else:
+        db(
+            'replace into queue_retention (topic, max_age, max_count) '
+            'values (%s, %s, %s)', topic, max_age, max_count
+        )
+
+
+def policies(db):
+    """returns the (topic, max_age, max_count) retention policies"""
+    cmd = (
+        'select topic, max_age, max_count from queue_retention order by topic'
+    )
+    return [
+        (topic, max_age, max_count)
+        for topic, max_age, max_count in db(cmd)
+    ]
+
+
+def purge(db, topic, older_than=None, keep=None):
+    """
+    remove the ready messages of a topic in bulk
+
+    Removes the messages older than older_than seconds and all but the
+    newest keep messages, or every ready message if neither is given.
+    Claimed messages are left to their consumers.  Returns the number
+    of messages removed.
+
+        >>> db = setup_test()
+        >>> from zoom.queues import Queues
+        >>> Queues(db).topic('mail').send('a', 'b', 'c')
+        [1L, 2L, 3L]
+        >>> purge(db, 'mail', keep=1), purge(db, 'mail', older_than=60)
+        (2, 0)
+        >>> purge(db, 'mail')
+        1
+
+    """
+    removed = 0
+    if older_than is None and keep is None:
+        db('delete from messages where topic=%s and status="ready"', topic)
+        return db.rowcount
+    if older_than is not None:
+        db(
+            'delete from messages where topic=%s and status="ready" and '
+            'created<date_sub(now(), interval %s second)',
+            topic, older_than
+        )
+        removed += db.rowcount
+    if keep is not None:
+        cmd = (
+            'select id from messages where topic=%s and status="ready" '
+            'order by id desc limit 1 offset {:d}'
+        ).format(keep)
+        for oldest_kept, in db(cmd, topic):
+            db(
+                'delete from messages '
+                'where topic=%s and status="ready" and id<=%s',
+                topic, oldest_kept
+            )
+            removed += db.rowcount
+    return removed
+
+
+def purge_replies(db, older_than=REPLY_AGE):
+    """remove the replies older than older_than seconds and return the
+    number removed"""
+    db(
+        'delete from replies '
+        'where created<date_sub(now(), interval %s second)', older_than
+    )
+    return db.rowcount
+
+
+def sweep(db):
+    """
+    enforce the retention policies
+
+    Returns a dict of the number of messages removed from each topic
+    that had any removed and the number of replies removed.
+    """
+    removed = {}
+    for pattern, max_age, max_count in policies(db):
+        cmd = 'select distinct topic from messages where topic like %s'
+        for topic, in db(cmd, pattern):
+            count = purge(db, topic, max_age, max_count)
+            if count:
+                removed[topic] = removed.get(topic, 0) + count
+    return removed, purge_replies(db)
+
+
+def space(db, tables=('messages', 'replies')):
+    """returns the bytes used by the data and indexes of tables,
+    including the space freed by deletes that has not been reclaimed"""
+    cmd = (
+        'select sum(data_length + index_length + data_free) '
+        'from information_schema.tables '
+        'where table_schema=database() and table_name in ({})'
+    ).format(','.join(['%s'] * len(tables)))
+    return long(db(cmd, *tables).first()[0] or 0)
+
+
+def compact(db, tables=('messages', 'replies')):
+    """reclaim the space freed by deletes from tables"""
+    list(db('optimize table {}'.format(', '.join(tables))))
+
+
+class Sweeper(threading.Thread):
+    """sweeps the queues every interval seconds in the background
+
+    A sweep that fails is logged and the next one starts on a new
+    connection, in case the failure was a lost connection.
+    """
+
+    def __init__(self, connect, interval=SWEEP_INTERVAL):
+        threading.Thread.__init__(self, name='zoom.retention.Sweeper')
+        self.daemon = True
+        self.connect = connect
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        db = None
+        while not self.stopped.wait(self.interval):
+            try:
+                if db is None:
+                    db = self.connect()
+                sweep(db)
+            except Exception:
+                logger.exception('queue retention sweep failed')
+                if db is not None:
+                    try:
+                        db.close()
+                    except Exception:
+                        pass
+                    db = None
+
+    def stop(self):
+        """stop sweeping once the sweep under way is done"""
+        self.stopped.set()
@@ -0,0 +1,128 @@
+"""
+    zoom.rows
+
+    lightweight read-only rows
+
+    Records are dicts, so a large result set spends most of its memory
+    on a dict per row and most of its time in the item lookups Record
+    does to support properties.  A row keeps the values of a result in
+    a tuple and reads them by position through a class generated for
+    each set of columns, so rows hold no per row dict at all.
+
+    Rows behave like the records they stand in for as far as reading
+    goes.  Columns are read as attributes or items, and null columns
+    are left out of keys, get and in, as they are from records.  Rows
+    can't be changed; make a record of one (Person(row)) to change it.
+
+        >>> Person = row_class(['_id', 'name', 'age'], 'Person')
+        >>> sam = Person((1L, 'Sam', None))
+        >>> sam.name, sam['name'], sam[1], sam.age
+        ('Sam', 'Sam', 'Sam', None)
+        >>> sam.keys(), sam.get('age', 0), 'age' in sam
+        (['_id', 'name'], 0, False)
+        >>> sam
+        <Person {'name': 'Sam'}>
+        >>> dict(sam) == {'_id': 1L, 'name': 'Sam'}
+        True
+        >>> row_class(['_id', 'name', 'age'], 'Person') is Person
+        True
+        >>> sam.name = 'Samuel'
+        Traceback (most recent call last):
+        ...
+        AttributeError: can't set attribute
+
+"""
+
+_row_classes = {}
+
+
+class Row(tuple):
+    """the methods shared by all row classes"""
+
+    __slots__ = ()
+
+    # the column names and their positions, set by row_class
+    _names = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        try:
+            return tuple.__getitem__(self, self._index[key])
+        except (KeyError, TypeError):
+            if isinstance(key, basestring):
+                raise KeyError(key)
+            return tuple.__getitem__(self, key)
+
+    def get(self, name, default=None):
+        index = self._index.get(name)
+        if index is not None:
+            value = tuple.__getitem__(self, index)
+            if value is not None:
+                return value
+        return default
+
+    def keys(self):
+        return [
+            name for name, value in zip(self._names, tuple.__iter__(self))
+            if value is not None
+        ]
+
+    def values(self):
+        return [value for value in tuple.__iter__(self) if value is not None]
+
+    def items(self):
+        return [
+            (name, value)
+            for name, value in zip(self._names, tuple.__iter__(self))
+            if value is not None
+        ]
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return '<%s {%s}>' % (self.__class__.__name__, ', '.join(
+            '%r: %r' % (name, value) for name, value in self.items()
+            if not name.startswith('_')
+        ))
+
+    __str__ = __repr__
+
+
+def _column(index):
+    getitem = tuple.__getitem__
+    return property(lambda self: getitem(self, index))
+
+
+def row_class(names, name='Row'):
+    """
+    returns the row class of a set of column names
+
+    Classes are generated once per name and set of columns.  Columns
+    named after a Row method are read as items only.
+    """
+    names = tuple(names)
+    cls = _row_classes.get((name, names))
+    if cls is None:
+        # the columns are properties of a base class so the row class
+        # looks like a record class with no properties of its own
+        columns = dict(
+            (column, _column(index))
+            for index, column in enumerate(names)
+            if not hasattr(Row, column)
+        )
+        columns.update(
+            __slots__=(),
+            _names=names,
+            _index=dict((column, index) for index, column in enumerate(names)),
+        )
+        base = type(name + 'Columns', (Row,), columns)
+        cls = type(name, (base,), dict(__slots__=()))
+        _row_classes[(name, names)] = cls
+    return cls
@@ -20,6 +20,7 @@ import zoom
 from zoom.db import database as DB
 from zoom.utils import locate_config, Config
 from zoom.instance import Instance
+from zoom.queues import START
 
 
 class ServiceException(Exception): pass
@@ -253,7 +254,7 @@ class Worker(object):
     @property
     def queue(self):
         """return the queue this worker uses"""
-        return zoom.system.queues.topic(self.topic, 1)
+        return zoom.system.queues.topic(self.topic, START)
 
     def process(self):
         """process a job"""
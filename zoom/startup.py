@@ -261,6 +261,10 @@ def generate_response(instance_path, start_time=None):
                 system_timer.report(),
                 system.database.report(),
                 system.db.report(),
+                system.identity_map is not None and
+                system.identity_map.report(
+                    system.db.queries + system.database.queries
+                ) or '',
                 '  Profiler\n ------------\n',
                 t
             ]))
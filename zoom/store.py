@@ -4,13 +4,22 @@
     key value store
 """
 
+import copy
 import datetime
 import decimal
+import itertools
+import uuid
 
 import zoom.utils
 import zoom.tools
 import zoom.exceptions
 import zoom.jsonz
+import zoom.fulltext
+import zoom.expressions
+import zoom.materialize
+import zoom.catalog
+import zoom.changes
+import zoom.partitions
 
 
 def setup_test():
@@ -41,7 +50,75 @@ def setup_test():
             """
         )
 
+        db(
+            """
+            create table if not exists search_terms (
+                id int not null auto_increment,
+                kind      varchar(100),
+                row_id    int not null,
+                term      varchar(50),
+                hits      int,
+                PRIMARY KEY (id),
+                KEY `term_key` (`kind`, `term`),
+                KEY `row_id_key` (`kind`, `row_id`)
+                )
+            """
+        )
+        db(
+            """
+            create table if not exists typed_attributes (
+                id int not null auto_increment,
+                kind      varchar(100),
+                row_id    int not null,
+                attribute varchar(100),
+                number    double,
+                moment    datetime,
+                PRIMARY KEY (id),
+                KEY `row_id_key` (`row_id`),
+                KEY `number_key` (`kind`, `attribute`, `number`),
+                KEY `moment_key` (`kind`, `attribute`, `moment`)
+                )
+            """
+        )
+        db(
+            """
+            create table if not exists entity_kinds (
+                kind      varchar(100) not null,
+                entities  int not null default 0,
+                updated   datetime,
+                PRIMARY KEY (kind)
+                )
+            """
+        )
+        db(
+            """
+            create table if not exists entity_kind_attributes (
+                id int not null auto_increment,
+                kind      varchar(100) not null,
+                attribute varchar(100) not null,
+                datatype  varchar(30) not null,
+                PRIMARY KEY (id),
+                UNIQUE KEY `attribute_key` (`kind`, `attribute`, `datatype`)
+                )
+            """
+        )
+        db(
+            """
+            create table if not exists entity_partitions (
+                kind             varchar(100) not null,
+                entities_table   varchar(100),
+                attributes_table varchar(100),
+                PRIMARY KEY (kind)
+                )
+            """
+        )
+
     def delete_test_tables(db):
+        db('drop table if exists entity_partitions')
+        db('drop table if exists entity_kind_attributes')
+        db('drop table if exists entity_kinds')
+        db('drop table if exists typed_attributes')
+        db('drop table if exists search_terms')
         db('drop table if exists attributes')
         db('drop table if exists entities')
 
@@ -63,72 +140,420 @@ Entity = zoom.utils.Record
 EntityList = zoom.utils.RecordList
 
 
-def entify(rs, klass):
+_dates = {}
+
+
+def _date(value):
+    """convert a stored date
+
+    Dates repeat a lot within a kind so parsed values are remembered.
     """
-    converts query result into an EntityList
+    try:
+        return _dates[value]
+    except KeyError:
+        if len(_dates) > 10000:
+            _dates.clear()
+        result = _dates[value] = datetime.date(
+            int(value[:4]), int(value[5:7]), int(value[8:10])
+        )
+        return result
+
+
+def _datetime(value):
+    """convert a stored datetime"""
+    return datetime.datetime(
+        int(value[:4]), int(value[5:7]), int(value[8:10]),
+        int(value[11:13]), int(value[14:16]), int(value[17:19])
+    )
+
+
+def _unicode(value):
+    """convert a stored unicode value"""
+    if isinstance(value, unicode):
+        return value
+    return value.decode('utf8')
+
+
+def _bool(value):
+    """convert a stored bool"""
+    return value == '1' or value == 'True'
+
+
+def _none(value):
+    """convert a stored None"""
+    return None
+
+
+# converters by stored datatype, None where the stored value is used as is
+CONVERTERS = {
+    'str': None,
+    'unicode': _unicode,
+    'long': long,
+    'int': int,
+    'float': float,
+    'decimal.Decimal': decimal.Decimal,
+    'datetime.date': _date,
+    'datetime.datetime': _datetime,
+    'bool': _bool,
+    'NoneType': _none,
+    'instance': long,
+    'list': zoom.jsonz.loads,
+    'tuple': zoom.jsonz.loads,
+}
+
+
+class DecodingPlan(object):
+    """decodes the attribute rows of a kind
+
+    Each kind gets its own copy of the converter table so a kind can
+    register converters for datatypes of its own without affecting other
+    kinds.  Rows for an entity arrive together so the entity being built
+    is only looked up when the row_id changes.
+
+    Entities that can carry attributes of their own remember the rows
+    they were decoded from so that EntityStore.put can write only the
+    attributes that have changed.
+    """
+
+    def __init__(self, converters=None, kind=None):
+        self.converters = dict(converters or CONVERTERS)
+        self.kind = kind
+
+    def __call__(self, rs, klass):
+        entities = {}
+        order = []
+        converters = self.converters
+        current = entity = None
+        originals = {}
+        track = self.kind is not None and hasattr(klass(), '__dict__')
+
+        for _, _, row_id, attribute, datatype, value in rs:
+            if row_id != current:
+                entity = entities.get(row_id)
+                if entity is None:
+                    entity = entities[row_id] = klass(_id=row_id)
+                    order.append(row_id)
+                    original = originals[row_id] = {}
+                else:
+                    original = originals[row_id]
+                current = row_id
+
+            if attribute is None:
+                # a projected entity with none of the projected attributes
+                continue
+
+            try:
+                convert = converters[datatype]
+            except KeyError:
+                msg = 'unsupported data type: ' + repr(datatype)
+                raise zoom.exceptions.TypeException(msg)
+
+            if track:
+                original[attribute] = datatype, value
+
+            if convert is not None:
+                value = convert(value)
+
+            entity[attribute] = value
+
+        if track:
+            for row_id in order:
+                remember(entities[row_id], self.kind, originals[row_id])
+
+        return EntityList(entities[row_id] for row_id in order)
+
+
+_plans = {}
+
+
+def decoding_plan(kind):
+    """return the decoding plan for a kind"""
+    plan = _plans.get(kind)
+    if plan is None:
+        plan = _plans[kind] = DecodingPlan(kind=kind)
+    return plan
+
+
+def entify(rs, klass, kind=None):
     """
-    entities = {}
+    converts query result into an EntityList
+
+        >>> rows = [
+        ...     (1, 'person', 1L, 'name', 'str', 'Joe'),
+        ...     (2, 'person', 1L, 'born', 'datetime.date', '1992-05-05'),
+        ...     (3, 'person', 2L, 'name', 'str', 'Sam'),
+        ...     (4, 'person', 2L, 'kids', 'int', '2'),
+        ...     (5, 'person', 2L, 'photo', 'instance', '12'),
+        ... ]
+        >>> for entity in entify(rows, dict): print sorted(entity.items())
+        [('_id', 1L), ('born', datetime.date(1992, 5, 5)), ('name', 'Joe')]
+        [('_id', 2L), ('kids', 2), ('name', 'Sam'), ('photo', 12L)]
+
+        >>> entify([(1, 'person', 1L, 'name', 'set', '')], dict)
+        Traceback (most recent call last):
+        ...
+        TypeException: unsupported data type: 'set'
 
+    """
     if hasattr(rs, 'data'):  # maintain backward compatibility with
         rs = rs.data         # legacy database module
 
-    for _, _, row_id, attribute, datatype, value in rs:
+    plan = kind is None and DecodingPlan() or decoding_plan(kind)
+    return plan(rs, klass)
+
+
+VALID_TYPES = [
+    'str', 'unicode', 'long', 'int', 'float', 'decimal.Decimal',
+    'datetime.date', 'datetime.datetime', 'bool', 'NoneType',
+    'list', 'tuple'
+    ]
+
+
+def fixval(d):
+    """returns a value in the form it is stored"""
+    if type(d) == datetime.datetime:
+        # avoids mysqldb reliance on strftime that lacks support
+        # for dates before 1900
+        return "%02d-%02d-%02d %02d:%02d:%02d" % (
+            d.year,
+            d.month,
+            d.day,
+            d.hour,
+            d.minute,
+            d.second
+            )
+    if type(d) == decimal.Decimal:
+        return str(d)
+    if isinstance(d, (list, tuple)):
+        return zoom.jsonz.dumps(d)
+    return d
+
+
+def get_type_str(v):
+    """returns the datatype name stored with a value"""
+    t = repr(type(v))
+    if 'type' in t:
+        return t.strip('<type >').strip("'")
+    elif 'class' in t:
+        return t.strip('<class >').strip("'")
+    else:
+        return t
+
+
+def encode(entity):
+    """returns the attribute names, datatypes and values of an entity"""
+    keys = [k for k in entity.keys() if k != '_id']
+    values = [entity[k] for k in keys]
+    datatypes = [get_type_str(v) for v in values]
+
+    for n, atype in enumerate(datatypes):
+        if atype not in VALID_TYPES:
+            msg = 'unsupported type <type %s> in value %r'
+            raise zoom.exceptions.TypeException, msg % (atype, keys[n])
 
-        if datatype == 'str':
-            pass
+    return [k.lower() for k in keys], datatypes, values
 
-        elif datatype == 'unicode' and isinstance(value, unicode):
-            pass
 
-        elif datatype == 'unicode':
-            value = value.decode('utf8')
+NUMBER_TYPES = ['int', 'long', 'float', 'decimal.Decimal']
 
-        elif datatype == "long":
-            value = long(value)
+# numbers are stored as text so they are cast to compare them as numbers
+NUMERIC = 'decimal(65,15)'
 
-        elif datatype == "int":
-            value = int(value)
+# the limit of statements with an offset but no limit
+MAX_ROWS = 2 ** 63 - 1
+
+
+def is_number(value):
+    """returns True if value is stored as a number
+
+        >>> is_number(25), is_number(decimal.Decimal('2.5')), is_number(True)
+        (True, True, False)
+
+    """
+    return (
+        isinstance(value, (int, long, float, decimal.Decimal))
+        and not isinstance(value, bool)
+    )
+
+
+def typed_column(value):
+    """returns the typed index column that holds values like value
+
+        >>> typed_column(25), typed_column(datetime.date(2017, 1, 1))
+        ('number', 'moment')
+        >>> typed_column('25'), typed_column(True)
+        (None, None)
+
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, long, float, decimal.Decimal)):
+        return 'number'
+    if isinstance(value, datetime.date):
+        return 'moment'
 
-        elif datatype == 'float':
-            value = float(value)
 
-        elif datatype == 'decimal.Decimal':
-            value = decimal.Decimal(value)
+def typed_value(value):
+    """returns a value in the form it is kept in the typed index"""
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    return float(value)
 
-        elif datatype == "datetime.date":
-            y = int(value[:4])
-            m = int(value[5:7])
-            d = int(value[8:10])
-            value = datetime.date(y, m, d)
 
-        elif datatype == "datetime.datetime":
-            y = int(value[:4])
-            m = int(value[5:7])
-            d = int(value[8:10])
-            hr = int(value[11:13])
-            mn = int(value[14:16])
-            sc = int(value[17:19])
-            value = datetime.datetime(y, m, d, hr, mn, sc)
+def attribute_rows(kind, id, keys, datatypes, values):
+    """returns attribute rows for encoded attributes"""
+    n = len(keys)
+    stored = [fixval(i) for i in values]
+    return zip([kind]*n, [id]*n, keys, datatypes, stored)
 
-        elif datatype == 'bool':
-            value = (value == '1' or value == 'True')
 
-        elif datatype == 'NoneType':
-            value = None
+def typed_rows(kind, id, pairs):
+    """returns typed index rows for the numbers and dates in pairs"""
+    rows = []
+    for key, value in pairs:
+        column = typed_column(value)
+        if column == 'number':
+            rows.append((kind, id, key, typed_value(value), None))
+        elif column == 'moment':
+            rows.append((kind, id, key, None, typed_value(value)))
+    return rows
 
-        elif datatype == 'instance':
-            value = long(rec.id)
 
-        elif datatype in ['list', 'tuple']:
-            value = zoom.jsonz.loads(value)
+ORIGINAL = '__original__'
 
+
+def remember(entity, kind, original):
+    """remember the stored (datatype, value) pairs of an entity"""
+    entity.__dict__[ORIGINAL] = kind, entity['_id'], original
+
+
+def forget(entity):
+    """forget the stored values of an entity"""
+    getattr(entity, '__dict__', {}).pop(ORIGINAL, None)
+
+
+def recall(entity, kind):
+    """return the stored values of an entity if they are known"""
+    state = getattr(entity, '__dict__', {}).get(ORIGINAL)
+    if state and state[0] == kind and state[1] == entity.get('_id'):
+        return state[2]
+
+
+PARTIAL = '__partial__'
+
+_partial_classes = {}
+
+
+def partial_class(klass):
+    """returns a subclass of klass whose instances can be marked partial"""
+    cls = _partial_classes.get(klass)
+    if cls is None:
+        cls = _partial_classes[klass] = type(klass.__name__, (klass,), {})
+    return cls
+
+
+def partial(entity):
+    """return the attributes a partial entity was read with, if it is one
+
+        >>> sam = partial_class(dict)(_id=1L, name='Sam')
+        >>> partial(sam)
+        >>> sam.__dict__[PARTIAL] = ('name',)
+        >>> sam, partial(sam)
+        ({'_id': 1L, 'name': 'Sam'}, ('name',))
+
+    """
+    return getattr(entity, '__dict__', {}).get(PARTIAL)
+
+
+def snapshot(keys, datatypes, values):
+    """returns the stored values of encoded attributes"""
+    return dict(
+        (k, (t, fixval(v))) for k, t, v in zip(keys, datatypes, values)
+    )
+
+
+def differences(original, keys, datatypes, values):
+    """returns the names of the encoded attributes that differ from the
+    stored ones, including the ones that were removed"""
+    changed = [
+        key for key, datatype, value in zip(keys, datatypes, values)
+        if key not in original or not unchanged(original[key], datatype, value)
+    ]
+    return changed + [key for key in original if key not in keys]
+
+
+def unchanged(original, datatype, value, converters=CONVERTERS):
+    """returns True if a value is the one that was stored"""
+    stored_datatype, stored = original
+    if stored_datatype != datatype:
+        return False
+    convert = converters.get(datatype)
+    try:
+        # values remembered by put are kept as they were, not as stored
+        if convert is None or not isinstance(stored, basestring):
+            decoded = stored
         else:
-            msg = 'unsupported data type: ' + repr(datatype)
-            raise zoom.exceptions.TypeException, msg
+            decoded = convert(stored)
+    except (TypeError, ValueError, decimal.InvalidOperation):
+        return False
+    if datatype == 'decimal.Decimal':
+        return str(decoded) == str(value)
+    return type(decoded) == type(value) and decoded == value
+
+
+AGGREGATES = ['sum', 'avg', 'min', 'max']
+
+
+def listed(names):
+    """returns names as a list
 
-        entities.setdefault(row_id, klass(_id=row_id))[attribute] = value
+        >>> listed('age'), listed(['name', 'age']), listed(None)
+        (['age'], ['name', 'age'], [])
 
-    return EntityList(entities.values())
+    """
+    if names is None:
+        return []
+    if isinstance(names, basestring):
+        return [names]
+    return list(names)
+
+
+def measured(function, value, datatypes):
+    """convert an aggregate to the type of the values aggregated
+
+        >>> measured('sum', decimal.Decimal('75.000'), ['int'])
+        75
+        >>> measured('avg', 12, ['int', 'long'])
+        12.0
+        >>> measured('max', '2.500', ['decimal.Decimal'])
+        Decimal('2.5')
+        >>> measured('sum', decimal.Decimal('7.00'), ['decimal.Decimal'])
+        Decimal('7')
+        >>> measured('min', 3, ['int', 'float'])
+        3.0
+
+    """
+    if value is None:
+        return None
+    datatypes = set(datatypes)
+    if 'decimal.Decimal' in datatypes:
+        value = decimal.Decimal(str(value))
+        if value == value.to_integral():
+            return value.quantize(decimal.Decimal(1))
+        return value.normalize()
+    if function == 'avg' or 'float' in datatypes:
+        return float(value)
+    return int(value)
+
+
+def decoded(value, datatype):
+    """returns a stored value as the datatype it was stored as"""
+    convert = CONVERTERS.get(datatype)
+    if value is None or convert is None:
+        return value
+    return convert(value)
 
 
 class EntityStore(object):
@@ -225,11 +650,125 @@ class EntityStore(object):
 
     """
 
+    # maintain a search index of the stored values (see zoom.fulltext)
+    searchable = False
+
+    # keep numbers and dates in the typed_attributes table so ranges
+    # can be selected through an index
+    typed_index = False
+
+    # number of entities read or written per statement by the batch methods
+    batch_size = 1000
+
+    # share entities through the request identity map (see zoom.identity)
+    use_identity_map = True
+
+    # keep the kind catalog up to date on sites that keep one
+    # (see zoom.catalog)
+    use_catalog = True
+
+    # the attributes read, or None for all of them (see only)
+    fields = None
+
+    # append puts and deletes to the change log (see zoom.changes)
+    log_changes = False
+
+    # keep the kind in entities and attributes tables of its own,
+    # created when the kind is first used (see zoom.partitions)
+    partitioned = False
+
     def __init__(self, db, klass=dict):
         self.db = db
         self.klass = type(klass) == str and dict or klass
         self.kind = type(klass) == str and klass or zoom.utils.kind(klass())
 
+    @property
+    def index(self):
+        """the search index of the kind"""
+        return zoom.fulltext.SearchIndex(self.db, self.kind)
+
+    @property
+    def identity_map(self):
+        """the identity map of the request, if there is one"""
+        if self.use_identity_map:
+            return getattr(self.db, 'identity_map', None)
+
+    @property
+    def _space(self):
+        """the identity map space of the entities the store reads"""
+        return 'entities', self.klass
+
+    @property
+    def partition(self):
+        """the entities and attributes tables of the kind"""
+        return zoom.partitions.lookup(self.db, self.kind, self.partitioned)
+
+    @property
+    def catalog(self):
+        """the catalog entry of the kind if the site keeps a catalog"""
+        if self.use_catalog:
+            return zoom.catalog.lookup(self.db, self.kind, self._survey)
+
+    def _count(self):
+        """count the entities of the kind"""
+        table = self._wide
+        if table is not None:
+            return table.count()
+        cmd = ('select count(*) n from '
+               '(select distinct row_id from {} where kind=%s) a')
+        cmd = cmd.format(self.partition.attributes)
+        return int(list(self.db(cmd, self.kind))[0][0])
+
+    def _survey(self):
+        """count the entities of the kind and list their datatypes"""
+        table = self._wide
+        if table is not None:
+            return table.count(), table.columns
+        cmd = (
+            'select attribute, datatype, min(id) first from {} '
+            'where kind=%s group by attribute, datatype order by first'
+        ).format(self.partition.attributes)
+        pairs = [(rec[0], rec[1]) for rec in self.db(cmd, self.kind)]
+        return self._count(), pairs
+
+    @property
+    def table(self):
+        """the wide table of the kind if it is materialized"""
+        return zoom.materialize.lookup(self.db, self.kind)
+
+    @property
+    def _wide(self):
+        """the wide table of the kind once it has replaced the attributes"""
+        table = self.table
+        if table is not None and table.state == 'wide':
+            return table
+
+    def _identify(self, entities):
+        """replace entities read before in the request by the ones read
+        first so each entity is one object"""
+        if self.fields is not None:
+            fields = tuple(self.fields)
+            for entity in entities:
+                forget(entity)
+                entity.__dict__[PARTIAL] = fields
+            return entities
+        identity_map = self.identity_map
+        if identity_map is None:
+            return entities
+        return EntityList(
+            identity_map.identify(self.kind, entities, space=self._space))
+
+    def _mapped(self, entities):
+        """record written entities in the identity map"""
+        identity_map = self.identity_map
+        if identity_map is not None:
+            for entity in entities:
+                if isinstance(entity, self.klass):
+                    identity_map.add(
+                        self.kind, entity['_id'], entity, self._space)
+                else:
+                    identity_map.discard(self.kind, [entity['_id']])
+
     def put(self, entity):
         """
         stores an entity
@@ -265,72 +804,363 @@ class EntityStore(object):
             >>> id = people.put({'name':'James', 'classes':classes, 'grades': grades})
             >>> assert classes == people.get(id).classes
             >>> assert len(people.get(id).grades) == 2  # json dump/load will bring back all tuples as lists
+
+        Entities remember what was stored so only the attributes that
+        changed are written when they are put back.
+
+            >>> james = people.get(id)
+            >>> james.name = 'Jim'
+            >>> del james['grades']
+            >>> james.age = 16
+            >>> people.put(james)
+            3L
+            >>> james = people.get(id)
+            >>> james.name, james.age, 'grades' in james
+            ('Jim', 16, False)
             >>> db.close()
 
         """
-        def fixval(d):
-            if type(d) == datetime.datetime:
-                # avoids mysqldb reliance on strftime that lacks support
-                # for dates before 1900
-                return "%02d-%02d-%02d %02d:%02d:%02d" % (
-                    d.year,
-                    d.month,
-                    d.day,
-                    d.hour,
-                    d.minute,
-                    d.second
-                    )
-            if type(d) == decimal.Decimal:
-                return str(d)
-            if isinstance(d, (list, tuple)):
-                return zoom.jsonz.dumps(d)
-            return d
-
-        def get_type_str(v):
-            t = repr(type(v))
-            if 'type' in t:
-                return t.strip('<type >').strip("'")
-            elif 'class' in t:
-                return t.strip('<class >').strip("'")
-            else:
-                return t
-
         db = self.db
 
-        keys = [k for k in entity.keys() if k != '_id']
-        values = [entity[k] for k in keys]
-        datatypes = [get_type_str(v) for v in values]
-        values = [fixval(i) for i in values]  # same fix as above
-        valid_types = [
-            'str', 'unicode', 'long', 'int', 'float', 'decimal.Decimal',
-            'datetime.date', 'datetime.datetime', 'bool', 'NoneType',
-            'list', 'tuple'
-            ]
-
-        for n, atype in enumerate(datatypes):
-            if atype not in valid_types:
-                msg = 'unsupported type <type %s> in value %r'
-                raise zoom.exceptions.TypeException, msg % (atype, keys[n])
+        self._refuse_partial([entity])
+
+        lkeys, datatypes, values = encode(entity)
+        original = recall(entity, self.kind)
+        table = self.table
+        wide = table is not None and table.state == 'wide'
+
+        catalog = self.catalog
+        existed = original is not None and bool(original)
+        new = '_id' not in entity
+        partition = self.partition
+
+        if wide:
+            changed = None
+            if not new:
+                id = entity['_id']
+                if original is not None:
+                    changed = differences(original, lkeys, datatypes, values)
+                elif catalog is not None:
+                    existed = bool(table.exists([id]))
+            else:
+                cmd = 'insert into {} (kind) values (%s)'
+                db(cmd.format(partition.entities), self.kind)
+                id = entity['_id'] = db.lastrowid
+            if changed != []:
+                table.write([entity])
 
-        if '_id' in entity:
+        elif original is not None:
             id = entity['_id']
-            db('delete from attributes where row_id=%s', id)
+            changed = self._update(id, original, lkeys, datatypes, values)
+
         else:
-            db('insert into entities (kind) values (%s)', self.kind)
-            id = entity['_id'] = db.lastrowid
+            if '_id' in entity:
+                id = entity['_id']
+                cmd = 'delete from {} where row_id=%s'
+                cursor = db.cursor()
+                cursor.execute(cmd.format(partition.attributes), (id,))
+                existed = cursor.rowcount > 0
+                changed = None
+            else:
+                cmd = 'insert into {} (kind) values (%s)'
+                db(cmd.format(partition.entities), self.kind)
+                id = entity['_id'] = db.lastrowid
+                changed = []
 
-        n = len(keys)
-        lkeys = [k.lower() for k in keys]
-        param_list = zip([self.kind]*n, [id]*n, lkeys, datatypes, values)
-        cmd = (
-            'insert into attributes ('
-            '    kind, row_id, attribute, datatype, value'
-            ') values (%s,%s,%s,%s,%s)'
+            self._insert_attributes(
+                attribute_rows(self.kind, id, lkeys, datatypes, values)
             )
-        db.cursor().executemany(cmd, param_list)
+
+        if table is not None and table.state == 'dual':
+            table.write([entity])
+
+        if self.searchable:
+            self.index.update(id, values)
+
+        if self.typed_index and not wide:
+            pairs = zip(lkeys, values)
+            if original is not None:
+                pairs = [pair for pair in pairs if pair[0] in changed]
+            self._retype(id, pairs, changed)
+
+        if catalog is not None:
+            exists = wide or bool(lkeys)
+            catalog.change(exists - existed, lkeys, datatypes)
+
+        if self.log_changes and (new or changed != []):
+            changes = [(id, lkeys if new else changed)]
+            zoom.changes.log(db, self.kind, 'put', changes)
+
+        if hasattr(entity, '__dict__'):
+            remember(entity, self.kind, snapshot(lkeys, datatypes, values))
+
+        self._mapped([entity])
 
         return id
 
+    def _update(self, id, original, keys, datatypes, values):
+        """
+        write only the attributes that differ from the stored ones
+        """
+        inserts, updates, deletes = self._changes(
+            id, original, keys, datatypes, values)
+        self._write_changes(inserts, updates, deletes)
+        return (
+            [row[2] for row in inserts] +
+            [row[3] for row in updates] +
+            deletes[id]
+        )
+
+    def _changes(self, id, original, keys, datatypes, values):
+        """
+        returns the attribute rows to insert, the attribute rows to
+        update and the attributes to delete, by id, to store an entity
+        """
+        inserts, updates = [], []
+        for key, datatype, value in zip(keys, datatypes, values):
+            if key not in original:
+                inserts.append((self.kind, id, key, datatype, fixval(value)))
+            elif not unchanged(original[key], datatype, value):
+                updates.append((datatype, fixval(value), id, key))
+        deletes = {id: [key for key in original if key not in keys]}
+        return inserts, updates, deletes
+
+    def _write_changes(self, inserts, updates, deletes):
+        """
+        write attribute changes with a statement for each kind of change
+        """
+        attributes = self.partition.attributes
+        deletes = [(id, keys) for id, keys in deletes.items() if keys]
+        if deletes:
+            cmd = 'delete from {} where {}'.format(attributes, ' or '.join(
+                '(row_id=%s and attribute in ({}))'.format(
+                    ','.join(['%s'] * len(keys)))
+                for _, keys in deletes
+            ))
+            self.db(cmd, *[v for id, keys in deletes for v in [id] + keys])
+        if updates:
+            cmd = (
+                'update {} set datatype=%s, value=%s '
+                'where row_id=%s and attribute=%s'
+            ).format(attributes)
+            self.db.cursor().executemany(cmd, updates)
+        self._insert_attributes(inserts)
+
+    def _insert_attributes(self, rows):
+        if rows:
+            cmd = (
+                'insert into {} ('
+                '    kind, row_id, attribute, datatype, value'
+                ') values (%s,%s,%s,%s,%s)'
+                ).format(self.partition.attributes)
+            self.db.cursor().executemany(cmd, rows)
+
+    def put_many(self, entities):
+        """
+        stores entities in batches
+
+        Each batch of entities is written with the same few statements
+        however many entities it holds, and new entities get their ids
+        from a single insert, read back rather than assumed to be
+        consecutive.  Loaded entities that have not changed are
+        not written at all.  Returns the ids in the order given.
+
+            >>> db = setup_test()
+            >>> class Person(Entity): pass
+            >>> people = EntityStore(db, Person)
+            >>> people.put_many([
+            ...     Person(name='Sam', age=25),
+            ...     Person(name='Sally', age=55),
+            ...     {'name': 'Bob', 'age': 25},
+            ... ])
+            [1L, 2L, 3L]
+            >>> sam, sally = people.get_many([1L, 2L])
+            >>> sally.age += 1
+            >>> people.put_many([sally, sam, Person(name='Ann', age=9)])
+            [2L, 1L, 4L]
+            >>> [(p.name, p.age) for p in people.get_many([1, 2, 3, 4])]
+            [('Sam', 25), ('Sally', 56), ('Bob', 25), ('Ann', 9)]
+            >>> people.put_many([])
+            []
+            >>> db.close()
+
+        """
+        entities = list(entities)
+        self._refuse_partial(entities)
+        ids = []
+        size = self.batch_size
+        for n in range(0, len(entities), size):
+            ids.extend(self._put_batch(entities[n:n + size]))
+        return ids
+
+    def _refuse_partial(self, entities):
+        """raise an exception if any of the entities are partial"""
+        for entity in entities:
+            fields = partial(entity)
+            if fields is not None:
+                msg = (
+                    '{} {} was read with only {} so putting it would lose '
+                    'its other attributes; get it in full to change it'
+                ).format(self.kind, entity.get('_id'), ', '.join(fields) or '_id')
+                raise zoom.exceptions.PartialException(msg)
+
+    def _put_batch(self, entities):
+        db = self.db
+        encoded = [encode(entity) for entity in entities]
+        table = self.table
+        wide = table is not None and table.state == 'wide'
+        partition = self.partition
+
+        new, stale, written, changes = [], [], [], []
+        # loaded entities only have their changed attributes written
+        inserts, updates, deletes, tracked = [], [], {}, {}
+        existed, unknown = 0, []
+        for entity, attributes in zip(entities, encoded):
+            if '_id' not in entity:
+                new.append(entity)
+                changed = attributes[0]
+            else:
+                id = entity['_id']
+                original = recall(entity, self.kind)
+                changed = None
+                if original is None:
+                    stale.append(id)
+                    unknown.append(id)
+                else:
+                    changed = differences(original, *attributes)
+                    if not changed:
+                        continue
+                    existed += bool(original)
+                    if not wide:
+                        rows = self._changes(id, original, *attributes)
+                        inserts.extend(rows[0])
+                        updates.extend(rows[1])
+                        deletes.update(rows[2])
+                        tracked[id] = changed
+            written.append((entity, attributes))
+            changes.append(changed)
+
+        catalog = self.catalog
+        if catalog is not None and unknown:
+            existed += len(self._found(unknown))
+
+        if new:
+            # the ids of a multi-row insert need not be consecutive, so
+            # the rows are inserted under a marker and their ids read back
+            entities_table = partition.entities
+            marker = '~' + uuid.uuid4().hex
+            cmd = 'insert into {} (kind) values '.format(entities_table)
+            cmd += ','.join(['(%s)'] * len(new))
+            db(cmd, *[marker] * len(new))
+            cmd = 'select id from {} where kind=%s order by id'
+            ids = [rec[0] for rec in db(cmd.format(entities_table), marker)]
+            cmd = 'update {} set kind=%s where kind=%s'
+            db(cmd.format(entities_table), self.kind, marker)
+            for entity, id in zip(new, ids):
+                entity['_id'] = id
+
+        if stale and not wide:
+            spots = ','.join(['%s'] * len(stale))
+            cmd = 'delete from {} where row_id in ({})'.format(
+                partition.attributes, spots)
+            db(cmd, *stale)
+            if self.typed_index:
+                cmd = (
+                    'delete from typed_attributes '
+                    'where kind=%s and row_id in ({})'
+                ).format(spots)
+                db(cmd, self.kind, *stale)
+
+        if wide:
+            table.write(entity for entity, _ in written)
+        else:
+            rows = []
+            typed = []
+            for entity, (keys, datatypes, values) in written:
+                id = entity['_id']
+                pairs = zip(keys, values)
+                if id in tracked:
+                    changed = tracked[id]
+                    pairs = [pair for pair in pairs if pair[0] in changed]
+                else:
+                    rows.extend(
+                        attribute_rows(self.kind, id, keys, datatypes, values)
+                    )
+                if self.typed_index:
+                    typed.extend(typed_rows(self.kind, id, pairs))
+            if tracked and self.typed_index:
+                cmd = 'delete from typed_attributes where kind=%s and ({})'
+                cmd = cmd.format(' or '.join(
+                    '(row_id=%s and attribute in ({}))'.format(
+                        ','.join(['%s'] * len(changed)))
+                    for changed in tracked.values()
+                ))
+                db(cmd, self.kind, *[
+                    v for id, changed in tracked.items() for v in [id] + changed
+                ])
+            self._write_changes(inserts + rows, updates, deletes)
+            self._insert_typed(typed)
+            if table is not None:
+                table.write(entity for entity, _ in written)
+
+        if self.searchable:
+            self.index.update_many(
+                (entity['_id'], values) for entity, (_, _, values) in written
+            )
+
+        if catalog is not None:
+            exists = sum(
+                wide or bool(keys) for _, (keys, _, _) in written
+            )
+            catalog.change(
+                exists - existed,
+                [key for _, (keys, _, _) in written for key in keys],
+                [t for _, (_, datatypes, _) in written for t in datatypes],
+            )
+
+        if self.log_changes:
+            zoom.changes.log(db, self.kind, 'put', [
+                (entity['_id'], changed)
+                for (entity, _), changed in zip(written, changes)
+            ])
+
+        for entity, attributes in written:
+            if hasattr(entity, '__dict__'):
+                remember(entity, self.kind, snapshot(*attributes))
+
+        self._mapped(entity for entity, _ in written)
+
+        return [entity['_id'] for entity in entities]
+
+    def _retype(self, id, pairs, stale=None):
+        """
+        replace the typed index rows of an entity
+
+        The rows of the stale attributes, or all of the rows of the
+        entity if stale is None, are replaced by rows for the numbers
+        and dates in pairs.
+        """
+        if stale is None:
+            cmd = 'delete from typed_attributes where kind=%s and row_id=%s'
+            self.db(cmd, self.kind, id)
+        elif stale:
+            cmd = (
+                'delete from typed_attributes '
+                'where kind=%s and row_id=%s and attribute in ({})'
+            ).format(','.join(['%s'] * len(stale)))
+            self.db(cmd, self.kind, id, *stale)
+
+        self._insert_typed(typed_rows(self.kind, id, pairs))
+
+    def _insert_typed(self, rows):
+        if rows:
+            cmd = (
+                'insert into typed_attributes ('
+                '    kind, row_id, attribute, number, moment'
+                ') values (%s,%s,%s,%s,%s)'
+            )
+            self.db.cursor().executemany(cmd, rows)
+
     def get(self, keys):
         """
         retrives entities
@@ -366,6 +1196,19 @@ class EntityStore(object):
               3 Alice  29 None
             2 person records
 
+        With an identity map repeat reads return the same entity and
+        are served from memory.
+
+            >>> from zoom.identity import IdentityMap
+            >>> db.identity_map = IdentityMap()
+            >>> people.get(1) is people.get(1L) is people.first(name='Sam')
+            True
+            >>> [p.name for p in people.get([3, 1])]
+            ['Alice', 'Sam']
+            >>> db.identity_map.hits, db.identity_map.misses
+            (2, 2)
+            >>> db.identity_map = None
+
             >>> db.close()
         """
         if keys is None:
@@ -384,18 +1227,70 @@ class EntityStore(object):
             else:
                 return None
 
-        cmd = 'select * from attributes where kind=%s and row_id in (%s)' % (
-            '%s', ','.join(['%s']*len(keys))
-            )
-        rs = self.db(cmd, self.kind, *keys)
-
-        result = entify(rs, self.klass)
+        identity_map = self.identity_map
+        if identity_map is not None:
+            mapped = [
+                identity_map.get(self.kind, key, self._space) for key in keys
+            ]
+            missing = [key for key, item in zip(keys, mapped) if item is None]
+            if missing:
+                found = dict(
+                    (entity['_id'], entity)
+                    for entity in self._get(missing)
+                )
+                mapped = [
+                    found.get(key) if item is None else item
+                    for key, item in zip(keys, mapped)
+                ]
+            result = EntityList(item for item in mapped if item is not None)
+        else:
+            result = self._get(keys)
 
         if as_list:
             return result
         if result:
             return result[0]
 
+    def _get(self, keys):
+        table = self._wide
+        if table is not None:
+            return self._identify(table.get(keys, self.klass, self.fields))
+        attributes = self.partition.attributes
+        if self.fields is not None:
+            cmd = (
+                'select distinct row_id from {} '
+                'where kind=%s and row_id in ({})'
+            ).format(attributes, ','.join(['%s'] * len(keys)))
+            return self._join(cmd, [self.kind] + list(keys))
+        cmd = 'select * from %s where kind=%s and row_id in (%s)' % (
+            attributes, '%s', ','.join(['%s']*len(keys))
+            )
+        rs = self.db(cmd, self.kind, *keys)
+        return self._identify(entify(rs, self.klass, self.kind))
+
+    def get_many(self, keys):
+        """
+        retrieves entities in the order of keys
+
+        Keys that are not found come back as None.
+
+            >>> db = setup_test()
+            >>> people = EntityStore(db, 'person')
+            >>> people.put_many([dict(name='Sam'), dict(name='Sally')])
+            [1L, 2L]
+            >>> people.get_many([2, 3, 1])
+            [{'_id': 2L, 'name': 'Sally'}, None, {'_id': 1L, 'name': 'Sam'}]
+            >>> db.close()
+
+        """
+        keys = [long(key) for key in keys]
+        found = {}
+        size = self.batch_size
+        for n in range(0, len(keys), size):
+            for entity in self.get(keys[n:n + size]):
+                found[entity['_id']] = entity
+        return [found.get(key) for key in keys]
+
     def get_attributes(self):
         """
         get complete set of attributes for the entity type
@@ -413,24 +1308,54 @@ class EntityStore(object):
             >>> db.close()
 
         """
+        catalog = self.catalog
+        if catalog is not None:
+            return catalog.attributes()
+
+        table = self._wide
+        if table is not None:
+            return [name for name, _ in table.columns]
+
         # order by id desc so that newly introduced attributes appear at
         # the end of the keys list
         cmd = (
             'select distinct attribute '
-            'from attributes '
+            'from {} '
             'where kind=%s order by id desc'
-        )
+        ).format(self.partition.attributes)
         rs = self.db(cmd, self.kind)
         values = [rec[0] for rec in rs]
         return values
 
     def _delete(self, ids):
         if ids:
+            catalog = self.catalog
+            if catalog is not None:
+                catalog.change(-len(self._found(ids)))
+            partition = self.partition
             spots = ','.join('%s' for _ in ids)
-            cmd = 'delete from attributes where row_id in ({})'.format(spots)
+            cmd = 'delete from {} where row_id in ({})'.format(
+                partition.attributes, spots)
             self.db(cmd, *ids)
-            cmd = 'delete from entities where id in ({})'.format(spots)
+            cmd = 'delete from {} where id in ({})'.format(
+                partition.entities, spots)
             self.db(cmd, *ids)
+            table = self.table
+            if table is not None:
+                table.delete(ids)
+            if self.log_changes:
+                zoom.changes.log(
+                    self.db, self.kind, 'delete', [(id, None) for id in ids])
+            if self.searchable:
+                self.index.remove(ids)
+            if self.typed_index:
+                cmd = (
+                    'delete from typed_attributes '
+                    'where kind=%s and row_id in ({})'
+                ).format(spots)
+                self.db(cmd, self.kind, *ids)
+            if self.identity_map is not None:
+                self.identity_map.discard(self.kind, ids)
             return ids
 
     def delete(self, *args, **kwargs):
@@ -475,12 +1400,41 @@ class EntityStore(object):
         ids = []
         for key in args:
             if hasattr(key, 'get'):
+                forget(key)
                 key = key['_id']
             ids.append(key)
         if kwargs:
             ids.extend(self._find(**kwargs))
         return self._delete(ids)
 
+    def delete_many(self, keys):
+        """
+        delete entities in batches
+
+        Keys can be ids or entities.  Returns the ids in the order given.
+
+            >>> db = setup_test()
+            >>> people = EntityStore(db, 'person')
+            >>> sam, sally, bob = people.put_many(
+            ...     dict(name=name) for name in ['Sam', 'Sally', 'Bob'])
+            >>> people.delete_many([bob, people.get(sam)])
+            [3L, 1L]
+            >>> people.all()
+            [{'_id': 2L, 'name': 'Sally'}]
+            >>> db.close()
+
+        """
+        ids = []
+        for key in keys:
+            if hasattr(key, 'get'):
+                forget(key)
+                key = key['_id']
+            ids.append(key)
+        size = self.batch_size
+        for n in range(0, len(ids), size):
+            self._delete(ids[n:n + size])
+        return ids
+
     def exists(self, keys=None):
         """
         tests for existence of an entity
@@ -507,21 +1461,27 @@ class EntityStore(object):
         """
         if not isinstance(keys, (list, tuple)):
             keys = (keys,)
-        slots = (','.join(['%s']*len(keys)))
-        cmd = (
-            'select distinct row_id '
-            'from attributes '
-            'where row_id in (%s)'
-            ) % slots
-        rs = self.db(cmd, *keys)
-
-        found_keys = [rec[0] for rec in rs]
+        found_keys = self._found(keys)
         if len(keys) > 1:
             result = [(key in found_keys) for key in keys]
         else:
             result = keys[0] in found_keys
         return result
 
+    def _found(self, keys):
+        """returns the keys of the stored entities"""
+        table = self._wide
+        if table is not None:
+            return table.exists(keys)
+        slots = (','.join(['%s']*len(keys)))
+        cmd = (
+            'select distinct row_id '
+            'from %s '
+            'where row_id in (%s)'
+            ) % (self.partition.attributes, slots)
+        rs = self.db(cmd, *keys)
+        return [rec[0] for rec in rs]
+
     def all(self):
         """
         Retrieves all entities
@@ -538,8 +1498,15 @@ class EntityStore(object):
             >>> db.close()
 
         """
-        cmd = 'select * from attributes where kind="%s"' % (self.kind)
-        return entify(self.db(cmd), self.klass)
+        table = self._wide
+        if table is not None:
+            return self._identify(table.all(self.klass, self.fields))
+        attributes = self.partition.attributes
+        if self.fields is not None:
+            cmd = 'select distinct row_id from {} where kind=%s'
+            return self._join(cmd.format(attributes), [self.kind])
+        cmd = 'select * from %s where kind="%s"' % (attributes, self.kind)
+        return self._identify(entify(self.db(cmd), self.klass, self.kind))
 
     def zap(self):
         """
@@ -560,10 +1527,23 @@ class EntityStore(object):
             >>> db.close()
 
         """
-        cmd = 'delete from attributes where kind=%s'
-        self.db(cmd, self.kind)
-        cmd = 'delete from entities where kind=%s'
-        self.db(cmd, self.kind)
+        partition = self.partition
+        cmd = 'delete from {} where kind=%s'
+        self.db(cmd.format(partition.attributes), self.kind)
+        self.db(cmd.format(partition.entities), self.kind)
+        table = self.table
+        if table is not None:
+            table.clear()
+        if self.catalog is not None:
+            self.catalog.clear()
+        if self.log_changes:
+            zoom.changes.log(self.db, self.kind, 'zap', [(None, None)])
+        if self.searchable:
+            self.index.clear()
+        if self.typed_index:
+            self.db('delete from typed_attributes where kind=%s', self.kind)
+        if self.identity_map is not None:
+            self.identity_map.clear(self.kind)
 
     def __len__(self):
         """
@@ -582,36 +1562,357 @@ class EntityStore(object):
             >>> db.close()
 
         """
-        cmd = ('select count(*) n from '
-               '(select distinct row_id from attributes where kind=%s) a')
-        r = self.db(cmd, self.kind)
-        return int(list(r)[0][0])
+        catalog = self.catalog
+        if catalog is not None:
+            return len(catalog)
+        return self._count()
+
+    def _finder(self, kv, descending=False, limit=None, order_by=None):
+        """
+        Compile search criteria into a single statement
+
+        Returns a statement and parameters that select the matching
+        row_ids in row_id order, or None if no entity can match.  Each
+        criterion selects one attribute row so an entity matches when it
+        has as many matching rows as there are criteria.  Numeric and
+        date ranges are selected from the typed index when the store
+        keeps one and are joined to the other criteria.
+        """
+        table = self._wide
+        if table is not None:
+            return table.finder(kv, descending, limit, order_by)
+
+        def literal(value):
+            # the kv index covers text values so compare ints as text
+            if isinstance(value, (int, long)) and not isinstance(value, bool):
+                return str(value)
+            return value
+
+        clauses = []
+        params = [self.kind]
+        ranges = []
+        for name, value in kv.items():
+            name = name.lower()
+            if isinstance(value, zoom.expressions.Equal):
+                value = value.value
+            elif isinstance(value, zoom.expressions.Occurs):
+                value = list(value.value)
+            if value is None:
+                continue
+            if isinstance(value, zoom.expressions.SearchTerm):
+                operand = value.value
+                column = typed_column(operand)
+                if column and self.typed_index:
+                    ranges.append((name, column, value.operator, operand))
+                    continue
+                elif column == 'number':
+                    clause = '(attribute=%s and cast(value as {}){}%s)'.format(
+                        NUMERIC, value.operator)
+                    operand = fixval(operand)
+                else:
+                    clause = '(attribute=%s and value{}%s)'.format(
+                        value.operator)
+                    operand = literal(fixval(operand))
+                clauses.append(clause)
+                params.extend([name, operand])
+            elif isinstance(value, (list, tuple)):
+                if not value:
+                    return None
+                clauses.append('(attribute=%s and value in ({}))'.format(
+                    ','.join(['%s'] * len(value))
+                ))
+                params.append(name)
+                params.extend(literal(v) for v in value)
+            else:
+                clauses.append('(attribute=%s and value=%s)')
+                params.extend([name, literal(value)])
+
+        if not (clauses or ranges):
+            return None
+
+        sources = []
+        conditions = []
+        where = []
+        if clauses:
+            sources.append((
+                '(select row_id from {} '
+                'where kind=%s and ({}) '
+                'group by row_id having count(distinct attribute)={})'
+            ).format(
+                self.partition.attributes, ' or '.join(clauses), len(clauses)
+            ))
+        else:
+            params = []
+        for name, column, operator, operand in ranges:
+            alias = 't{}'.format(len(sources))
+            sources.append('typed_attributes')
+            conditions.append(
+                '{0}.kind=%s and {0}.attribute=%s and {0}.{1}{2}%s'.format(
+                    alias, column, operator)
+            )
+            where.extend([self.kind, name, typed_value(operand)])
+
+        cmd = 'select t0.row_id from {} t0'.format(sources[0])
+        for n, source in enumerate(sources[1:], 1):
+            cmd += ' join {0} t{1} on t{1}.row_id=t0.row_id'.format(source, n)
+        if conditions:
+            cmd += ' where ' + ' and '.join(conditions)
+        params.extend(where)
+
+        direction = descending and ' desc' or ''
+        if order_by:
+            if order_by.startswith('-'):
+                direction = ' desc'
+            cmd = (
+                'select f.row_id, '
+                'case when s.datatype in ({numbers}) '
+                'then cast(s.value as {numeric}) end as number, '
+                's.value as value '
+                'from ({cmd}) f '
+                'left join {attributes} s on s.row_id=f.row_id '
+                'and s.kind=%s and s.attribute=%s '
+                'order by number{d}, value{d}, f.row_id{d}'
+            ).format(
+                attributes=self.partition.attributes,
+                numbers=','.join(repr(t) for t in NUMBER_TYPES),
+                numeric=NUMERIC,
+                cmd=cmd,
+                d=direction,
+            )
+            params.extend([self.kind, order_by.lstrip('-').lower()])
+        else:
+            cmd += ' order by t0.row_id{}'.format(direction)
+
+        if limit is not None:
+            cmd += ' limit {:d}'.format(limit)
+        return cmd, params
 
     def _find(self, **kv):
         """
         Find keys that meet search critieria
         """
-        db = self.db
-        all_keys = []
-        for field_name in kv.keys():
-            value = kv[field_name]
-            if value is not None:
-                if not isinstance(value, (list, tuple)):
-                    wc = 'value=%s'
-                    v = (value,)
+        finder = self._finder(kv)
+        if finder is None:
+            return []
+        cmd, params = finder
+        return [rec[0] for rec in self.db(cmd, *params)]
+
+    def _fetch(self, kv, descending=False, limit=None, order_by=None):
+        """
+        Find entities that meet search criteria in one statement
+        """
+        finder = self._finder(kv, descending, limit, order_by)
+        if finder is None:
+            return EntityList()
+        cmd, params = finder
+        if order_by:
+            direction = order_by.startswith('-') and ' desc' or ''
+            order = 'f.number{0}, f.value{0}, f.row_id{0}'.format(direction)
+        else:
+            order = descending and 'f.row_id desc'
+        return self._join(cmd, params, order)
+
+    def _join(self, cmd, params, order=None):
+        """
+        Fetch the entities selected by a row_id statement
+
+        The attributes are fetched through a join on the statement so
+        selecting and fetching the entities takes one round trip.
+        """
+        table = self._wide
+        if table is not None:
+            return self._identify(
+                table.join(cmd, params, order, self.klass, self.fields)
+            )
+        attributes = self.partition.attributes
+        if self.fields is not None:
+            # entities without any of the fields still come back, by id
+            fields = self.fields
+            cmd = (
+                'select a.id, a.kind, f.row_id, a.attribute, a.datatype, a.value '
+                'from ({}) f '
+                'left join {} a on a.row_id=f.row_id '
+                'and a.kind=%s and {} '
+                'order by {}, a.id'
+            ).format(
+                cmd,
+                attributes,
+                fields and 'a.attribute in ({})'.format(
+                    ','.join(['%s'] * len(fields))) or '0=1',
+                order or 'f.row_id',
+            )
+            params = list(params) + [self.kind] + list(fields)
+        else:
+            cmd = (
+                'select a.* from {} a '
+                'join ({}) f on f.row_id=a.row_id '
+                'where a.kind=%s '
+                'order by {}, a.id'
+            ).format(attributes, cmd, order or 'f.row_id')
+            params = list(params) + [self.kind]
+        rs = self.db(cmd, *params)
+        return self._identify(entify(rs, self.klass, self.kind))
+
+    def page(self, after=None, size=50, order_by=None):
+        """
+        return a page of entities and a continuation token
+
+        Pages are selected by key rather than by position so each page
+        costs the same regardless of how deep into the kind it is.  Pass
+        the returned token as after to get the next page.  The token is
+        None when there are no more entities.
+
+        Entities are ordered by id unless order_by names an attribute
+        (prefixed with - for descending order), in which case only the
+        entities that have that attribute are paged, in order of its
+        stored value.
+
+            >>> db = setup_test()
+            >>> class Person(Entity): pass
+            >>> class People(EntityStore): pass
+            >>> people = People(db, Person)
+            >>> for name in ['Sam', 'Sally', 'Bob', 'Ann', 'Joe']:
+            ...     id = people.put(Person(name=name))
+            >>> page, token = people.page(size=2)
+            >>> page
+            [<Person {'name': 'Sam'}>, <Person {'name': 'Sally'}>]
+            >>> token
+            2L
+            >>> page, token = people.page(token, size=2)
+            >>> page
+            [<Person {'name': 'Bob'}>, <Person {'name': 'Ann'}>]
+            >>> page, token = people.page(token, size=2)
+            >>> page, token
+            ([<Person {'name': 'Joe'}>], None)
+
+            >>> page, token = people.page(size=3, order_by='name')
+            >>> page
+            [<Person {'name': 'Ann'}>, <Person {'name': 'Bob'}>, <Person {'name': 'Joe'}>]
+            >>> token
+            ('Joe', 5L)
+            >>> people.page(token, size=3, order_by='name')
+            ([<Person {'name': 'Sally'}>, <Person {'name': 'Sam'}>], None)
+            >>> people.page(size=2, order_by='-name')[0]
+            [<Person {'name': 'Sam'}>, <Person {'name': 'Sally'}>]
+
+            >>> for name, age in [('Sam', 9), ('Sally', 10), ('Bob', 100)]:
+            ...     person = people.first(name=name)
+            ...     person.age = age
+            ...     id = people.put(person)
+            >>> page, token = people.page(size=2, order_by='age')
+            >>> [p.name for p in page], token
+            (['Sam', 'Sally'], (10, 2L))
+            >>> [p.name for p in people.page(token, size=2, order_by='age')[0]]
+            ['Bob']
+
+            >>> db.close()
+
+        """
+        size = int(size)
+        table = self._wide
+        if table is not None:
+            cmd, params, order = table.pager(after, size, order_by)
+            attribute = order_by and order_by.lstrip('-').lower()
+        elif order_by:
+            descending = order_by.startswith('-')
+            attribute = order_by.lstrip('-').lower()
+            op, direction = descending and ('<', ' desc') or ('>', '')
+            numbers = ','.join(repr(t) for t in NUMBER_TYPES)
+            number = 'case when datatype in ({}) then cast(value as {}) end'.format(
+                numbers, NUMERIC)
+            cmd = (
+                'select row_id, {} as number, value from {} '
+                'where kind=%s and attribute=%s'
+            ).format(number, self.partition.attributes)
+            params = [self.kind, attribute]
+            if after is not None:
+                # numbers sort after text values, and by number
+                value, row_id = after
+                if is_number(value):
+                    key = '{0}{1}%s or ({0}=%s and row_id{1}%s)'.format(
+                        number, op)
+                    beyond = descending and 'datatype not in ({0})'
                 else:
-                    wc = 'value in ('+','.join(['%s']*len(value))+')'
-                    v = value
-                cmd = 'select distinct row_id from attributes where kind=%s and attribute=%s and '+wc
-                rs = db(cmd, self.kind, field_name.lower(), *v)
-                all_keys.append([rec[0] for rec in rs])
-        answer = all_keys and set(all_keys[0]) or set()
-        for keys in all_keys[1:]:
-            answer = set(keys) & answer
-        if answer:
-            return list(answer)
+                    key = (
+                        'datatype not in ({{0}}) and '
+                        '(value{0}%s or (value=%s and row_id{0}%s))'
+                    ).format(op)
+                    beyond = not descending and 'datatype in ({0})'
+                if beyond:
+                    key += ' or ' + beyond
+                cmd += ' and ({})'.format(key.format(numbers))
+                params.extend([value, value, row_id])
+            cmd += ' order by number{0}, value{0}, row_id{0} limit {1:d}'.format(
+                direction, size)
+            order = 'f.number{0}, f.value{0}, f.row_id{0}'.format(direction)
         else:
-            return []
+            cmd = 'select distinct row_id from {} where kind=%s'.format(
+                self.partition.attributes)
+            params = [self.kind]
+            if after is not None:
+                cmd += ' and row_id>%s'
+                params.append(after)
+            cmd += ' order by row_id limit {:d}'.format(size)
+            order = None
+
+        entities = self._join(cmd, params, order)
+
+        token = None
+        if size and len(entities) == size:
+            last = entities[-1]
+            if order_by:
+                token = last.get(attribute, None), last['_id']
+                if attribute not in last and table is not None:
+                    token = table.value(last['_id'], attribute), token[1]
+                elif table is None and not (
+                        type(token[0]) in [str, unicode] or is_number(token[0])):
+                    token = self._stored_value(last['_id'], attribute), token[1]
+            else:
+                token = last['_id']
+        return entities, token
+
+    def _stored_value(self, row_id, attribute):
+        """return the value of an attribute as it is stored"""
+        cmd = (
+            'select value from {} '
+            'where kind=%s and row_id=%s and attribute=%s'
+        ).format(self.partition.attributes)
+        for rec in self.db(cmd, self.kind, row_id, attribute):
+            return rec[0]
+
+    def _slice(self, offset, limit):
+        """return entities by position using a single statement"""
+        table = self._wide
+        if table is not None:
+            return self._join(table.slicer(offset, limit), [])
+        cmd = (
+            'select distinct row_id from {} '
+            'where kind=%s order by row_id limit {:d} offset {:d}'
+        ).format(self.partition.attributes, limit, offset)
+        return self._join(cmd, [self.kind])
+
+    def stream(self, size=500):
+        """
+        iterate through all entities fetching them in chunks of size
+
+            >>> db = setup_test()
+            >>> class Person(Entity): pass
+            >>> class People(EntityStore): pass
+            >>> people = People(db, Person)
+            >>> for name in ['Sam', 'Sally', 'Bob']:
+            ...     id = people.put(Person(name=name))
+            >>> [person.name for person in people.stream(2)]
+            ['Sam', 'Sally', 'Bob']
+            >>> db.close()
+
+        """
+        token = None
+        while True:
+            entities, token = self.page(token, size)
+            for entity in entities:
+                yield entity
+            if token is None:
+                break
 
     def find(self, **kv):
         """
@@ -636,10 +1937,99 @@ class EntityStore(object):
             >>> len(people.find(name='Sam'))
             1
 
+            >>> print people.find(name=['Sam', 'Sally'], age=25)
+            person
+            _id name age
+            --- ---- ---
+              1 Sam   25
+            1 person records
+
+            >>> people.find(name='Sam', age=55)
+            []
+
+        Criteria can be expressions from zoom.expressions and results
+        can be ordered by an attribute, descending if it starts with '-'.
+
+            >>> from zoom.expressions import lt, gte, ne
+            >>> people.find(age=gte(30))
+            [<Person {'name': 'Sally', 'age': 55}>]
+            >>> people.find(age=lt(30), name=ne('Sam'))
+            [<Person {'name': 'Bob', 'age': 25}>]
+            >>> [p.name for p in people.find(age=lt(100), order_by='-age')]
+            ['Sally', 'Bob', 'Sam']
+
+        Stores that keep a typed index select number and date ranges
+        through it.
+
+            >>> people.typed_index = True
+            >>> people.reindex()
+            3
+            >>> id = people.put(Person(name='Ann', age=9))
+            >>> [p.name for p in people.find(age=lt(30), order_by='age')]
+            ['Ann', 'Sam', 'Bob']
+            >>> ann = people.get(id)
+            >>> ann.age = 40
+            >>> people.put(ann)
+            4L
+            >>> [p.name for p in people.find(age=gte(30), order_by='name')]
+            ['Ann', 'Sally']
+            >>> people.find(age=gte(30), name='Ann', order_by='name')
+            [<Person {'name': 'Ann', 'age': 40}>]
+
+        Only the attributes named in fields are read if it is given (see
+        only).
+
+            >>> people.find(age=gte(30), fields=['name'])
+            [<Person {'name': 'Sally'}>, <Person {'name': 'Ann'}>]
+
             >>> db.close()
 
         """
-        return self.get(self._find(**kv))
+        order_by = kv.pop('order_by', None)
+        fields = kv.pop('fields', None)
+        if fields is not None:
+            return self.only(*fields)._fetch(kv, order_by=order_by)
+        return self._fetch(kv, order_by=order_by)
+
+    def only(self, *fields):
+        """
+        returns a view of the store that reads only the named attributes
+
+        Entities read through the view are partial.  They have their _id
+        and whichever of the fields they hold, and they can't be put
+        since that would lose the attributes that were not read.
+
+            >>> db = setup_test()
+            >>> class Person(Entity): pass
+            >>> people = EntityStore(db, Person)
+            >>> people.put_many([
+            ...     Person(name='Sam', age=25, photo='x' * 1000),
+            ...     Person(age=55, photo='y' * 1000),
+            ... ])
+            [1L, 2L]
+            >>> names = people.only('name')
+            >>> names.all()
+            [<Person {'name': 'Sam'}>, <Person {}>]
+            >>> names.get(2)['_id']
+            2L
+            >>> older = names.find(age=zoom.expressions.gte(20), order_by='-age')
+            >>> [p.get('name', None) for p in older]
+            [None, 'Sam']
+            >>> sam = names.first(age=25)
+            >>> sam.age = 26
+            >>> people.put(sam)
+            Traceback (most recent call last):
+            ...
+            PartialException: person 1 was read with only name so putting it would lose its other attributes; get it in full to change it
+            >>> people.get(1).photo == 'x' * 1000
+            True
+            >>> db.close()
+
+        """
+        view = copy.copy(self)
+        view.fields = [field.lower() for field in fields]
+        view.klass = partial_class(self.klass)
+        return view
 
     def first(self, **kv):
         """
@@ -655,10 +2045,12 @@ class EntityStore(object):
             >>> people.first(age=5)
             >>> people.first(age=25)
             <Person {'name': 'Sam', 'age': 25}>
+            >>> people.first(age=25, name='Bob')
+            <Person {'name': 'Bob', 'age': 25}>
             >>> db.close()
 
         """
-        for item in self.find(**kv):
+        for item in self._fetch(kv, limit=1):
             return item
 
     def last(self, **kv):
@@ -678,12 +2070,121 @@ class EntityStore(object):
             >>> db.close()
 
         """
-        rows = self._find(**kv)
-        if rows:
-            return self.get(rows[-1])
-        return None
+        for item in self._fetch(kv, descending=True, limit=1):
+            return item
+
+    def aggregate(self, group_by=None, count=False, where=None,
+                  sum=None, avg=None, min=None, max=None):
+        """
+        compute aggregates of the entities in one statement
+
+        Entities can be grouped by one or more attributes and are
+        counted, and have the attributes named by sum, avg, min and max
+        aggregated, in each group.  The entities can be selected with
+        the same criteria as find.  Returns a Record for each group, in
+        order of the group values.
+
+            >>> db = setup_test()
+            >>> people = EntityStore(db, 'person')
+            >>> people.put_many([
+            ...     dict(name='Sam', team='red', age=25, pay=decimal.Decimal('10.50')),
+            ...     dict(name='Sally', team='blue', age=55, pay=decimal.Decimal('20')),
+            ...     dict(name='Bob', team='red', age=9),
+            ... ])
+            [1L, 2L, 3L]
+            >>> row = people.aggregate(count=True, sum='age')[0]
+            >>> row.count, row.sum_age
+            (3, 89)
+            >>> for row in people.aggregate('team', count=True, sum=['age', 'pay']):
+            ...     print row.team, row.count, row.sum_age, row.sum_pay
+            blue 1 55 20
+            red 2 34 10.5
+            >>> rows = people.aggregate(['team'], min='name', max='age',
+            ...     where=dict(age=zoom.expressions.lt(30)))
+            >>> [(row.team, row.min_name, row.max_age) for row in rows]
+            [('red', 'Bob', 25)]
+            >>> people.aggregate('team', avg='age', where=dict(name=[]))
+            []
+            >>> db.close()
 
-    def search(self, text):
+        """
+        groups = [name.lower() for name in listed(group_by)]
+        measures = [
+            (function, name.lower())
+            for function, names in zip(AGGREGATES, [sum, avg, min, max])
+            for name in listed(names)
+        ]
+        names = []
+        for name in groups + [name for _, name in measures]:
+            if name not in names:
+                names.append(name)
+
+        table = self._wide
+        attributes = self.partition.attributes
+        if where:
+            finder = self._finder(dict(where))
+            if finder is None:
+                finder = 'select row_id from {} where 0=1'.format(attributes), []
+            source, params = finder
+        elif table is not None:
+            source = 'select _id as row_id from {}'.format(
+                zoom.materialize.quote(table.name))
+            params = []
+        else:
+            source = 'select distinct row_id from {} where kind=%s'.format(
+                attributes)
+            params = [self.kind]
+
+        if table is not None:
+            return table.aggregate(source, params, groups, count, measures)
+
+        aliases = dict((name, 'a{}'.format(n)) for n, name in enumerate(names))
+        columns = []
+        for name in groups:
+            columns.append('{0}.value, max({0}.datatype)'.format(aliases[name]))
+        if count:
+            columns.append('count(*)')
+        for function, name in measures:
+            columns.append(
+                '{0}(cast({1}.value as {2})), {0}({1}.value), '
+                'group_concat(distinct {1}.datatype)'.format(
+                    function, aliases[name], NUMERIC)
+            )
+        cmd = 'select {} from ({}) f'.format(', '.join(columns), source)
+        for name in names:
+            cmd += (
+                ' left join {1} {0} on {0}.row_id=f.row_id '
+                'and {0}.kind=%s and {0}.attribute=%s'
+            ).format(aliases[name], attributes)
+            params.extend([self.kind, name])
+        if groups:
+            cmd += ' group by ' + ', '.join(
+                aliases[name] + '.value' for name in groups)
+
+        rows = []
+        for rec in self.db(cmd, *params):
+            values = iter(rec)
+            row = zoom.utils.Record()
+            for name in groups:
+                value, datatype = next(values), next(values)
+                row[name] = decoded(value, datatype)
+            if count:
+                row['count'] = int(next(values))
+            for function, name in measures:
+                number, value, datatypes = next(values), next(values), next(values)
+                datatypes = (datatypes or '').split(',')
+                label = function + '_' + name
+                if function in ['sum', 'avg'] or set(datatypes) <= set(NUMBER_TYPES):
+                    row[label] = measured(function, number, datatypes)
+                else:
+                    row[label] = decoded(value, datatypes[0])
+            rows.append(row)
+
+        return EntityList(sorted(
+            rows, key=lambda row: [row[name] for name in groups]
+        ))
+
+    def search(self, text, rank=False, limit=None):
         """
         search for entities that match text
 
@@ -708,14 +2209,87 @@ class EntityStore(object):
 
             >>> list(people.search('Bill'))
             []
+            >>> [p.name for p in people.search(25, limit=1)]
+            ['Sam']
+
+        Searchable stores look up the words of the text in their search
+        index.  Every word has to match the beginning of a stored word.
+
+            >>> db = setup_test()
+            >>> people.searchable = True
+            >>> id = people.put(Person(name='Sam Adam Jones', age=25))
+            >>> id = people.put(Person(name='Sally Mary Smith', age=55))
+            >>> id = people.put(Person(name='Bob Marvin Smith', age=25))
+            >>> list(people.search('bo smi'))
+            [<Person {'name': 'Bob Marvin Smith', 'age': 25}>]
+            >>> [p.name for p in people.search('smi')]
+            ['Sally Mary Smith', 'Bob Marvin Smith']
+            >>> bob = people.first(name='Bob Marvin Smith')
+            >>> bob.name = 'Bob Marvin Smith-Smith'
+            >>> people.put(bob)
+            3L
+            >>> [p.name for p in people.search('smith', rank=True)]
+            ['Bob Marvin Smith-Smith', 'Sally Mary Smith']
+            >>> people.delete(bob)
+            [3L]
+            >>> [p.name for p in people.search('smi')]
+            ['Sally Mary Smith']
             >>> db.close()
 
         """
-        t = unicode(text).lower()
-        for rec in self:
-            if t in repr(rec.values()).lower():
+        if self.searchable:
+            query = self.index.query(text, rank, limit)
+            if query:
+                cmd, params = query
+                order = rank and 'f.score desc, f.row_id' or None
+                for rec in self._join(cmd, params, order):
+                    yield rec
+
+        else:
+            t = unicode(text).lower()
+            matches = (rec for rec in self if t in repr(rec.values()).lower())
+            for rec in itertools.islice(matches, limit):
                 yield rec
 
+    def reindex(self):
+        """
+        rebuild the indexes the store keeps from the stored entities
+
+            >>> db = setup_test()
+            >>> class Person(Entity): pass
+            >>> people = EntityStore(db, Person)
+            >>> id = people.put(Person(name='Sam', age=25))
+            >>> id = people.put(Person(name='Sally', age=55))
+            >>> people.searchable = True
+            >>> list(people.search('sally'))
+            []
+            >>> people.reindex()
+            2
+            >>> list(people.search('sally'))
+            [<Person {'name': 'Sally', 'age': 55}>]
+            >>> people.typed_index = True
+            >>> people.find(age=zoom.expressions.gt(30))
+            []
+            >>> people.reindex()
+            2
+            >>> people.find(age=zoom.expressions.gt(30))
+            [<Person {'name': 'Sally', 'age': 55}>]
+            >>> db.close()
+
+        """
+        def indexed():
+            for entity in self.stream():
+                pairs = [(k, v) for k, v in entity.items() if k != '_id']
+                if self.typed_index:
+                    self._retype(entity['_id'], pairs, [])
+                yield entity['_id'], [v for _, v in pairs]
+
+        if self.typed_index:
+            self.db('delete from typed_attributes where kind=%s', self.kind)
+        if self.searchable:
+            return self.index.rebuild(indexed())
+        return sum(1 for _ in indexed())
+
     def __iter__(self):
         """
         interates through records
@@ -740,8 +2314,11 @@ class EntityStore(object):
             >>> sum(person.age for person in people)
             105
 
+        Entities are streamed in chunks (see stream) rather than read
+        into a list up front, so each pass through the store queries it
+        again.  Use all() for a list.
         """
-        return self.all()
+        return self.stream()
 
     def __getitem__(self, key):
         """
@@ -776,6 +2353,15 @@ class EntityStore(object):
             >>> people[1:-1]
             [<Person {'name': 'Sally', 'age': 55}>]
 
+            >>> people[1:]
+            [<Person {'name': 'Sally', 'age': 55}>, <Person {'name': 'Bob', 'age': 25}>]
+
+            >>> people[-2:]
+            [<Person {'name': 'Sally', 'age': 55}>, <Person {'name': 'Bob', 'age': 25}>]
+
+            >>> people[5:10]
+            []
+
             >>> try:
             ...     people[3]
             ... except IndexError, e:
@@ -785,27 +2371,31 @@ class EntityStore(object):
             >>> db.close()
 
         """
-        n = len(self)
         if isinstance(key, slice):
-            # get the start, stop, and step from the slice
-            start, stop, step = key.indices(n)
-            return [self[ii] for ii in xrange(start, stop, step)]
-        elif isinstance(key, int):
+            start, stop, step = key.start, key.stop, key.step or 1
+            if all(i is None or i >= 0 for i in (start, stop)) and step > 0:
+                # positions known up front so one statement will do
+                start = start or 0
+                if stop is None:
+                    return self._slice(start, MAX_ROWS)[::step]
+                if stop <= start:
+                    return EntityList()
+                return self._slice(start, stop - start)[::step]
+            start, stop, step = key.indices(len(self))
+            if step > 0:
+                if stop <= start:
+                    return EntityList()
+                return self._slice(start, stop - start)[::step]
+            if start <= stop:
+                return EntityList()
+            return self._slice(stop + 1, start - stop)[::-1][::-step]
+        elif isinstance(key, (int, long)):
             if key < 0:
-                key += n
-            elif key >= n:
+                key += len(self)
+            entities = key >= 0 and self._slice(key, 1)
+            if not entities:
                 raise IndexError('Index ({}) out of range'.format(key))
-            cmd = (
-                'select distinct row_id '
-                'from attributes '
-                'where kind="%s" '
-                'limit %s,1'
-                ) % (self.kind, key)
-            rs = self.db(cmd)
-            if rs:
-                return self.get(list(rs)[0][0])
-            else:
-                return 'no records'
+            return entities[0]
         else:
             raise TypeError('Invalid argument type')
 
@@ -147,6 +147,7 @@ class System(object):
         self.templates = None
         self.helpers = None
         self.db_debug = False
+        self.identity_map = None
         self.themes_path = None
         self.logging = False
         self.queues = None
@@ -175,6 +176,9 @@ class System(object):
     def release(self):
         """release allocated system resources"""
         if self.is_setup:
+            if self.identity_map is not None:
+                self.identity_map.clear()
+                self.identity_map = None
             self.db.close()
             self.database.close()
 
@@ -240,9 +244,25 @@ class System(object):
         self.db.debug = self.db_debug
         self.database.debug = self.db_debug
 
-        # message queues
+        # per-request identity map shared by the stores
+        if config.get('database', 'identity_map', '0') not in NEGATIVE:
+            from zoom.identity import IdentityMap
+            self.identity_map = IdentityMap()
+            self.db.identity_map = self.identity_map
+            self.database.identity_map = self.identity_map
+
+        # catalog of entity kinds kept up to date by the stores
+        if config.get('database', 'catalog', '0') not in NEGATIVE:
+            import zoom.catalog
+            zoom.catalog.enable(self.db)
+
+        # message queues, waking consumers through the notifier
         from zoom.queues import Queues
-        self.queues = Queues(self.db)
+        from zoom.notifiers import notifier
+        self.queues = Queues(self.db, notifier(
+            config.get('queues', 'notifier', 'local'),
+            config.get('queues', 'path', None),
+        ))
 
         from zoom.store import EntityStore
         settings_store = EntityStore(self.database, settings.SystemSettings)
@@ -0,0 +1,191 @@
+"""
+    zoom.workers
+
+    queue worker pools
+
+    A Pool handles the messages of a topic in a number of processes.
+    Each worker claims one message at a time and only removes it once
+    the handler has returned, so the message of a worker that crashes
+    or stalls is delivered again when its claim times out.  A handler
+    that raises has its message put back after a delay that doubles
+    with every attempt, and a message that has failed max_attempts
+    times is moved to the dead-letter topic of its topic for someone
+    to look into.
+
+    Delivery is at least once: a handler that outlives the claim
+    timeout can see its message handled twice.
+
+    Workers make their own database connections with the connect
+    function they are given and check for layout changes made by other
+    connections before each message (see zoom.layouts).
+
+        pool = Pool(connect, 'mail', send_message, processes=4)
+        pool.run()
+
+"""
+
+import logging
+import multiprocessing
+import time
+
+import zoom.layouts
+from zoom.queues import Queues, StopHandling, START, VISIBILITY
+from zoom.retention import Sweeper
+
+logger = logging.getLogger('zoom.workers')
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 10
+
+
+def setup_test():
+    from zoom.queues import setup_test
+    return setup_test().db
+
+
+def backoff(attempts, delay=RETRY_DELAY):
+    """returns the seconds to wait before the next attempt
+
+        >>> [backoff(n, 10) for n in range(1, 5)]
+        [10, 20, 40, 80]
+
+    """
+    return delay * 2 ** (attempts - 1)
+
+
+class Pool(object):
+    """
+    handles the messages of a topic in worker processes
+
+        >>> db = setup_test()
+        >>> jobs = Queues(db).topic('jobs')
+        >>> jobs.send(2, 0, 5)
+        [1L, 2L, 3L]
+        >>> pool = Pool(None, 'jobs', lambda n: 10 / n, max_attempts=2,
+        ...             retry_delay=0)
+        >>> pool.work(db, timeout=0.2)
+        2
+        >>> Queues(db).join([3])
+        [2]
+        >>> Queues(db).topic('jobs.dead', START).pop()
+        0
+
+    """
+
+    def __init__(
+            self,
+            connect,
+            topic,
+            handler,
+            processes=2,
+            timeout=VISIBILITY,
+            max_attempts=MAX_ATTEMPTS,
+            retry_delay=RETRY_DELAY,
+            notifier=None,
+            sweep_interval=None,
+    ):
+        self.connect = connect
+        self.topic = topic
+        self.handler = handler
+        self.processes = processes
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.notifier = notifier
+        self.sweep_interval = sweep_interval
+
+    def deliver(self, topic, delivery):
+        """
+        handle a claimed message, returning True if it was handled
+
+        The response is sent and the message removed once the handler
+        returns.  If it raises the message is retried or, after
+        max_attempts, moved to the dead-letter topic.
+        """
+        try:
+            result = self.handler(delivery.message)
+        except StopHandling:
+            topic.acknowledge(delivery)
+            raise
+        except Exception:
+            if delivery.attempts >= self.max_attempts:
+                logger.exception(
+                    'message %s of %r failed %s times, giving up',
+                    delivery.id, delivery.topic, delivery.attempts)
+                topic.dead_letter(delivery)
+            else:
+                logger.exception(
+                    'message %s of %r failed, retrying',
+                    delivery.id, delivery.topic)
+                topic.retry(
+                    delivery, backoff(delivery.attempts, self.retry_delay))
+            return False
+        topic.respond(delivery.id, result)
+        topic.acknowledge(delivery)
+        return True
+
+    def work(self, db=None, timeout=0):
+        """
+        handle messages in this process
+
+        Runs until the handler raises StopHandling or, given a timeout,
+        until the topic has been idle for timeout seconds.  Returns the
+        number of messages handled.
+        """
+        db = db or self.connect()
+        topic = Queues(db, self.notifier).topic(self.topic, START)
+        n = 0
+        deadline = timeout and time.time() + timeout
+        with topic.notifier.listen(self.topic) as listener:
+            while True:
+                deliveries = topic.claim(1, self.timeout)
+                if deliveries:
+                    zoom.layouts.check(db)
+                    try:
+                        n += self.deliver(topic, deliveries[0])
+                    except StopHandling:
+                        return n
+                    deadline = timeout and time.time() + timeout
+                    listener.reset()
+                elif not topic.redeliver():
+                    if timeout and time.time() >= deadline:
+                        return n
+                    listener.wait(timeout and deadline - time.time() or None)
+
+    def _start(self, timeout):
+        process = multiprocessing.Process(
+            target=self.work, kwargs=dict(timeout=timeout))
+        process.start()
+        return process
+
+    def run(self, timeout=0):
+        """
+        run the workers, each in a process of its own
+
+        Workers that die are replaced.  Returns when the workers have
+        all stopped, which they only do given a timeout or when the
+        handler raises StopHandling.  Given a sweep_interval the pool
+        also enforces the queue retention policies (see zoom.retention).
+        """
+        sweeper = None
+        if self.sweep_interval:
+            sweeper = Sweeper(self.connect, self.sweep_interval)
+            sweeper.start()
+        workers = [self._start(timeout) for _ in range(self.processes)]
+        try:
+            while workers:
+                workers[0].join(1)
+                for process in list(workers):
+                    if not process.is_alive():
+                        workers.remove(process)
+                        if process.exitcode:
+                            logger.warning(
+                                'worker %s on %r died (exit code %s)',
+                                process.pid, self.topic, process.exitcode)
+                            workers.append(self._start(timeout))
+        except KeyboardInterrupt:
+            for process in workers:
+                process.terminate()
+        finally:
+            if sweeper is not None:
+                sweeper.stop()